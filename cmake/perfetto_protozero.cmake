@@ -0,0 +1,123 @@
+# perfetto_generate_pbzero(TARGET <target> PROTOS <file>...
+#                          [PROTO_ROOT <dir>] [IMPORT_DIRS <dir>...]
+#                          [OUTPUT_DIR <dir>] [BATCH_SIZE <n>])
+#
+# Generates protozero (.pbzero.h/.pbzero.cc) sources with protoc and protozero_plugin
+# from the perfetto package and adds them to TARGET.
+#
+# - PROTO_ROOT: import root of PROTOS, outputs are placed into OUTPUT_DIR
+#   by path relative to PROTO_ROOT (default: CMAKE_CURRENT_SOURCE_DIR)
+# - IMPORT_DIRS: additional -I dirs, `protos` dir of the package is always added
+# - OUTPUT_DIR: default is ${CMAKE_CURRENT_BINARY_DIR}/pbzero, added to include dirs of TARGET
+# - BATCH_SIZE: protos per protoc invocation, by default PROTOS are split
+#   into one batch per logical core. Batches are independent build steps, so they run in parallel.
+#
+# protoc is skipped if SHA256 of PROTOS and generator binaries did not change
+# (i.e. after git checkout that only touched mtimes) and generated files
+# are replaced only if their content differs, so dependent sources are not recompiled.
+#
+# protoc and protozero_plugin are taken from PERFETTO_PROTOC_BIN and PERFETTO_protozero_plugin_BIN
+# if set, otherwise from bin/ of the perfetto package.
+
+set(_PERFETTO_PROTOZERO_MODULE_DIR "${CMAKE_CURRENT_LIST_DIR}")
+# NOTE: module is packaged into lib/cmake/perfetto
+get_filename_component(_PERFETTO_PROTOZERO_PACKAGE_DIR "${CMAKE_CURRENT_LIST_DIR}/../../.." ABSOLUTE)
+
+function(perfetto_generate_pbzero)
+  cmake_parse_arguments(ARG "" "TARGET;PROTO_ROOT;OUTPUT_DIR;BATCH_SIZE" "PROTOS;IMPORT_DIRS" ${ARGN})
+  if(NOT ARG_TARGET OR NOT TARGET ${ARG_TARGET})
+    message(FATAL_ERROR "perfetto_generate_pbzero: TARGET must be an existing target, got '${ARG_TARGET}'")
+  endif()
+  if(NOT ARG_PROTOS)
+    message(FATAL_ERROR "perfetto_generate_pbzero: PROTOS is empty")
+  endif()
+  if(NOT ARG_PROTO_ROOT)
+    set(ARG_PROTO_ROOT "${CMAKE_CURRENT_SOURCE_DIR}")
+  endif()
+  get_filename_component(ARG_PROTO_ROOT "${ARG_PROTO_ROOT}" ABSOLUTE)
+  if(NOT ARG_OUTPUT_DIR)
+    set(ARG_OUTPUT_DIR "${CMAKE_CURRENT_BINARY_DIR}/pbzero")
+  endif()
+
+  if(NOT PERFETTO_PROTOC_BIN)
+    find_program(PERFETTO_PROTOC_BIN NAMES protoc PATHS "${_PERFETTO_PROTOZERO_PACKAGE_DIR}/bin" NO_DEFAULT_PATH)
+  endif()
+  if(NOT PERFETTO_protozero_plugin_BIN)
+    find_program(PERFETTO_protozero_plugin_BIN NAMES protozero_plugin PATHS "${_PERFETTO_PROTOZERO_PACKAGE_DIR}/bin" NO_DEFAULT_PATH)
+  endif()
+  if(NOT PERFETTO_PROTOC_BIN OR NOT PERFETTO_protozero_plugin_BIN)
+    message(FATAL_ERROR "perfetto_generate_pbzero: protoc (${PERFETTO_PROTOC_BIN}) or protozero_plugin (${PERFETTO_protozero_plugin_BIN}) not found")
+  endif()
+  set(_protoc "${PERFETTO_PROTOC_BIN}")
+  set(_plugin "${PERFETTO_protozero_plugin_BIN}")
+
+  set(_import_dirs "${ARG_PROTO_ROOT}" ${ARG_IMPORT_DIRS})
+  if(EXISTS "${_PERFETTO_PROTOZERO_PACKAGE_DIR}/protos")
+    list(APPEND _import_dirs "${_PERFETTO_PROTOZERO_PACKAGE_DIR}/protos")
+  endif()
+
+  set(_protos "")
+  foreach(_proto ${ARG_PROTOS})
+    get_filename_component(_proto "${_proto}" ABSOLUTE)
+    list(APPEND _protos "${_proto}")
+  endforeach()
+  list(LENGTH _protos _count)
+
+  set(_batch_size "${ARG_BATCH_SIZE}")
+  if(NOT _batch_size)
+    cmake_host_system_information(RESULT _cores QUERY NUMBER_OF_LOGICAL_CORES)
+    if(NOT _cores OR _cores LESS 1)
+      set(_cores 1)
+    endif()
+    math(EXPR _batch_size "(${_count} + ${_cores} - 1) / ${_cores}")
+  endif()
+
+  set(_work_dir "${CMAKE_CURRENT_BINARY_DIR}/perfetto_pbzero_${ARG_TARGET}")
+  set(_all_outputs "")
+  set(_batch 0)
+  set(_batch_protos "")
+  set(_batch_outputs "")
+  set(_index 0)
+  foreach(_proto ${_protos})
+    file(RELATIVE_PATH _rel "${ARG_PROTO_ROOT}" "${_proto}")
+    if(_rel MATCHES "^\\.\\.")
+      message(FATAL_ERROR "perfetto_generate_pbzero: ${_proto} is not below PROTO_ROOT ${ARG_PROTO_ROOT}")
+    endif()
+    string(REGEX REPLACE "\\.proto$" "" _rel "${_rel}")
+    list(APPEND _batch_protos "${_proto}")
+    list(APPEND _batch_outputs "${ARG_OUTPUT_DIR}/${_rel}.pbzero.h" "${ARG_OUTPUT_DIR}/${_rel}.pbzero.cc")
+    math(EXPR _index "${_index} + 1")
+    list(LENGTH _batch_protos _batch_count)
+    if(_batch_count EQUAL _batch_size OR _index EQUAL _count)
+      set(_stamp "${_work_dir}/batch${_batch}.stamp")
+      add_custom_command(
+        OUTPUT "${_stamp}"
+        BYPRODUCTS ${_batch_outputs}
+        COMMAND "${CMAKE_COMMAND}"
+          "-DPROTOC=${_protoc}"
+          "-DPLUGIN=${_plugin}"
+          "-DIMPORT_DIRS=${_import_dirs}"
+          "-DPROTOS=${_batch_protos}"
+          "-DHASH_INPUTS=${_protos}"
+          "-DOUTPUTS=${_batch_outputs}"
+          "-DOUTPUT_DIR=${ARG_OUTPUT_DIR}"
+          "-DTMP_DIR=${_work_dir}/batch${_batch}"
+          "-DSTAMP=${_stamp}"
+          -P "${_PERFETTO_PROTOZERO_MODULE_DIR}/perfetto_protozero_generate.cmake"
+        # NOTE: all protos of the call, because protos of one batch may import protos of another batch
+        DEPENDS ${_protos} "${_protoc}" "${_plugin}" "${_PERFETTO_PROTOZERO_MODULE_DIR}/perfetto_protozero_generate.cmake"
+        COMMENT "perfetto_generate_pbzero: ${ARG_TARGET} batch ${_batch} (${_batch_count} protos)"
+        VERBATIM
+      )
+      list(APPEND _all_outputs "${_stamp}" ${_batch_outputs})
+      math(EXPR _batch "${_batch} + 1")
+      set(_batch_protos "")
+      set(_batch_outputs "")
+    endif()
+  endforeach()
+
+  set_source_files_properties(${_all_outputs} PROPERTIES GENERATED TRUE)
+  target_sources(${ARG_TARGET} PRIVATE ${_all_outputs})
+  target_include_directories(${ARG_TARGET} PUBLIC "${ARG_OUTPUT_DIR}")
+  message(STATUS "perfetto_generate_pbzero: ${ARG_TARGET}: ${_count} protos in ${_batch} batches")
+endfunction()
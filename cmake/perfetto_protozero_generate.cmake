@@ -0,0 +1,57 @@
+# Runs one batch of perfetto_generate_pbzero() (see perfetto_protozero.cmake), invoked with cmake -P.
+#
+# Skips protoc if STAMP contains SHA256 of HASH_INPUTS + generator binaries + arguments
+# and all OUTPUTS exist. Generated files are copied to OUTPUT_DIR only if they differ.
+
+set(_hash_input "")
+foreach(_file ${HASH_INPUTS} ${PROTOC} ${PLUGIN})
+  file(SHA256 "${_file}" _file_hash)
+  string(APPEND _hash_input "${_file}=${_file_hash};")
+endforeach()
+string(APPEND _hash_input "IMPORT_DIRS=${IMPORT_DIRS};PROTOS=${PROTOS}")
+string(SHA256 _hash "${_hash_input}")
+
+set(_up_to_date FALSE)
+if(EXISTS "${STAMP}")
+  file(READ "${STAMP}" _previous_hash)
+  if(_previous_hash STREQUAL _hash)
+    set(_up_to_date TRUE)
+    foreach(_output ${OUTPUTS})
+      if(NOT EXISTS "${_output}")
+        set(_up_to_date FALSE)
+      endif()
+    endforeach()
+  endif()
+endif()
+
+if(NOT _up_to_date)
+  file(REMOVE_RECURSE "${TMP_DIR}")
+  file(MAKE_DIRECTORY "${TMP_DIR}")
+  set(_import_args "")
+  foreach(_dir ${IMPORT_DIRS})
+    list(APPEND _import_args "-I${_dir}")
+  endforeach()
+  execute_process(
+    COMMAND "${PROTOC}" ${_import_args}
+      "--plugin=protoc-gen-plugin=${PLUGIN}"
+      "--plugin_out=wrapper_namespace=pbzero:${TMP_DIR}"
+      ${PROTOS}
+    RESULT_VARIABLE _result
+  )
+  if(NOT _result EQUAL 0)
+    message(FATAL_ERROR "protoc failed (${_result}) for ${PROTOS}")
+  endif()
+  foreach(_output ${OUTPUTS})
+    file(RELATIVE_PATH _rel "${OUTPUT_DIR}" "${_output}")
+    if(NOT EXISTS "${TMP_DIR}/${_rel}")
+      message(FATAL_ERROR "protoc did not generate ${_rel}")
+    endif()
+    get_filename_component(_output_dir "${_output}" DIRECTORY)
+    file(MAKE_DIRECTORY "${_output_dir}")
+    execute_process(COMMAND "${CMAKE_COMMAND}" -E copy_if_different "${TMP_DIR}/${_rel}" "${_output}")
+  endforeach()
+  file(REMOVE_RECURSE "${TMP_DIR}")
+endif()
+
+# NOTE: stamp is always rewritten, so the build step does not run again until its inputs change
+file(WRITE "${STAMP}" "${_hash}")
@@ -0,0 +1,7 @@
+-- Queries run by trace_processor_shell on the trace of training_workload
+-- to profile trace ingest (perfetto:pgo=True).
+SELECT COUNT(*) AS slices, SUM(dur) AS total_dur FROM slice;
+SELECT name, COUNT(*) AS cnt, AVG(dur) AS avg_dur FROM slice GROUP BY name ORDER BY cnt DESC;
+SELECT t.name, COUNT(*) AS samples, MAX(c.value) AS max_value
+  FROM counter c JOIN counter_track t ON c.track_id = t.id GROUP BY t.name;
+SELECT key, COUNT(*) FROM args GROUP BY key;
@@ -0,0 +1,123 @@
+// Training workload for the profile-guided build (perfetto:pgo=True).
+// Exercises hot paths of the client library: TRACE_EVENT emission from
+// several threads, TracingSession Setup/Start/Stop and ReadTrace.
+// The last trace is written to --output and ingested by trace_processor_shell.
+
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <cstdlib>
+#include <cstring>
+#include <fstream>
+#include <iostream>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+
+#include <perfetto.h>
+
+PERFETTO_DEFINE_CATEGORIES(
+    perfetto::Category("rendering")
+        .SetDescription("Events from the graphics subsystem"),
+    perfetto::Category("network")
+        .SetDescription("Network upload and download statistics"),
+    perfetto::Category("audio.latency").SetTags("verbose")
+        .SetDescription("Detailed audio latency metrics"));
+
+PERFETTO_TRACK_EVENT_STATIC_STORAGE();
+
+static void EmitEvents(int thread_index, int events) {
+  std::string dynamic_name = "Worker" + std::to_string(thread_index);
+  for (int i = 0; i < events; ++i) {
+    TRACE_EVENT("rendering", "DrawFrame", "frame", i, "thread", thread_index);
+    TRACE_EVENT_BEGIN("network", perfetto::DynamicString{dynamic_name},
+                      "bytes", static_cast<uint64_t>(i) * 1024u,
+                      "url", "https://example.com/resource");
+    TRACE_EVENT_INSTANT("audio.latency", "Underrun", "ms", 0.5 * i);
+    TRACE_EVENT_END("network");
+    TRACE_COUNTER("rendering", "Framerate", i % 120);
+  }
+}
+
+static std::vector<char> RunSession(int threads, int events, int buffer_kb) {
+  perfetto::TraceConfig cfg;
+  cfg.add_buffers()->set_size_kb(buffer_kb);
+  auto* ds_cfg = cfg.add_data_sources()->mutable_config();
+  ds_cfg->set_name("track_event");
+
+  std::unique_ptr<perfetto::TracingSession> tracing_session(
+      perfetto::Tracing::NewTrace(perfetto::kInProcessBackend));
+  tracing_session->Setup(cfg);
+  tracing_session->StartBlocking();
+
+  std::vector<std::thread> workers;
+  for (int t = 0; t < threads; ++t) {
+    workers.emplace_back(EmitEvents, t, events);
+  }
+  for (auto& worker : workers) {
+    worker.join();
+  }
+
+  perfetto::TrackEvent::Flush();
+  tracing_session->StopBlocking();
+
+  // NOTE: ReadTrace() streams the trace in chunks (unlike ReadTraceBlocking)
+  std::vector<char> trace_data;
+  std::mutex mutex;
+  std::condition_variable cv;
+  bool done = false;
+  tracing_session->ReadTrace(
+      [&](perfetto::TracingSession::ReadTraceCallbackArgs args) {
+        std::lock_guard<std::mutex> lock(mutex);
+        if (args.size) {
+          trace_data.insert(trace_data.end(), args.data, args.data + args.size);
+        }
+        if (!args.has_more) {
+          done = true;
+          cv.notify_one();
+        }
+      });
+  std::unique_lock<std::mutex> lock(mutex);
+  cv.wait(lock, [&] { return done; });
+  return trace_data;
+}
+
+int main(int argc, char** argv) {
+  std::string output = "training.perfetto-trace";
+  int threads = 4;
+  int events = 20000;
+  int sessions = 3;
+  for (int i = 1; i + 1 < argc; i += 2) {
+    if (!strcmp(argv[i], "--output")) {
+      output = argv[i + 1];
+    } else if (!strcmp(argv[i], "--threads")) {
+      threads = atoi(argv[i + 1]);
+    } else if (!strcmp(argv[i], "--events")) {
+      events = atoi(argv[i + 1]);
+    } else if (!strcmp(argv[i], "--sessions")) {
+      sessions = atoi(argv[i + 1]);
+    }
+  }
+
+  perfetto::TracingInitArgs args;
+  args.backends |= perfetto::kInProcessBackend;
+  perfetto::Tracing::Initialize(args);
+  perfetto::TrackEvent::Register();
+
+  std::vector<char> trace_data;
+  for (int session = 0; session < sessions; ++session) {
+    trace_data = RunSession(threads, events, 32 * 1024);
+  }
+  if (trace_data.empty()) {
+    std::cerr << "training workload: empty trace" << std::endl;
+    return EXIT_FAILURE;
+  }
+
+  std::ofstream out(output, std::ios::out | std::ios::binary);
+  out.write(trace_data.data(), std::streamsize(trace_data.size()));
+  std::cout << "training workload: " << sessions << " sessions, "
+            << threads * events << " events per session, "
+            << trace_data.size() << " bytes written to " << output << std::endl;
+  return EXIT_SUCCESS;
+}
@@ -1,9 +1,11 @@
-import os, re, sys, stat, json, fnmatch, platform, glob, traceback, shutil
+import os, re, sys, stat, json, fnmatch, platform, glob, traceback, shutil, hashlib, time, bisect, subprocess, contextlib, tempfile
 from conans import ConanFile, CMake, tools, errors, AutoToolsBuildEnvironment, RunEnvironment, python_requires
 from conans.errors import ConanInvalidConfiguration, ConanException
 from conans.model.version import Version
 from conans.tools import os_info
+from conans.client.build.compiler_flags import build_type_flags
 from functools import total_ordering
+from xml.etree import ElementTree
 
 # if you using python less than 3 use from distutils import strtobool
 from distutils.util import strtobool
@@ -17,6 +19,459 @@ def merge_two_dicts(x, y):
     z.update(y)    # modifies z with y's keys and values & returns None
     return z
 
+# converts gn literal (as printed by `gn args --list`) to python value
+def parse_gn_value(value):
+    if value is None:
+        return None
+    value = value.strip()
+    if value == "true":
+        return True
+    if value == "false":
+        return False
+    if re.match(r"^-?[0-9]+$", value):
+        return int(value)
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return re.sub(r'\\([\\"$])', r"\1", value[1:-1])
+    # lists and scopes are kept as is
+    return value
+
+def format_gn_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "%s" % (value)
+
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+# returns (total, available) physical memory in bytes, None if unknown
+def memory_info():
+    if os.path.exists("/proc/meminfo"):
+        meminfo = {}
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    meminfo[parts[0].rstrip(":")] = int(parts[1]) * 1024
+        return (meminfo.get("MemTotal"), meminfo.get("MemAvailable", meminfo.get("MemFree")))
+    if platform.system() == "Windows":
+        import ctypes
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("sullAvailExtendedVirtual", ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return (status.ullTotalPhys, status.ullAvailPhys)
+        return (None, None)
+    total = None
+    available = None
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        available = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        pass
+    return (total, available)
+
+# Materializes files using reflinks (copy-on-write clones) or hardlinks
+# where the filesystem supports it, falls back to regular copy.
+# NOTE: hardlink=False for files that may be rewritten in place later, the change would show through the link
+class FileMaterializer(object):
+    # FICLONE from linux/fs.h
+    _FICLONE = 0x40049409
+
+    def __init__(self):
+        self.counts = {"reflink": 0, "hardlink": 0, "copy": 0}
+        self._try_reflink = sys.platform.startswith("linux")
+        self._try_hardlink = True
+
+    def _reflink(self, src, dst):
+        import fcntl
+        try:
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), self._FICLONE, src_file.fileno())
+        except (IOError, OSError):
+            if os.path.exists(dst):
+                os.remove(dst)
+            return False
+        shutil.copystat(src, dst)
+        return True
+
+    def materialize(self, src, dst, hardlink=True):
+        dst_dir = os.path.dirname(dst)
+        if dst_dir and not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if self._try_reflink:
+            if self._reflink(src, dst):
+                self.counts["reflink"] += 1
+                return
+            # NOTE: do not retry reflink for every file if filesystem does not support it
+            self._try_reflink = False
+        if self._try_hardlink and hardlink:
+            try:
+                os.link(src, dst)
+                self.counts["hardlink"] += 1
+                return
+            except (OSError, AttributeError):
+                self._try_hardlink = False
+        shutil.copy2(src, dst)
+        self.counts["copy"] += 1
+
+# replaces hardlinked file with its own copy, so that in-place edits
+# do not modify other links to the same file
+def break_hardlink(path):
+    if os.stat(path).st_nlink > 1:
+        tmp_path = path + ".tmp"
+        shutil.copy2(path, tmp_path)
+        os.remove(path)
+        os.rename(tmp_path, path)
+
+# Materializes file or directory tree `src` as `dst`, symlinks are recreated as symlinks.
+# Returns number of materialized files.
+def materialize_tree(materializer, src, dst):
+    if os.path.islink(src):
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.symlink(os.readlink(src), dst)
+        return 1
+    if not os.path.isdir(src):
+        materializer.materialize(src, dst)
+        return 1
+    count = 0
+    for root, dirs, files in os.walk(src):
+        dst_root = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(dst_root):
+            os.makedirs(dst_root)
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                dst_path = os.path.join(dst_root, name)
+                if os.path.lexists(dst_path):
+                    os.remove(dst_path)
+                os.symlink(os.readlink(path), dst_path)
+                count += 1
+            elif name in files:
+                materializer.materialize(path, os.path.join(dst_root, name))
+                count += 1
+    return count
+
+_build_dep_archive_exts = [".tar.gz", ".tar.xz", ".tar.bz2", ".tgz", ".zip", ".tar"]
+
+# install-build-deps unpacks archive deps (i.e. buildtools/linux64/clang.tgz)
+# into the target folder without archive extension (buildtools/linux64/clang)
+def build_dep_unpacked(target_folder):
+    for ext in _build_dep_archive_exts:
+        if target_folder.endswith(ext):
+            return target_folder[:-len(ext)]
+    return target_folder
+
+# Pattern with "/" matches target folder prefix, otherwise any component of target folder,
+# both without archive extension (i.e. nodejs matches buildtools/linux64/nodejs.tgz).
+# NOTE: scripts/perfetto_install_build_deps.py gets target folders matched here
+def build_dep_excluded(target_folder, patterns):
+    target_folder = build_dep_unpacked(target_folder.replace("\\", "/").strip("/"))
+    components = target_folder.split("/")
+    for pattern in patterns:
+        pattern = build_dep_unpacked(pattern.strip("/"))
+        if "/" in pattern:
+            if target_folder == pattern or target_folder.startswith(pattern + "/"):
+                return True
+        elif pattern in components:
+            return True
+    return False
+
+# Returns build steps recorded in .ninja_log after `offset` as list of
+# (start_ms, end_ms, cmdhash, [outputs]), one entry per command.
+def read_ninja_log(path, offset=0):
+    steps = {}
+    last_end = 0
+    with open(path, "r") as f:
+        # NOTE: ninja may recompact the log, then all entries of the last build are used
+        f.seek(0, os.SEEK_END)
+        if f.tell() < offset:
+            offset = 0
+        f.seek(offset)
+        for line in f:
+            if line.startswith("#"):
+                continue
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 5:
+                continue
+            start, end, output, cmdhash = int(parts[0]), int(parts[1]), parts[3], parts[4]
+            # NOTE: times are relative to build start, so end time going back means a new build
+            if end < last_end:
+                steps = {}
+            last_end = end
+            steps.setdefault((start, end, cmdhash), []).append(output)
+    return [(start, end, cmdhash, outputs) for (start, end, cmdhash), outputs in steps.items()]
+
+def ninja_step_kind(output):
+    ext = os.path.splitext(output)[1].lower()
+    if ext in [".o", ".obj"]:
+        return "compile"
+    if ext in ["", ".exe", ".dll", ".so", ".dylib", ".a", ".lib"]:
+        return "link"
+    return "other"
+
+# obj/src/base/base.file_utils.o => //src/base:base
+# gcc_like_host/obj/src/base/base.file_utils.o => //src/base:base(gcc_like_host)
+def ninja_object_label(output):
+    parts = output.replace("\\", "/").split("/")
+    if "obj" not in parts:
+        return output
+    obj_index = parts.index("obj")
+    label = "//%s:%s" % ("/".join(parts[obj_index + 1:-1]), parts[-1].split(".")[0])
+    if obj_index > 0:
+        label += "(%s)" % ("/".join(parts[:obj_index]))
+    return label
+
+# link steps of .ninja_log (without static library archiving):
+# wall_seconds is the time at least one link was running
+def ninja_link_summary(steps, top_n):
+    links = sorted((start, end, outputs[0]) for start, end, cmdhash, outputs in steps
+                   if ninja_step_kind(outputs[0]) == "link" and os.path.splitext(outputs[0])[1].lower() not in [".a", ".lib"])
+    wall_ms = 0
+    busy_until = None
+    for start, end, output in links:
+        if busy_until is None or start > busy_until:
+            wall_ms += end - start
+            busy_until = end
+        elif end > busy_until:
+            wall_ms += end - busy_until
+            busy_until = end
+    slowest = sorted(links, key=lambda link: link[0] - link[1])[:top_n]
+    return {
+        "steps": len(links),
+        "wall_seconds": wall_ms / 1000.0,
+        "cpu_seconds": sum(end - start for start, end, output in links) / 1000.0,
+        "slowest": [{"output": output, "seconds": (end - start) / 1000.0} for start, end, output in slowest],
+    }
+
+def ninja_build_report(steps, top_n):
+    if not steps:
+        return {"steps": 0}
+    build_start = min(step[0] for step in steps)
+    build_end = max(step[1] for step in steps)
+    wall_ms = build_end - build_start
+    cpu_ms = sum(end - start for start, end, cmdhash, outputs in steps)
+
+    targets = {}
+    compile_steps = []
+    for start, end, cmdhash, outputs in steps:
+        kind = ninja_step_kind(outputs[0])
+        if kind == "compile":
+            label = ninja_object_label(outputs[0])
+            compile_steps.append({"output": outputs[0], "target": label, "seconds": (end - start) / 1000.0})
+        else:
+            label = outputs[0]
+        target = targets.setdefault(label, {"compile_seconds": 0.0, "link_seconds": 0.0, "other_seconds": 0.0})
+        target[kind + "_seconds"] += (end - start) / 1000.0
+
+    # NOTE: .ninja_log has no dependency information, so critical path is estimated
+    # by walking back from the last finished step to the step that finished last
+    # before the current one started
+    steps_by_end = sorted(steps, key=lambda step: step[1])
+    ends = [step[1] for step in steps_by_end]
+    critical_path = []
+    current = steps_by_end[-1]
+    while current is not None:
+        critical_path.append({"output": current[3][0], "kind": ninja_step_kind(current[3][0]), "seconds": (current[1] - current[0]) / 1000.0})
+        index = bisect.bisect_right(ends, current[0])
+        current = steps_by_end[index - 1] if index > 0 else None
+    critical_path.reverse()
+
+    return {
+        "steps": len(steps),
+        "wall_seconds": wall_ms / 1000.0,
+        "cpu_seconds": cpu_ms / 1000.0,
+        "effective_parallelism": (float(cpu_ms) / wall_ms) if wall_ms else None,
+        "critical_path_seconds": sum(step["seconds"] for step in critical_path),
+        "critical_path": critical_path,
+        "slowest_translation_units": sorted(compile_steps, key=lambda step: -step["seconds"])[:top_n],
+        "link": ninja_link_summary(steps, top_n),
+        "targets": targets,
+    }
+
+# `gn desc <out_dir> <label> deps --tree` -> {label: [direct deps]},
+# duplicates elided by gn with "..." still describe an edge.
+def parse_gn_deps_tree(output, root):
+    graph = {root: []}
+    stack = [root]
+    for line in output.splitlines():
+        m = re.match(r'^( *)(//\S+?)(\.\.\.)?\s*$', line)
+        if not m:
+            continue
+        depth = len(m.group(1)) // 2 + 1
+        label = m.group(2)
+        del stack[depth:]
+        graph.setdefault(label, [])
+        if stack and label not in graph[stack[-1]]:
+            graph[stack[-1]].append(label)
+        stack.append(label)
+    return graph
+
+# Object files compiled by a gn target, read from its ninja file (obj/<dir>/<name>.ninja).
+def ninja_target_objects(ninja_file):
+    objects = []
+    with open(ninja_file, "r") as f:
+        for line in f:
+            m = re.match(r'^build (\S+\.(?:o|obj)): (?:\w+_)?(?:cc|cxx|objc|objcxx|asm) ', line)
+            if m:
+                objects.append(m.group(1))
+    return objects
+
+_benchmark_time_units = {"ns": 1.0, "us": 1e3, "ms": 1e6, "s": 1e9}
+
+# Google Benchmark JSON output -> {benchmark name: cpu time in ns}.
+# With --benchmark_repetitions only median aggregates are used.
+def benchmark_times(report):
+    entries = report.get("benchmarks", [])
+    has_aggregates = any(e.get("run_type") == "aggregate" for e in entries)
+    times = {}
+    for e in entries:
+        if has_aggregates:
+            if e.get("run_type") != "aggregate" or e.get("aggregate_name") != "median":
+                continue
+            name = e.get("run_name", e["name"])
+        else:
+            if e.get("error_occurred"):
+                continue
+            name = e["name"]
+        times[name] = e["cpu_time"] * _benchmark_time_units.get(e.get("time_unit", "ns"), 1.0)
+    return times
+
+# Compares benchmark times against a baseline, change is in percent (positive means slower).
+def compare_benchmarks(baseline, current, threshold_percent):
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        if baseline[name] <= 0:
+            continue
+        change = (current[name] - baseline[name]) * 100.0 / baseline[name]
+        rows.append({"name": name, "baseline_ns": baseline[name], "current_ns": current[name],
+                     "change_percent": change, "regression": change > threshold_percent})
+    return {
+        "threshold_percent": threshold_percent,
+        "benchmarks": rows,
+        "regressions": [row["name"] for row in rows if row["regression"]],
+        "missing_in_current": sorted(set(baseline) - set(current)),
+        "new_in_current": sorted(set(current) - set(baseline)),
+    }
+
+# Merges gtest XML (GTEST_OUTPUT=xml:...) of all shards into one <testsuites>.
+# Returns ({"Suite.Test": {"seconds": ..., "status": passed|failed|skipped}}, merged root element).
+# NOTE: gtest reports only the tests of its own shard
+def merge_gtest_xml(paths):
+    merged = ElementTree.Element("testsuites", name="AllTests")
+    suites = {}
+    tests = {}
+    for path in paths:
+        for suite in ElementTree.parse(path).getroot().iter("testsuite"):
+            merged_suite = suites.get(suite.get("name"))
+            if merged_suite is None:
+                merged_suite = suites[suite.get("name")] = ElementTree.SubElement(merged, "testsuite", name=suite.get("name"))
+            for case in suite.findall("testcase"):
+                merged_suite.append(case)
+                if case.find("failure") is not None or case.find("error") is not None:
+                    status = "failed"
+                elif case.get("status") == "notrun" or case.get("result") in ["skipped", "suppressed"] or case.find("skipped") is not None:
+                    status = "skipped"
+                else:
+                    status = "passed"
+                tests["%s.%s" % (case.get("classname"), case.get("name"))] = {
+                    "seconds": float((case.get("time") or "0").rstrip("s")), "status": status}
+    for element in [merged] + list(suites.values()):
+        cases = list(element.iter("testcase"))
+        element.set("tests", str(len(cases)))
+        element.set("failures", str(sum(1 for case in cases if case.find("failure") is not None)))
+        element.set("errors", str(sum(1 for case in cases if case.find("error") is not None)))
+        element.set("disabled", str(sum(1 for case in cases if case.get("status") == "notrun")))
+        element.set("time", "%.3f" % (sum(float((case.get("time") or "0").rstrip("s")) for case in cases)))
+    return tests, merged
+
+# Tests that took at least `threshold_seconds`, slowest first, with time of the same test in baseline ({name: seconds}).
+def slow_gtests(tests, baseline, threshold_seconds):
+    rows = []
+    for name, test in tests.items():
+        if test["status"] == "skipped" or test["seconds"] < threshold_seconds:
+            continue
+        rows.append({"name": name, "seconds": test["seconds"], "baseline_seconds": baseline.get(name)})
+    return sorted(rows, key=lambda row: -row["seconds"])
+
+# `ccache --print-stats` (tab separated) or `sccache --show-stats --stats-format=json` output -> {counter: number},
+# nested sccache counters are joined with "."
+def parse_compiler_cache_stats(launcher, output):
+    stats = {}
+    if launcher == "ccache":
+        for line in output.splitlines():
+            parts = line.split("\t")
+            if len(parts) == 2 and re.match(r"^-?\d+$", parts[1].strip()) and "timestamp" not in parts[0]:
+                stats[parts[0].strip()] = int(parts[1])
+        return stats
+    def flatten(prefix, value):
+        if isinstance(value, bool):
+            return
+        if isinstance(value, (int, float)):
+            stats[prefix] = value
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                flatten("%s.%s" % (prefix, k) if prefix else k, v)
+    # NOTE: sccache may print log lines before json output
+    flatten("", json.loads(output[output.index("{"):]).get("stats", {}))
+    return stats
+
+# counters that changed between two parse_compiler_cache_stats() results
+def compiler_cache_stats_diff(before, after):
+    return dict((k, after[k] - before.get(k, 0)) for k in sorted(after) if after[k] != before.get(k, 0))
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+_sanitizers = ["asan", "lsan", "msan", "tsan", "ubsan"]
+_build_types = ["Debug", "Release", "RelWithDebInfo", "MinSizeRel"]
+
+# "Debug, Release+asan, Release+tsan+ubsan" -> [("Debug", ()), ("Release", ("asan",)), ("Release", ("tsan", "ubsan"))]
+def parse_build_variants(spec):
+    variants = []
+    for entry in re.split(r"[,;\s]+", spec.strip()):
+        if not entry:
+            continue
+        parts = entry.split("+")
+        build_type = [t for t in _build_types if t.lower() == parts[0].lower()]
+        if not build_type:
+            raise ConanInvalidConfiguration("build variant {}: unknown build type {}, expected one of {}".format(entry, parts[0], _build_types))
+        sanitizers = [s.lower() for s in parts[1:]]
+        unknown = [s for s in sanitizers if s not in _sanitizers]
+        if unknown:
+            raise ConanInvalidConfiguration("build variant {}: unknown sanitizers {}, expected some of {}".format(entry, unknown, _sanitizers))
+        variant = (build_type[0], tuple(sorted(set(sanitizers))))
+        if variant not in variants:
+            variants.append(variant)
+    return variants
+
+# ("Release", ("asan",)) -> release-asan
+def build_variant_name(variant):
+    return "-".join([variant[0].lower()] + list(variant[1]))
+
+# replaces compiler flags of one build type with flags of another one, i.e. "-O3" with "-g"
+def replace_flags(flags, old_flags, new_flags):
+    tokens = [token for token in flags.split() if token not in old_flags]
+    return " %s %s " % (" ".join(tokens), " ".join(new_flags))
+
 class PerfettoConan(conan_build_helper.CMakePackage):
     name = "perfetto"
 
@@ -36,7 +491,7 @@ class PerfettoConan(conan_build_helper.CMakePackage):
 
     license = "MIT"
 
-    exports_sources = ["CMakeLists.txt", "CHANGELOG", "patches/**"]
+    exports_sources = ["CMakeLists.txt", "CHANGELOG", "patches/**", "cmake/**", "scripts/**"]
     short_paths = True
 
     settings = "os_build", "os", "arch", "compiler", "build_type"
@@ -271,7 +726,82 @@ class PerfettoConan(conan_build_helper.CMakePackage):
         # TEMPORARY FIX FOR v13.0: buildtools/android-unwinding/libunwindstack/DwarfOp.cpp:1439:5: error: array designators are a C99 extension [-Werror,-Wc99-designator]
         "warn_no_error": [True, False],
         # set target_os and target_cpu based on conan data
-        "append_target_arg": [True, False]
+        "append_target_arg": [True, False],
+        # skip `gn gen` and reuse out/conan-build if gn args, compiler env
+        # and patched sources did not change since the previous build()
+        "incremental_build": [True, False],
+        # compiler launcher passed to gn as `cc_wrapper`, shares object files
+        # between package_id variants and conan cache folders
+        "compiler_launcher": [None, "ccache", "sccache"],
+        # CCACHE_DIR or SCCACHE_DIR, launcher default if not set
+        "compiler_cache_dir": "ANY",
+        # ninja -j, by default sized from CPU count and available memory
+        "ninja_jobs": "ANY",
+        # gn `concurrent_links`, by default sized from total memory
+        "ninja_link_jobs": "ANY",
+        # package only what package_info() exposes:
+        # sdk/ only once, only headers from gen/ and buildtools/protobuf, only .proto files from protos/
+        "lean_package": [True, False],
+        # keep debug info in packaged binaries, split it into `debug_info_dir` or strip it
+        "debug_info": ["keep", "split", "strip"],
+        # where debug info is stored if debug_info=split, default is the package:
+        # <dir>/.debug/<name>.debug (found by gdb via .gnu_debuglink), <dir>/<name>.dSYM on macOS
+        "debug_info_dir": "ANY",
+        # compile sdk/perfetto.cc once into static library `perfetto_sdk`
+        # exposed by perfetto-sdk component, consumers may still compile sdk/perfetto.cc themselves
+        "build_sdk_library": [True, False],
+        # clang only: compile and link with -flto=thin
+        # NOTE: static libraries contain LLVM bitcode, consumers must link them with clang and LTO-capable linker (lld)
+        "thin_lto": [True, False],
+        # clang only: two-stage profile-guided build,
+        # instrumented binaries are trained on cmake/pgo workload, then everything is rebuilt using collected profile
+        "pgo": [True, False],
+        # run perfetto_benchmarks after build(), Google Benchmark JSON is packaged as res/perfetto_benchmarks.json
+        # NOTE: enables enable_perfetto_benchmarks
+        "run_benchmarks": [True, False],
+        # passed as --benchmark_filter
+        "benchmark_filter": "ANY",
+        # Google Benchmark JSON (i.e. res/perfetto_benchmarks.json from the previous version) to compare with
+        "benchmark_baseline": "ANY",
+        # max allowed slowdown of benchmark cpu time in percent compared to `benchmark_baseline`
+        "benchmark_regression_threshold": "ANY",
+        # warn or fail build() if `benchmark_regression_threshold` is exceeded
+        "benchmark_regression_action": ["warn", "fail"],
+        # package every compiled dependency of perfetto_trace_protos (i.e. //protos/perfetto/trace/ftrace:lite)
+        # as its own static library and component with `requires` from gn,
+        # libperfetto component then does not link monolithic perfetto_trace_protos
+        "split_trace_protos": [True, False],
+        # additional build_type/sanitizer variants built from the same patched sources
+        # into out/conan-<variant>, i.e. "Debug, Release+asan, Release+tsan, Release+msan, Release+ubsan",
+        # ninja builds run concurrently and share ninja_jobs (jobserver with ninja 1.13+), see README
+        "matrix_variants": "ANY",
+        # sparse checkout without docs/, infra/ and ui/ (unless enable_perfetto_ui=True),
+        # install-build-deps skips dependencies of disabled components (UI, heapprofd, tests, NDK)
+        "sparse_checkout": [True, False],
+        # build only these ninja targets instead of `all`, package_info() declares only them:
+        # libperfetto, sdk, protoc, protozero_plugin, cppgen_plugin, ipc_plugin, trace_processor_shell, traced, traceconv
+        # i.e. "libperfetto,protoc,protozero_plugin,cppgen_plugin", None builds everything
+        "components": "ANY",
+        # build with protoc and libprotobuf of the protobuf tool_require (perfetto_use_system_protobuf=True)
+        # instead of compiling buildtools/protobuf, its protoc is packaged as bin/protoc
+        "protoc_from_tool_requires": [True, False],
+        # Linux/Android, gcc or clang: link with lld or mold (from PATH or a tool_require) instead of the default linker
+        "linker": [None, "lld", "mold"],
+        # compile with -gsplit-dwarf, debug info stays in .dwo files next to object files
+        "split_dwarf": [True, False],
+        # lld or mold: link with --gdb-index (and compile with -ggnu-pubnames)
+        "gdb_index": [True, False],
+        # compile with -gz and link with --compress-debug-sections=zlib
+        "compress_debug_sections": [True, False],
+        # run the linker through scripts/perfetto_link_stats.py,
+        # link wall time and peak linker RSS are added to the build report
+        "link_stats": [True, False],
+        # enable_perfetto_unittests=True runs perfetto_unittests after the build in this many shards, CPU count by default
+        "unittest_shards": "ANY",
+        # tests taking at least this many seconds are reported as slow
+        "unittest_slow_threshold": "ANY",
+        # res/perfetto_unittest_timing.json of the previous version, by default the previous run in the build folder
+        "unittest_baseline": "ANY"
      }, perfetto_options) # merging allows conan to affect gn options
 
     default_options = merge_two_dicts({
@@ -284,7 +814,36 @@ class PerfettoConan(conan_build_helper.CMakePackage):
         "build_sdk_examples": False,
         "gen_amalgamated": False,
         "warn_no_error": True,
-        "append_target_arg": False
+        "append_target_arg": False,
+        "incremental_build": True,
+        "compiler_launcher": None,
+        "compiler_cache_dir": None,
+        "ninja_jobs": None,
+        "ninja_link_jobs": None,
+        "lean_package": False,
+        "debug_info": "keep",
+        "debug_info_dir": None,
+        "build_sdk_library": True,
+        "thin_lto": False,
+        "pgo": False,
+        "run_benchmarks": False,
+        "benchmark_filter": None,
+        "benchmark_baseline": None,
+        "benchmark_regression_threshold": "10",
+        "benchmark_regression_action": "warn",
+        "split_trace_protos": False,
+        "matrix_variants": None,
+        "sparse_checkout": False,
+        "components": None,
+        "protoc_from_tool_requires": False,
+        "linker": None,
+        "split_dwarf": False,
+        "gdb_index": False,
+        "compress_debug_sections": False,
+        "link_stats": False,
+        "unittest_shards": None,
+        "unittest_slow_threshold": "1",
+        "unittest_baseline": None
      }, default_perfetto_options)
 
     generators = "cmake", "virtualenv"
@@ -397,43 +956,248 @@ class PerfettoConan(conan_build_helper.CMakePackage):
     # use_libfuzzer = false
     # use_sanitizer_configs_without_instrumentation = false
     # using_sanitizer = false
-    def log_gn_options(self, build_dir, cwd):
+    # NOTE: one `gn args --list --json` call instead of one `gn args --list=<name>` call per option,
+    # each gn call loads the whole build graph
+    def load_gn_options(self, build_dir, cwd):
         buf = StringIO()
-        self.run('gn args %s --list --short' % (build_dir), output=buf, cwd=cwd)
+        self.run('gn args %s --list --json' % (build_dir), output=buf, cwd=cwd)
         output = buf.getvalue()
-        self.output.info("gn_options - %s" %(output))
-
-    def get_gn_option_value(self, option_name, build_dir, cwd):
-        buf = StringIO()
-        self.run('gn args %s --list=%s --short' % (build_dir, option_name), output=buf, cwd=cwd)
-        output = buf.getvalue()
-        self.output.info("output - %s" %(output))
-        pattern = r'%s = (.*)' % (option_name)
-        for str in re.findall(pattern, output):
-            self.output.info("str - %s" %(str))
-            if str == 'true':
-                return True
-            elif str == 'false':
-                return False
-
-        raise errors.ConanInvalidConfiguration("Could not parse gn configuration options because option {} not found in {} due to match {}".format(option_name, output, match))
+        try:
+            # NOTE: gn may print warnings before json output
+            entries = json.loads(output[output.index("["):])
+        except ValueError as err:
+            raise errors.ConanInvalidConfiguration("Could not parse gn configuration options from {}: {}".format(output, err))
+        gn_options = {}
+        for entry in entries:
+            # NOTE: "current" is the value from args.gn, "default" is used if option was not overriden
+            value = entry.get("current", entry.get("default", {})).get("value")
+            gn_options[entry["name"]] = parse_gn_value(value)
+        return gn_options
+
+    def log_gn_options(self, gn_options):
+        self.output.info("gn_options - \n%s" % ("\n".join("%s = %s" % (k, format_gn_value(gn_options[k])) for k in sorted(gn_options))))
+
+    def get_gn_option_value(self, option_name, gn_options):
+        if option_name not in gn_options:
+            raise errors.ConanInvalidConfiguration("Could not parse gn configuration options because option {} not found in {}".format(option_name, sorted(gn_options)))
+        return gn_options[option_name]
+
+    def check_gn_options(self, gn_options):
+        mismatches = []
+        for k,v in self._perfetto_option_values():
+            expected = parse_gn_value(str(v).lower())
+            actual = self.get_gn_option_value(option_name=k, gn_options=gn_options)
+            if expected != actual:
+                mismatches.append((k, format_gn_value(expected), format_gn_value(actual)))
+        if mismatches:
+            rows = [("option", "requested", "gn")] + mismatches
+            widths = [max(len(row[i]) for row in rows) for i in range(3)]
+            table = "\n".join(" | ".join(cell.ljust(widths[i]) for i, cell in enumerate(row)) for row in rows)
+            self.output.warn("Mismatch in gn options:\n%s" % (table))
+            raise errors.ConanInvalidConfiguration("Final gn configuration did not match requested config for options {}".format([m[0] for m in mismatches]))
 
     @property
     def _source_subfolder(self):
         return "source_subfolder"
 
+    # build variant (build_type, sanitizers) that is being configured or built,
+    # None means the variant of the current settings and options
+    _active_variant = None
+
+    @property
+    def _matrix_variants(self):
+        spec = self.options.get_safe("matrix_variants")
+        if spec is None or str(spec).lower() == "none":
+            return []
+        return parse_build_variants(str(spec))
+
+    @property
+    def _current_variant(self):
+        if self._active_variant is not None:
+            return self._active_variant
+        return (str(self.settings.build_type), tuple(s for s in _sanitizers if self.options.get_safe("is_" + s)))
+
+    # variant of the current settings first, then the other matrix variants
+    @property
+    def _build_variants(self):
+        current = self._current_variant
+        return [current] + [variant for variant in self._matrix_variants if variant != current]
+
+    @contextlib.contextmanager
+    def _build_variant(self, variant):
+        previous = self._active_variant
+        self._active_variant = variant
+        try:
+            yield
+        finally:
+            self._active_variant = previous
+
+    @property
+    def _active_build_type(self):
+        return self._current_variant[0]
+
+    def _sanitizer_enabled(self, option_name):
+        return option_name[len("is_"):] in self._current_variant[1]
+
+    # perfetto gn options as (name, value), sanitizers of matrix variants override conan options
+    def _perfetto_option_values(self):
+        values = []
+        for k,v in self.options.items():
+            if k in self.perfetto_options and not (self._matrix_variants and k in ["is_" + s for s in _sanitizers]):
+                values.append((k, v))
+        if self._matrix_variants:
+            values += [("is_" + s, self._sanitizer_enabled("is_" + s)) for s in _sanitizers]
+        return values
+
+    def _gn_option_args(self):
+        args = [("%s=%s" % (k,v)).lower() for k,v in self._perfetto_option_values()]
+        if self._matrix_variants:
+            args.append("is_debug=%s" % (format_gn_value(self._active_build_type == "Debug")))
+        args.append("concurrent_links=%s" % (self._concurrent_links))
+        return args
+
+    # link jobs of one build dir
+    @property
+    def _concurrent_links(self):
+        if self._matrix_variants:
+            # NOTE: variants are linked concurrently
+            return max(1, self._ninja_link_jobs // len(self._build_variants))
+        return self._ninja_link_jobs
+
+    @property
+    def _gn_build_dir(self):
+        if self._matrix_variants:
+            return "out/conan-%s" % (build_variant_name(self._current_variant))
+        return "out/conan-build"
+
+    # files that may be rewritten by _patch_sources* before `gn gen`
+    _patched_files = [
+        "sdk/perfetto.cc",
+        "src/profiling/symbolizer/BUILD.gn",
+        "tools/gn_utils.py",
+        "tools/gen_amalgamated",
+        "BUILD.gn",
+        "gn/standalone/BUILD.gn",
+        "gn/standalone/toolchain/win_find_msvc.py",
+    ]
+
+    @property
+    def _gn_fingerprint_path(self):
+        return os.path.join(self._source_subfolder, self._gn_build_dir, "conan_gn_fingerprint.json")
+
+    # Everything that affects the output of `gn gen`.
+    # If nothing changed since the previous build(), out/conan-build can be reused as is
+    # and ninja is able to perform a no-op build.
+    def _gn_fingerprint(self, gn_opts):
+        buf = StringIO()
+        self.run('gn --version', output=buf, cwd=self._source_subfolder)
+        patched_sources = {}
+        for patched_file in self._patched_files:
+            path = os.path.join(self._source_subfolder, patched_file)
+            patched_sources[patched_file] = file_sha256(path) if os.path.exists(path) else None
+        return {
+            "commit": self.commit,
+            "gn_version": buf.getvalue().strip(),
+            "gn_args": gn_opts,
+            "settings": dict((k, str(v)) for k, v in self.settings.values_list),
+            "env": dict((k, os.environ.get(k)) for k in ["CC", "CXX", "AR", "CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS"]),
+            "patched_sources": patched_sources,
+            "tool_protoc": self._tool_protoc if self.options.get_safe("protoc_from_tool_requires") else None,
+        }
+
+    def _is_gn_build_dir_up_to_date(self, fingerprint):
+        if not os.path.exists(os.path.join(self._source_subfolder, self._gn_build_dir, "build.ninja")):
+            return False
+        if not os.path.exists(self._gn_fingerprint_path):
+            return False
+        try:
+            with open(self._gn_fingerprint_path, "r") as f:
+                previous = json.load(f)
+        except ValueError as err:
+            self.output.warn("can not parse %s: %s" % (self._gn_fingerprint_path, err))
+            return False
+        changed = [k for k in sorted(set(previous) | set(fingerprint)) if previous.get(k) != fingerprint.get(k)]
+        if changed:
+            self.output.info("gn fingerprint changed in: %s" % (", ".join(changed)))
+            return False
+        return True
+
+    def _save_gn_fingerprint(self, fingerprint):
+        with open(self._gn_fingerprint_path, "w") as f:
+            json.dump(fingerprint, f, indent=2, sort_keys=True)
+
+    def _remove_gn_fingerprint(self):
+        if os.path.exists(self._gn_fingerprint_path):
+            os.remove(self._gn_fingerprint_path)
+
+    @property
+    def _patch_stamps_path(self):
+        return os.path.join(self._source_subfolder, ".conan_patches.json")
+
+    def _load_patch_stamps(self):
+        if not os.path.exists(self._patch_stamps_path):
+            return {}
+        try:
+            with open(self._patch_stamps_path, "r") as f:
+                return json.load(f)
+        except ValueError as err:
+            self.output.warn("can not parse %s: %s" % (self._patch_stamps_path, err))
+            return {}
+
+    # Idempotent replacement of `search` with `replace` in file relative to source_subfolder.
+    # Hash of patched content is recorded per file, so reruns of build() skip applied patches
+    # without searching. File is written only if its content changed, because
+    # touching mtime of sources invalidates incremental ninja builds.
+    def _patch_file(self, path, search, replace):
+        full_path = os.path.join(self._source_subfolder, path)
+        patch_id = hashlib.sha256((search + "\0" + replace).encode("utf-8")).hexdigest()
+        stamps = self._load_patch_stamps()
+        stamp = stamps.get(path.replace("\\", "/"), {"sha256": None, "patches": []})
+
+        with open(full_path, "rb") as f:
+            content = f.read().decode("utf-8")
+        sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if stamp["sha256"] == sha256 and patch_id in stamp["patches"]:
+            self.output.info("patch already applied to %s" % (path))
+            return
+        if stamp["sha256"] != sha256:
+            # file was changed by someone else, forget about previously applied patches
+            stamp["patches"] = []
+
+        if "\r\n" in content and "\r\n" not in search:
+            search = search.replace("\n", "\r\n")
+            replace = replace.replace("\n", "\r\n")
+
+        # NOTE: replacement may contain searched text
+        already_applied = (replace in content) if replace else (search not in content)
+        if search in content and not (already_applied and search in replace):
+            patched = content.replace(search, replace)
+        elif already_applied:
+            self.output.info("patch already applied to %s" % (path))
+            patched = content
+        else:
+            self.output.error("can not patch %s: pattern not found: %s" % (path, search))
+            return
+
+        if patched != content:
+            with open(full_path, "wb") as f:
+                f.write(patched.encode("utf-8"))
+            sha256 = hashlib.sha256(patched.encode("utf-8")).hexdigest()
+        stamp["sha256"] = sha256
+        stamp["patches"].append(patch_id)
+        stamps[path.replace("\\", "/")] = stamp
+        with open(self._patch_stamps_path, "w") as f:
+            json.dump(stamps, f, indent=2, sort_keys=True)
+
     def _patch_sources(self):
         self.output.info("replacing sdk\perfetto.cc")
-        try:
-            # https://github.com/google/perfetto/issues/347
-            tools.replace_in_file(os.path.join(self._source_subfolder, "sdk", "perfetto.cc"), r"    shm = PosixSharedMemory::Create(shmem_size_hint);"
-                                , r"""#if PERFETTO_BUILDFLAG(PERFETTO_OS_WIN)
+        # https://github.com/google/perfetto/issues/347
+        self._patch_file(os.path.join("sdk", "perfetto.cc"), r"    shm = PosixSharedMemory::Create(shmem_size_hint);"
+                            , r"""#if PERFETTO_BUILDFLAG(PERFETTO_OS_WIN)
     shm = SharedMemoryWindows::Create(shmem_size_hint);
 #else
     shm = PosixSharedMemory::Create(shmem_size_hint);
 #endif""")
-        except Exception as err:
-            self.output.error("replace_in_file sdk\perfetto.cc failed: {0}".format(err))
 
         # https://github.com/google/perfetto/issues/343
 #        self.output.info("replacing unix_socket_unittest in base/BUILD.gn")
@@ -449,8 +1213,7 @@ class PerfettoConan(conan_build_helper.CMakePackage):
 
         # https://github.com/google/perfetto/issues/343
         self.output.info("replacing symbolize_database in symbolizer")
-        try:
-            tools.replace_in_file(os.path.join(self._source_subfolder, "src", "profiling", "symbolizer", "BUILD.gn"), r"""source_set("symbolize_database") {
+        self._patch_file(os.path.join("src", "profiling", "symbolizer", "BUILD.gn"), r"""source_set("symbolize_database") {
   public_deps = [
     ":symbolizer",
     "../../../include/perfetto/ext/base",
@@ -468,7 +1231,7 @@ class PerfettoConan(conan_build_helper.CMakePackage):
     "symbolize_database.h",
   ]
 }"""
-                                , r"""if (!is_win) {
+                            , r"""if (!is_win) {
   source_set("symbolize_database") {
     public_deps = [
       ":symbolizer",
@@ -488,8 +1251,6 @@ class PerfettoConan(conan_build_helper.CMakePackage):
     ]
   }
 }""")
-        except Exception as err:
-            self.output.error("replace_in_file symbolizer failed: {0}".format(err))
 
     def _patch_sources_to_gen_amalgamated(self):
         # The CHANGELOG mtime triggers the perfetto_version.gen.h genrule. This is
@@ -500,34 +1261,25 @@ class PerfettoConan(conan_build_helper.CMakePackage):
             self.copy("CHANGELOG", dst=os.path.join(self._source_subfolder, "CHANGELOG"), src=self.source_folder)
 
         self.output.info("replacing python3 in gn_utils.py")
-        try:
-            # FIXES subprocess.check_output exit status "9009"
-            # https://bugs.python.org/issue20117
-            tools.replace_in_file(os.path.join(self._source_subfolder, "tools", "gn_utils.py"), r"return ['python3', wrapper, name]"
-                                , r"return [sys.executable, wrapper, name]")
-        except Exception as err:
-            self.output.error("replace_in_file gn_utils.py failed: {0}".format(err))
+        # FIXES subprocess.check_output exit status "9009"
+        # https://bugs.python.org/issue20117
+        self._patch_file(os.path.join("tools", "gn_utils.py"), r"return ['python3', wrapper, name]"
+                            , r"return [sys.executable, wrapper, name]")
 
         self.output.info("replacing import in gn_utils.py")
-        try:
-            # FIXES subprocess.check_output exit status "9009"
-            # https://bugs.python.org/issue20117
-            tools.replace_in_file(os.path.join(self._source_subfolder, "tools", "gn_utils.py"), r"from compat import iteritems"
-                                , r"""from compat import iteritems
+        # FIXES subprocess.check_output exit status "9009"
+        # https://bugs.python.org/issue20117
+        self._patch_file(os.path.join("tools", "gn_utils.py"), r"from compat import iteritems"
+                            , r"""from compat import iteritems
 from platform import system""")
-        except Exception as err:
-            self.output.error("replace_in_file gn_utils.py failed: {0}".format(err))
 
         self.output.info("replacing splitext in gn_utils.py")
-        try:
-            # FIXES "def compute_source_dependencies" if
-            # os.path.splitext(line)=('    ../../buildtools/win/clang/lib/clang/16.0.0/include/vadefs', '.h\r')
-            # or if
-            # os.path.splitext(line)=('    ../../buildtools/protobuf/src/google/protobuf/port_def', '.inc\r')
-            tools.replace_in_file(os.path.join(self._source_subfolder, "tools", "gn_utils.py"), r"assert os.path.splitext(line)[1] in ['.c', '.cc', '.cpp', '.S']"
-                                , r"assert os.path.splitext(line)[1] in ['.h', '.h\r', '.h', '.inc\r', '.c', '.cc', '.cpp', '.obj' if system().lower() == 'windows' else '.S']")
-        except Exception as err:
-            self.output.error("replace_in_file gn_utils.py failed: {0}".format(err))
+        # FIXES "def compute_source_dependencies" if
+        # os.path.splitext(line)=('    ../../buildtools/win/clang/lib/clang/16.0.0/include/vadefs', '.h\r')
+        # or if
+        # os.path.splitext(line)=('    ../../buildtools/protobuf/src/google/protobuf/port_def', '.inc\r')
+        self._patch_file(os.path.join("tools", "gn_utils.py"), r"assert os.path.splitext(line)[1] in ['.c', '.cc', '.cpp', '.S']"
+                            , r"assert os.path.splitext(line)[1] in ['.h', '.h\r', '.h', '.inc\r', '.c', '.cc', '.cpp', '.obj' if system().lower() == 'windows' else '.S']")
 
         # TODO: cxx = 'clang-cl' if windows and is_clang=true
         #
@@ -539,21 +1291,17 @@ from platform import system""")
         #  cxx = 'clang++'
 
         self.output.info("replacing source_deps in gen_amalgamated")
-        try:
-            tools.replace_in_file(os.path.join(self._source_subfolder, "tools", "gen_amalgamated"), r"    deps = self.source_deps[source_name]"
-                                , r"""
+        self._patch_file(os.path.join("tools", "gen_amalgamated"), r"    deps = self.source_deps[source_name]"
+                            , r"""
     if source_name not in self.source_deps:
       # TODO: KeyError: 'src/base/android_utils.cc'
       return
     deps = self.source_deps[source_name]
 """)
-        except Exception as err:
-            self.output.error("replace_in_file gen_amalgamated failed: {0}".format(err))
 
         self.output.info("replacing result[-1] in gen_amalgamated")
-        try:
-            tools.replace_in_file(os.path.join(self._source_subfolder, "tools", "gen_amalgamated"), r"        result[-1] += flag"
-                                , r"""
+        self._patch_file(os.path.join("tools", "gen_amalgamated"), r"        result[-1] += flag"
+                            , r"""
         # If result is empty, then result[-1] yields "list index out of range" error. 
         # Trying to access result[-1] in an empty array is just as invalid as result[0]
         if len(result) == 0:
@@ -561,26 +1309,20 @@ from platform import system""")
         else:
           result[-1] += flag
 """)
-        except Exception as err:
-            self.output.error("replace_in_file gen_amalgamated failed: {0}".format(err))
 
         if self.settings.os == 'Windows':
             self.output.info("replacing touch in gen_amalgamated")
-            try:
-                # TODO: use some windows command instead of "touch"
-                tools.replace_in_file(os.path.join(self._source_subfolder, "tools", "gen_amalgamated"), r"  subprocess.check_call(['touch', '-c', changelog_path])"
-                                    , "")
-            except Exception as err:
-                self.output.error("replace_in_file gen_amalgamated failed: {0}".format(err))
+            # TODO: use some windows command instead of "touch"
+            self._patch_file(os.path.join("tools", "gen_amalgamated"), r"  subprocess.check_call(['touch', '-c', changelog_path])"
+                                , "")
 
     def _patch_sources_to_warn_no_error(self):
         if self.settings.os == 'Windows':
             # TODO: on WINDOWS enable_perfetto_tools error: assert(enable_perfetto_ipc)
             # because tools/websocket_bridge uses ipc:default_socket
             self.output.info("replacing websocket_bridge in BUILD.gn")
-            try:
-                tools.replace_in_file(os.path.join(self._source_subfolder, "BUILD.gn"), r"if (enable_perfetto_tools)"
-                                    , r"""if (is_win && enable_perfetto_tools) {
+            self._patch_file("BUILD.gn", r"if (enable_perfetto_tools)"
+                                , r"""if (is_win && enable_perfetto_tools) {
   all_targets += [
     "src/tools"
   ]
@@ -591,20 +1333,12 @@ from platform import system""")
   ]
 }
 if (false)""")
-            except Exception as err:
-                self.output.error("replace_in_file BUILD.gn failed: {0}".format(err))
 
         self.output.info("replacing WX in gn\standalone\BUILD.gn")
-        try:
-            tools.replace_in_file(os.path.join(self._source_subfolder, "gn", "standalone", "BUILD.gn"), "cflags += [ \"/WX\" ]" , "cflags += [ \"/W0\" ]")
-        except Exception as err:
-            self.output.error("replace_in_file gn/standalone/BUILD.gn failed: {0}".format(err))
+        self._patch_file(os.path.join("gn", "standalone", "BUILD.gn"), "cflags += [ \"/WX\" ]" , "cflags += [ \"/W0\" ]")
 
         self.output.info("replacing Werror in gn\standalone\BUILD.gn")
-        try:
-            tools.replace_in_file(os.path.join(self._source_subfolder, "gn", "standalone", "BUILD.gn"), "cflags += [ \"-Werror\" ]" , "cflags += [ \"-Wno-error\" ]")
-        except Exception as err:
-            self.output.error("replace_in_file gn/standalone/BUILD.gn failed: {0}".format(err))
+        self._patch_file(os.path.join("gn", "standalone", "BUILD.gn"), "cflags += [ \"-Werror\" ]" , "cflags += [ \"-Wno-error\" ]")
             
         #self.output.info("replacing extra_warnings in gn\standalone\BUILDCONFIG.gn")
         #try:
@@ -613,12 +1347,11 @@ if (false)""")
         #    self.output.error("replace_in_file BUILDCONFIG.gn failed: {0}".format(err))
 
         if self.settings.os == 'Windows':
-            try:
-                self.output.info("replacing msvc_base in win_find_msvc.py")
-                tools.replace_in_file(os.path.join(self._source_subfolder, "gn", "standalone", "toolchain", "win_find_msvc.py"),
-                                r"out[1] = find_max_subdir(lib_base, filt)"
-                                ,
-                                r"""out[1] = find_max_subdir(lib_base, filt)
+            self.output.info("replacing msvc_base in win_find_msvc.py")
+            self._patch_file(os.path.join("gn", "standalone", "toolchain", "win_find_msvc.py"),
+                            r"out[1] = find_max_subdir(lib_base, filt)"
+                            ,
+                            r"""out[1] = find_max_subdir(lib_base, filt)
   for version in ['BuildTools', 'Community', 'Professional', 'Enterprise']:
     for year in ['2022', '2021', '2020', '2019', '2018', '2017']:
         msvc_base = ('C:\\Program Files (x86)\\Microsoft Visual Studio\\{}\\'
@@ -630,13 +1363,53 @@ if (false)""")
             if max_msvc is not None:
                 out[2] = os.path.join(msvc_base, max_msvc)
             break""")
-            except Exception as err:
-                self.output.error("replace_in_file gn/standalone/toolchain/win_find_msvc.py failed: {0}".format(err))
 
     def configure(self):
         if self.settings.compiler.cppstd:
             tools.check_min_cppstd(self, 11)
 
+        if self.options.get_safe("run_benchmarks") and not self.options.get_safe("enable_perfetto_benchmarks"):
+            self.output.warn("enable_perfetto_benchmarks=True because run_benchmarks=True")
+            self.options.enable_perfetto_benchmarks = True
+            self.perfetto_options['enable_perfetto_benchmarks'] = True
+
+        for option_name in ["thin_lto", "pgo"]:
+            if self.options.get_safe(option_name) and (str(self.settings.compiler) not in ["clang", "apple-clang"] or self._is_clang_cl):
+                raise errors.ConanInvalidConfiguration("{}=True requires clang, got compiler {}".format(option_name, self.settings.compiler))
+
+        for option_name in ["linker", "split_dwarf", "gdb_index", "compress_debug_sections", "link_stats"]:
+            if not self._str_option(option_name) or self._str_option(option_name) == "False":
+                continue
+            if str(self.settings.compiler) not in ["gcc", "clang"] or self._is_clang_cl:
+                raise errors.ConanInvalidConfiguration("{}={} requires gcc or clang, got compiler {}".format(option_name, self._str_option(option_name), self.settings.compiler))
+            if option_name != "link_stats" and str(self.settings.os) not in ["Linux", "Android"]:
+                raise errors.ConanInvalidConfiguration("{}={} is supported only for ELF targets (Linux, Android)".format(option_name, self._str_option(option_name)))
+        # NOTE: the linker shim is a /bin/sh script and perfetto_link_stats.py uses os.wait4
+        if self.options.get_safe("link_stats") and os_info.is_windows:
+            raise errors.ConanInvalidConfiguration("link_stats=True requires a POSIX build machine")
+        # NOTE: GNU ld does not support --gdb-index
+        if self.options.get_safe("gdb_index") and not self._linker:
+            raise errors.ConanInvalidConfiguration("gdb_index=True requires linker=lld or linker=mold")
+
+        if self.options.get_safe("protoc_from_tool_requires"):
+            self.output.warn("perfetto_use_system_protobuf=True because protoc_from_tool_requires=True")
+            self.options.perfetto_use_system_protobuf = True
+            self.perfetto_options['perfetto_use_system_protobuf'] = True
+
+        # NOTE: parses and validates components
+        if self._components is not None and self.options.get_safe("split_trace_protos") and not self._has_component("libperfetto"):
+            raise errors.ConanInvalidConfiguration("split_trace_protos=True requires libperfetto in components")
+
+        # NOTE: parses and validates matrix_variants
+        if self._matrix_variants and self.options.get_safe("pgo"):
+            raise errors.ConanInvalidConfiguration("pgo=True can not be combined with matrix_variants")
+
+        # NOTE: gn may enable UI by default, but ui/ is not checked out
+        if self.options.get_safe("sparse_checkout") and str(self.options.get_safe("enable_perfetto_ui")).lower() == "none":
+            self.output.warn("enable_perfetto_ui=False because sparse_checkout=True")
+            self.options.enable_perfetto_ui = False
+            self.perfetto_options['enable_perfetto_ui'] = False
+
         lower_build_type = str(self.settings.build_type).lower()
 
         if self.settings.os == 'Windows':
@@ -711,14 +1484,283 @@ if (false)""")
         self.tool_requires("ninja/[>=1.11]")
         self.tool_requires("protobuf/v3.9.1@conan/stable")
 
+    # Local bare repository (i.e. created by `git clone --mirror`) that is used instead of repo_url.
+    # Objects are shared with the mirror via git alternates, so each new source folder
+    # only materializes the working tree of the pinned commit.
+    @property
+    def _git_mirror(self):
+        mirror = os.environ.get("PERFETTO_GIT_MIRROR")
+        if not mirror:
+            return None
+        return os.path.abspath(os.path.expanduser(mirror))
+
+    def _git_mirror_has_revision(self, mirror, revision):
+        try:
+            self.run('git --git-dir="{}" cat-file -e {}^{{commit}}'.format(mirror, revision))
+            return True
+        except ConanException:
+            return False
+
+    def _update_git_mirror(self, mirror):
+        if not os.path.exists(mirror):
+            self.output.info("creating git mirror %s" % (mirror))
+            self.run('git clone --progress --mirror {} "{}"'.format(self.repo_url, mirror))
+            return
+        revision = self.commit if self.commit else self.branch
+        if self._git_mirror_has_revision(mirror, revision):
+            return
+        buf = StringIO()
+        try:
+            self.run('git --git-dir="{}" config --get remote.origin.url'.format(mirror), output=buf)
+        except ConanException:
+            raise errors.ConanInvalidConfiguration("git mirror {} does not contain {} and has no remote to fetch from".format(mirror, revision))
+        self.output.info("updating git mirror %s from %s" % (mirror, buf.getvalue().strip()))
+        self.run('git --git-dir="{}" fetch --progress --prune origin'.format(mirror))
+
+    def _clone_sources(self):
+        mirror = self._git_mirror
+        sparse = self.options.get_safe("sparse_checkout")
+        if mirror:
+            self._update_git_mirror(mirror)
+            # NOTE: --shared writes objects/info/alternates instead of copying objects from the mirror
+            self.run('git clone --progress --shared --no-checkout -b {} "{}" {}'.format(self.branch, mirror, self._source_subfolder))
+            with tools.chdir(self._source_subfolder):
+                self.run('git remote set-url origin {}'.format(self.repo_url))
+                if sparse:
+                    self._set_sparse_checkout(self._sparse_checkout_excludes)
+                self.run('git checkout {}'.format(self.commit if self.commit else self.branch))
+                self.run('git submodule update --init --recursive')
+        elif sparse:
+            # NOTE: --filter=blob:none fetches only blobs of checked out paths
+            self.run('git clone -b {} --progress --depth 100 --no-checkout --filter=blob:none {} {}'.format(self.branch, self.repo_url, self._source_subfolder))
+            with tools.chdir(self._source_subfolder):
+                self._set_sparse_checkout(self._sparse_checkout_excludes)
+                self.run('git checkout {}'.format(self.commit if self.commit else self.branch))
+                self.run('git submodule update --init --recursive')
+        else:
+            self.run('git clone -b {} --progress --depth 100 --recursive --recurse-submodules {} {}'.format(self.branch, self.repo_url, self._source_subfolder))
+            if self.commit:
+                with tools.chdir(self._source_subfolder):
+                    self.run('git checkout {}'.format(self.commit))
+
+    # Top level paths of the perfetto tree that are not checked out with sparse_checkout=True
+    @property
+    def _sparse_checkout_excludes(self):
+        excludes = ["docs", "infra"]
+        if not self.options.get_safe("enable_perfetto_ui"):
+            excludes.append("ui")
+        return excludes
+
+    # Patterns (see build_dep_excluded) of tools/install-build-deps dependencies
+    # that are not installed with sparse_checkout=True, derived from the effective gn options
+    @property
+    def _excluded_build_deps(self):
+        gn_options = self._effective_gn_options(self.options)
+        # NOTE: None of options without platform independent gn default (not in _gn_default_options)
+        # may be enabled by gn, i.e. enable_perfetto_heapprofd on Linux
+        enabled = lambda name: gn_options.get(name) is not False
+        excludes = []
+        if not enabled("enable_perfetto_ui"):
+            excludes += ["nodejs", "emsdk", "node_modules"]
+        if not enabled("enable_perfetto_heapprofd") and not enabled("enable_perfetto_traced_perf"):
+            # libunwindstack and its dependencies
+            excludes += ["android-unwinding", "android-core", "android-logging", "android-libbase", "android-libprocinfo", "bionic", "lzma"]
+        if self.settings.os != "Android":
+            excludes += ["ndk", "android_sdk"]
+        with_tests = any(enabled(name) for name in ["enable_perfetto_unittests", "enable_perfetto_integration_tests",
+                                                    "enable_perfetto_benchmarks", "enable_perfetto_fuzzers"])
+        if not with_tests:
+            excludes += ["googletest", "test/data"]
+        if not enabled("enable_perfetto_benchmarks"):
+            excludes += ["benchmark"]
+        if not enabled("enable_perfetto_fuzzers"):
+            excludes += ["libfuzzer"]
+        return excludes
+
+    @property
+    def _sparse_info_path(self):
+        return os.path.join(self._source_subfolder, ".conan_sparse.json")
+
+    # non-cone sparse checkout of everything except `excludes`, must be called from source_subfolder
+    def _set_sparse_checkout(self, excludes):
+        buf = StringIO()
+        self.run('git rev-parse --git-path info/sparse-checkout', output=buf)
+        sparse_checkout_path = buf.getvalue().strip()
+        if not os.path.exists(os.path.dirname(sparse_checkout_path)):
+            os.makedirs(os.path.dirname(sparse_checkout_path))
+        with open(sparse_checkout_path, "w") as f:
+            f.write("/*\n")
+            for path in excludes:
+                f.write("!/%s/\n" % (path))
+        self.run('git config core.sparseCheckout true')
+        self.output.info("sparse checkout without: %s" % (", ".join(excludes)))
+
+    # Installs only build deps that are not excluded by _excluded_build_deps,
+    # the script gets target folders of the install-build-deps manifest that match the patterns
+    def _install_build_deps(self, excluded_build_deps):
+        excluded = sorted(target_folder for target_folder in self._load_build_deps().values()
+                          if build_dep_excluded(target_folder, excluded_build_deps))
+        script = os.path.join(self.source_folder, "scripts", "perfetto_install_build_deps.py")
+        self.run('"{python}" "{script}" --source-dir {source_dir} {excludes}'.format(python=sys.executable, script=script,
+            source_dir=self._source_subfolder, excludes=" ".join('--exclude "%s"' % (e) for e in excluded)))
+
+    # Options of build() may need paths or build deps that source() did not fetch
+    # (source folder is shared between option sets), they are added to the build folder copy.
+    def _extend_sparse_sources(self):
+        if not os.path.exists(self._sparse_info_path):
+            return
+        with open(self._sparse_info_path, "r") as f:
+            sparse_info = json.load(f)
+        excludes = [path for path in sparse_info["excludes"] if path in self._sparse_checkout_excludes]
+        excluded_build_deps = [dep for dep in sparse_info["excluded_build_deps"] if dep in self._excluded_build_deps]
+        if excludes != sparse_info["excludes"]:
+            self.output.warn("checking out %s required by options" % (", ".join(sorted(set(sparse_info["excludes"]) - set(excludes)))))
+            with tools.chdir(self._source_subfolder):
+                self._set_sparse_checkout(excludes)
+                self.run('git read-tree -mu HEAD')
+        if excluded_build_deps != sparse_info["excluded_build_deps"]:
+            self.output.warn("installing build deps %s required by options" % (", ".join(sorted(set(sparse_info["excluded_build_deps"]) - set(excluded_build_deps)))))
+            self._install_build_deps(excluded_build_deps)
+        with open(self._sparse_info_path, "w") as f:
+            json.dump({"excludes": excludes, "excluded_build_deps": excluded_build_deps}, f, indent=2)
+
+    # Local content-addressed cache of dependencies installed by tools/install-build-deps,
+    # local directory or file:// URL. Entries are keyed by the checksum (sha256 or git revision)
+    # of the dependency in the install-build-deps manifest.
+    @property
+    def _build_deps_cache(self):
+        cache = os.environ.get("PERFETTO_BUILD_DEPS_CACHE")
+        if not cache:
+            return None
+        if cache.startswith("file://"):
+            cache = cache[len("file://"):]
+        return os.path.abspath(os.path.expanduser(cache))
+
+    # {checksum: target_folder} of all dependencies listed by tools/install-build-deps,
+    # the script is loaded as module (main() is not executed)
+    def _load_build_deps(self):
+        script = os.path.join(self._source_subfolder, "tools", "install-build-deps")
+        sys.path.insert(0, os.path.dirname(script))
+        try:
+            from importlib.machinery import SourceFileLoader
+            module = SourceFileLoader("perfetto_install_build_deps", script).load_module()
+        except Exception as err:
+            self.output.warn("can not load %s, build deps cache is not used: %s" % (script, err))
+            return {}
+        finally:
+            sys.path.pop(0)
+        build_deps = {}
+        for value in vars(module).values():
+            if not isinstance(value, (list, tuple)):
+                continue
+            for dep in value:
+                if all(hasattr(dep, attr) for attr in ["source_url", "checksum", "target_folder"]):
+                    build_deps[dep.checksum] = dep.target_folder.replace("\\", "/")
+        return build_deps
+
+    # Paths relative to source_subfolder that belong to installed dependency: its target folder,
+    # the folder an archive is unpacked into (i.e. `clang` of `clang.tgz`) and stamps next to them
+    # (i.e. `clang.stamp`), except target folders of other dependencies.
+    def _build_deps_paths(self, target_folder, build_deps):
+        parent, name = os.path.split(target_folder)
+        parent_dir = os.path.join(self._source_subfolder, parent)
+        if not os.path.isdir(parent_dir):
+            return []
+        names = set([name, os.path.basename(build_dep_unpacked(target_folder))])
+        other_targets = set()
+        for other in set(build_deps.values()) - set([target_folder]):
+            other_targets.update([other, build_dep_unpacked(other)])
+        paths = []
+        for entry in sorted(os.listdir(parent_dir)):
+            path = "/".join([parent, entry]) if parent else entry
+            if path in other_targets:
+                continue
+            if any(entry == n or entry.startswith(n + ".") or entry.startswith("." + n) for n in names):
+                paths.append(path)
+        return paths
+
+    # Links cached dependencies into buildtools/ before install-build-deps runs,
+    # so that it finds them installed and does not download or unpack them again.
+    def _restore_build_deps(self, build_deps):
+        materializer = FileMaterializer()
+        restored = []
+        for checksum, target_folder in sorted(build_deps.items()):
+            entry = os.path.join(self._build_deps_cache, checksum)
+            if not os.path.exists(os.path.join(entry, "complete")):
+                continue
+            files_dir = os.path.join(entry, "files")
+            for name in os.listdir(files_dir):
+                dst = os.path.join(self._source_subfolder, os.path.dirname(target_folder), name)
+                if os.path.lexists(dst) and not os.path.islink(dst) and os.path.isdir(dst):
+                    shutil.rmtree(dst)
+                materialize_tree(materializer, os.path.join(files_dir, name), dst)
+            restored.append(target_folder)
+        self.output.info("restored %s of %s build deps from %s (reflinks: %s, hardlinks: %s, copies: %s)" % (
+            len(restored), len(build_deps), self._build_deps_cache,
+            materializer.counts["reflink"], materializer.counts["hardlink"], materializer.counts["copy"]))
+
+    # Adds dependencies installed by install-build-deps to the cache.
+    # Entries are written into a temporary folder and renamed, so concurrent source() calls do not see partial entries.
+    def _store_build_deps(self, build_deps):
+        materializer = FileMaterializer()
+        stored = []
+        for checksum, target_folder in sorted(build_deps.items()):
+            entry = os.path.join(self._build_deps_cache, checksum)
+            if os.path.exists(os.path.join(entry, "complete")):
+                continue
+            paths = self._build_deps_paths(target_folder, build_deps)
+            installed = [os.path.basename(target_folder), os.path.basename(build_dep_unpacked(target_folder))]
+            if not any(os.path.basename(path) in installed for path in paths):
+                # i.e. dependency of other platform
+                continue
+            tmp_entry = "%s.tmp-%s" % (entry, os.getpid())
+            if os.path.exists(tmp_entry):
+                shutil.rmtree(tmp_entry)
+            for path in paths:
+                materialize_tree(materializer, os.path.join(self._source_subfolder, path), os.path.join(tmp_entry, "files", os.path.basename(path)))
+            with open(os.path.join(tmp_entry, "complete"), "w") as f:
+                json.dump({"target_folder": target_folder, "paths": paths}, f, indent=2)
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # stored by concurrent source()
+                shutil.rmtree(tmp_entry)
+                continue
+            stored.append(target_folder)
+        if stored:
+            self.output.info("stored %s build deps in %s: %s" % (len(stored), self._build_deps_cache, ", ".join(stored)))
+
     def source(self):
         python_executable = sys.executable
-        self.run('git clone -b {} --progress --depth 100 --recursive --recurse-submodules {} {}'.format(self.branch, self.repo_url, self._source_subfolder))
-        if self.commit:
+        clone_start = time.time()
+        self._clone_sources()
+        self.output.info("git clone took %.1fs, source folder uses %.1f MiB (.git: %.1f MiB)" % (
+            time.time() - clone_start,
+            dir_size(self._source_subfolder) / (1024.0 * 1024.0),
+            dir_size(os.path.join(self._source_subfolder, ".git")) / (1024.0 * 1024.0)))
+        if self._git_mirror:
+            self.output.info("git mirror %s uses %.1f MiB" % (self._git_mirror, dir_size(self._git_mirror) / (1024.0 * 1024.0)))
+        deps_start = time.time()
+        sparse = self.options.get_safe("sparse_checkout")
+        excluded_build_deps = self._excluded_build_deps if sparse else []
+        build_deps = self._load_build_deps() if self._build_deps_cache else {}
+        build_deps = dict((checksum, target_folder) for checksum, target_folder in build_deps.items()
+                          if not build_dep_excluded(target_folder, excluded_build_deps))
+        if build_deps:
+            self._restore_build_deps(build_deps)
+        if sparse:
+            self._install_build_deps(excluded_build_deps)
+            with open(self._sparse_info_path, "w") as f:
+                json.dump({"excludes": self._sparse_checkout_excludes, "excluded_build_deps": excluded_build_deps}, f, indent=2)
+        else:
             with tools.chdir(self._source_subfolder):
-                self.run('git checkout {}'.format(self.commit))
-        with tools.chdir(self._source_subfolder):
-            self.run('{python} tools/install-build-deps'.format(python=python_executable))
+                self.run('{python} tools/install-build-deps'.format(python=python_executable))
+        if build_deps:
+            self._store_build_deps(build_deps)
+        self.output.info("install-build-deps took %.1fs, buildtools uses %.1f MiB" % (
+            time.time() - deps_start, dir_size(os.path.join(self._source_subfolder, "buildtools")) / (1024.0 * 1024.0)))
 
     @property
     def _is_msvc(self):
@@ -804,6 +1846,865 @@ if (false)""")
             return getattr(tools.XCRun(self.settings), apple_name)
         return None
 
+    @property
+    def _compiler_launcher(self):
+        launcher = self.options.get_safe("compiler_launcher")
+        if launcher is None or str(launcher).lower() == "none":
+            return None
+        return str(launcher)
+
+    @property
+    def _compiler_launcher_path(self):
+        path = tools.which(self._compiler_launcher)
+        if not path:
+            raise errors.ConanInvalidConfiguration("compiler_launcher={0} requested, but {0} not found in PATH".format(self._compiler_launcher))
+        return path
+
+    @property
+    def _compiler_cache_dir(self):
+        cache_dir = self.options.get_safe("compiler_cache_dir")
+        if cache_dir is None or str(cache_dir).lower() == "none":
+            return None
+        return os.path.abspath(os.path.expanduser(str(cache_dir)))
+
+    # NOTE: gn compiles from out/conan-build using relative paths (../../src/...),
+    # so only absolute paths that we pass via extra_cflags differ between conan cache folders
+    def _cache_friendly_path(self, path):
+        if not self._compiler_launcher:
+            return path
+        gn_build_dir = os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir)
+        try:
+            return os.path.relpath(path, gn_build_dir)
+        except ValueError:
+            # on Windows paths on different drives can not be relative
+            return path
+
+    @property
+    def _compiler_launcher_env(self):
+        env = {}
+        if self._compiler_launcher == "ccache":
+            # rewrite absolute paths below the conan storage to relative ones,
+            # do not hash the current directory (it is the per-package build folder)
+            try:
+                env["CCACHE_BASEDIR"] = os.path.commonpath([self.build_folder] + list(self.deps_cpp_info.include_paths))
+            except ValueError:
+                # on Windows paths on different drives have no common path
+                self.output.warn("dependencies are not on the drive of the build folder, CCACHE_BASEDIR is not set")
+            env["CCACHE_NOHASHDIR"] = "1"
+            if self._compiler_cache_dir:
+                env["CCACHE_DIR"] = self._compiler_cache_dir
+        elif self._compiler_launcher == "sccache":
+            if self._compiler_cache_dir:
+                env["SCCACHE_DIR"] = self._compiler_cache_dir
+        return env
+
+    # Counters of the compiler cache, None if the launcher can not print them machine-readable (ccache < 4.0).
+    # NOTE: counters are global (shared by all builds using the cache), they are not reset,
+    # statistics of this build are the difference of two snapshots
+    def _compiler_cache_stats(self):
+        buf = StringIO()
+        try:
+            if self._compiler_launcher == "ccache":
+                self.run('ccache --print-stats', output=buf)
+            elif self._compiler_launcher == "sccache":
+                self.run('sccache --show-stats --stats-format=json', output=buf)
+            else:
+                return None
+            return parse_compiler_cache_stats(self._compiler_launcher, buf.getvalue())
+        except Exception as err:
+            self.output.warn("can not read %s statistics: %s" % (self._compiler_launcher, err))
+            return None
+
+    def _log_compiler_cache_stats(self, stats_before):
+        if not self._compiler_launcher:
+            return
+        stats_after = self._compiler_cache_stats()
+        if stats_before is None or stats_after is None:
+            buf = StringIO()
+            self.run('%s --show-stats' % (self._compiler_launcher), output=buf)
+            self.output.info("%s statistics (all builds using the cache):\n%s" % (self._compiler_launcher, buf.getvalue()))
+            return
+        diff = compiler_cache_stats_diff(stats_before, stats_after)
+        self.output.info("%s statistics of this build:\n%s" % (self._compiler_launcher,
+            "\n".join("%s: %s" % (k, v) for k, v in diff.items()) or "no compilations"))
+
+    # approximate peak memory usage of a single compile / link job,
+    # used to avoid OOM when linking trace_processor_shell and unittests in parallel
+    _compile_job_memory_mb = 1024
+    _link_job_memory_mb = 4096
+
+    @property
+    def _memory_factor(self):
+        # instrumented builds need more memory per job
+        if self._sanitizer_enabled("is_asan") or self._sanitizer_enabled("is_msan") or self._sanitizer_enabled("is_tsan"):
+            return 2
+        return 1
+
+    def _int_option(self, name):
+        value = self.options.get_safe(name)
+        if value is None or str(value).lower() == "none":
+            return None
+        try:
+            value = int(str(value))
+        except ValueError:
+            raise errors.ConanInvalidConfiguration("option {} must be integer, got {}".format(name, value))
+        if value <= 0:
+            raise errors.ConanInvalidConfiguration("option {} must be positive, got {}".format(name, value))
+        return value
+
+    @property
+    def _ninja_jobs(self):
+        jobs = self._int_option("ninja_jobs")
+        if jobs:
+            return jobs
+        jobs = tools.cpu_count()
+        total, available = memory_info()
+        if available:
+            jobs = min(jobs, available // (self._compile_job_memory_mb * self._memory_factor * 1024 * 1024))
+        return max(1, jobs)
+
+    # NOTE: based on total (not available) memory, because it is passed to gn
+    # and must not change between incremental builds
+    @property
+    def _ninja_link_jobs(self):
+        jobs = self._int_option("ninja_link_jobs")
+        if jobs:
+            return jobs
+        jobs = tools.cpu_count()
+        total, available = memory_info()
+        if total:
+            jobs = min(jobs, total // (self._link_job_memory_mb * self._memory_factor * 1024 * 1024))
+        return max(1, jobs)
+
+    # `components` option -> ninja targets
+    _component_targets = {
+        "libperfetto": ["libperfetto", "libperfetto_client_experimental", "perfetto_trace_protos"],
+        # sdk/perfetto.cc is compiled by _build_sdk_library
+        "sdk": [],
+        "protoc": ["protoc"],
+        # ProtoZero is a zero-copy zero-alloc zero-syscall protobuf serialization libary purposefully built for Perfetto's tracing use cases.
+        "protozero_plugin": ["protozero_plugin"],
+        "cppgen_plugin": ["cppgen_plugin"],
+        "ipc_plugin": ["ipc_plugin"],
+        "trace_processor_shell": ["trace_processor_shell"],
+        "traced": ["traced"],
+        "traceconv": ["traceconv"],
+    }
+
+    # components selected by `components` option, None means everything gn builds by default
+    @property
+    def _components(self):
+        value = self._str_option("components")
+        if not value:
+            return None
+        components = [c for c in re.split(r"[,;\s]+", value.strip()) if c]
+        unknown = [c for c in components if c not in self._component_targets]
+        if unknown:
+            raise errors.ConanInvalidConfiguration("unknown components {}, expected some of {}".format(unknown, sorted(self._component_targets)))
+        return components
+
+    def _has_component(self, name):
+        return self._components is None or name in self._components
+
+    @property
+    def _with_sdk_library(self):
+        return self.options.get_safe("build_sdk_library") and self._has_component("sdk")
+
+    @property
+    def _ninja_targets(self):
+        if self._components is None:
+            targets = ["all"]
+            if not self.options.get_safe("perfetto_use_system_protobuf"):
+                targets.append("protoc")
+            targets.append("protozero_plugin")
+            return targets
+        targets = []
+        for component in self._components:
+            if component == "protoc" and self.options.get_safe("perfetto_use_system_protobuf"):
+                continue
+            targets += [t for t in self._component_targets[component] if t not in targets]
+        # executed by build()
+        if self.options.get_safe("run_benchmarks"):
+            targets.append("perfetto_benchmarks")
+        if self.options.get_safe("enable_perfetto_unittests"):
+            targets.append("perfetto_unittests")
+        return targets
+
+    _link_pool_name = "conan_link_pool"
+    _link_rule_tools = ["link", "solink", "solink_module"]
+
+    # Adds ninja pool `conan_link_pool` with `depth` to link rules of gn toolchains that do not use a pool
+    # (toolchains without `concurrent_links`), so links do not run with the full compile -j.
+    # NOTE: gn rewrites the generated .ninja files when gn files change, so the manifest is regenerated first
+    # and the pool is added again before every ninja run. Rule commands do not change, nothing is rebuilt.
+    def _add_link_pool(self, build_dir, depth):
+        self.run('ninja -C %s build.ninja' % (build_dir), cwd=self._source_subfolder)
+        full_build_dir = os.path.join(self._source_subfolder, build_dir)
+        patched = []
+        uses_pool = False
+        for root, _, files in os.walk(full_build_dir):
+            if "toolchain.ninja" not in files:
+                continue
+            path = os.path.join(root, "toolchain.ninja")
+            with open(path, "r") as f:
+                lines = f.read().split("\n")
+            result = []
+            rule = None
+            for line in lines + [None]:
+                if rule is not None and line is not None and line.startswith(" "):
+                    rule.append(line)
+                    continue
+                if rule is not None:
+                    if not any(l.strip().startswith("pool ") or l.strip().startswith("pool=") for l in rule[1:]):
+                        rule.insert(1, "  pool = %s" % (self._link_pool_name))
+                        patched.append(os.path.relpath(path, full_build_dir))
+                    result += rule
+                    rule = None
+                if line is None:
+                    break
+                name = line[len("rule "):].strip() if line.startswith("rule ") else None
+                if name and any(name == t or name.endswith("_" + t) for t in self._link_rule_tools):
+                    rule = [line]
+                else:
+                    result.append(line)
+            if result != lines:
+                with open(path, "w") as f:
+                    f.write("\n".join(result))
+            uses_pool = uses_pool or ("  pool = %s" % (self._link_pool_name)) in result
+        if not uses_pool:
+            return
+
+        # NOTE: pools are global in ninja, declared once in build.ninja before the toolchains are included
+        build_ninja = os.path.join(full_build_dir, "build.ninja")
+        with open(build_ninja, "r") as f:
+            content = f.read()
+        declaration = "pool %s\n  depth = %s\n" % (self._link_pool_name, depth)
+        content = re.sub(r"(?m)^pool %s\n  depth = \d+\n" % (self._link_pool_name), "", content)
+        with open(build_ninja, "w") as f:
+            f.write(declaration + content)
+        if patched:
+            self.output.info("link rules without pool in %s use %s with depth %s" % (build_dir, self._link_pool_name, depth))
+
+    # NOTE: ninja without targets builds the default `all`, i.e. components=sdk selects no gn targets
+    def _run_ninja(self, targets, build_dir=None):
+        build_dir = build_dir or self._gn_build_dir
+        if not targets:
+            self.output.info("no ninja targets in %s, skipping ninja" % (build_dir))
+            return
+        jobs = self._ninja_jobs
+        self._add_link_pool(build_dir, self._concurrent_links)
+        self.output.info("running ninja in %s with %s jobs (%s link jobs) for targets: %s" % (build_dir, jobs, self._concurrent_links, " ".join(targets)))
+        # -l: do not start new jobs if the load average is greater than CPU count
+        self.run('ninja -C %s -j %s -l %s %s' % (build_dir, jobs, tools.cpu_count(), " ".join(targets)), cwd=self._source_subfolder)
+
+    def _ninja_version(self):
+        buf = StringIO()
+        self.run("ninja --version", output=buf)
+        match = re.search(r"(\d+)\.(\d+)", buf.getvalue())
+        return tuple(int(v) for v in match.groups()) if match else (0, 0)
+
+    # Runs one ninja per build variant at the same time, all of them share ninja_jobs (sized for the most
+    # memory hungry variant), so the variant that builds longest gets jobs of the variants that already finished:
+    # ninja 1.13+ takes jobs from a GNU make jobserver fifo shared by all ninjas (POSIX),
+    # older ninja gets full -j and the shared load limit -l (same budget) throttles the sum of them.
+    # Returns {variant: ninja seconds}, output of each ninja is written to <build dir>/conan_ninja.log
+    def _run_ninja_matrix(self, variants, targets):
+        if not targets:
+            self.output.info("no ninja targets, skipping ninja for all build variants")
+            return dict((variant, 0.0) for variant in variants)
+        jobs = []
+        for variant in variants:
+            with self._build_variant(variant):
+                jobs.append(self._ninja_jobs)
+        jobs = min(jobs)
+        build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
+        env = dict(os.environ)
+        jobserver_dir = None
+        jobserver_fd = None
+        if platform.system() != "Windows" and self._ninja_version() >= (1, 13):
+            jobserver_dir = tempfile.mkdtemp(prefix="conan-jobserver-")
+            fifo = os.path.join(jobserver_dir, "fifo")
+            os.mkfifo(fifo)
+            # NOTE: kept open for reading and writing, so tokens survive while no ninja has the fifo open
+            jobserver_fd = os.open(fifo, os.O_RDWR)
+            # every ninja runs one job without a token
+            os.write(jobserver_fd, b"+" * max(0, jobs - len(variants)))
+            # NOTE: ninja ignores the jobserver if -j is passed
+            env["MAKEFLAGS"] = "-j%s --jobserver-auth=fifo:%s" % (jobs, fifo)
+            jobs_args = ["-l", str(tools.cpu_count())]
+            self.output.info("ninja jobserver with %s jobs shared by %s build variants" % (jobs, len(variants)))
+        else:
+            # NOTE: load average lags behind, so the sum may briefly exceed the budget
+            jobs_args = ["-j", str(jobs), "-l", str(min(jobs, tools.cpu_count()))]
+            self.output.info("ninja 1.13+ not found, every build variant gets -j %s, shared load limit %s" % (jobs, min(jobs, tools.cpu_count())))
+        running = {}
+        seconds = {}
+        failed = []
+        try:
+            for variant in variants:
+                with self._build_variant(variant):
+                    build_dir = self._gn_build_dir
+                    self._add_link_pool(build_dir, self._concurrent_links)
+                log_path = os.path.join(build_subfolder, build_dir, "conan_ninja.log")
+                log_file = open(log_path, "w")
+                self.output.info("running ninja in %s for targets: %s" % (build_dir, " ".join(targets)))
+                process = subprocess.Popen(["ninja", "-C", build_dir] + jobs_args + targets,
+                                           cwd=build_subfolder, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+                running[variant] = (process, log_file, log_path, time.time())
+            while running and not failed:
+                time.sleep(1)
+                for variant, (process, log_file, log_path, start) in list(running.items()):
+                    if process.poll() is None:
+                        continue
+                    log_file.close()
+                    del running[variant]
+                    seconds[variant] = time.time() - start
+                    self.output.info("ninja for %s finished in %.1fs with exit code %s" % (build_variant_name(variant), seconds[variant], process.returncode))
+                    if process.returncode != 0:
+                        with open(log_path, "r") as f:
+                            self.output.error("".join(f.readlines()[-50:]))
+                        failed.append(build_variant_name(variant))
+        finally:
+            # NOTE: on failure or KeyboardInterrupt other ninjas are stopped, ninja terminates its running jobs
+            for variant, (process, log_file, log_path, start) in running.items():
+                if process.poll() is None:
+                    self.output.warn("stopping ninja for %s" % (build_variant_name(variant)))
+                    process.terminate()
+                    try:
+                        process.wait(timeout=30)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                        process.wait()
+                log_file.close()
+            if jobserver_fd is not None:
+                os.close(jobserver_fd)
+            if jobserver_dir is not None:
+                shutil.rmtree(jobserver_dir, ignore_errors=True)
+        if failed:
+            raise errors.ConanException("ninja failed for build variants: %s" % (", ".join(failed)))
+        return seconds
+
+    _linker_binaries = {
+        "lld": ["ld.lld"],
+        "mold": ["mold", "ld.mold"],
+    }
+
+    @property
+    def _linker(self):
+        return self._str_option("linker")
+
+    # real linker: bin dirs of tool_requires first, then PATH, GNU ld if `linker` is not set
+    @property
+    def _linker_path(self):
+        names = self._linker_binaries[self._linker] if self._linker else ["ld"]
+        for bin_path in self.deps_cpp_info.bin_paths:
+            for name in names:
+                if os.path.exists(os.path.join(bin_path, name)):
+                    return os.path.join(bin_path, name)
+        for name in names:
+            path = tools.which(name)
+            if path:
+                return path
+        raise errors.ConanInvalidConfiguration("linker={} requested, but none of {} found in tool_requires or PATH".format(self._linker or "default", ", ".join(names)))
+
+    # shared by all build variants, relative `--log` is resolved from the ninja build dir of the link
+    @property
+    def _linker_shim_dir(self):
+        return os.path.join(self.build_folder, self._source_subfolder, "out", "conan-linker")
+
+    _link_stats_log = "conan_link_stats.jsonl"
+
+    # Compiler drivers look up the linker in -B dirs first: `ld.lld` for -fuse-ld=lld, `ld` otherwise.
+    # NOTE: mold is installed as `ld` (its documented -B setup), -fuse-ld=mold needs gcc 12+.
+    def _write_linker_shims(self):
+        if not self._linker and not self.options.get_safe("link_stats"):
+            return
+        linker_path = self._linker_path
+        shim_name = "ld.lld" if self._linker == "lld" else "ld"
+        if os.path.exists(self._linker_shim_dir):
+            shutil.rmtree(self._linker_shim_dir)
+        os.makedirs(self._linker_shim_dir)
+        shim_path = os.path.join(self._linker_shim_dir, shim_name)
+        if self.options.get_safe("link_stats"):
+            script = os.path.join(self.build_folder, "scripts", "perfetto_link_stats.py")
+            with open(shim_path, "w") as f:
+                f.write('#!/bin/sh\nexec "%s" "%s" --linker "%s" --log "%s" -- "$@"\n' % (sys.executable, script, linker_path, self._link_stats_log))
+            os.chmod(shim_path, os.stat(shim_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        else:
+            os.symlink(linker_path, shim_path)
+        self.output.info("linking with %s%s" % (linker_path, " (link_stats=True)" if self.options.get_safe("link_stats") else ""))
+
+    @property
+    def _linker_flags(self):
+        flags = []
+        if self._linker or self.options.get_safe("link_stats"):
+            flags += ["-B%s" % (self._linker_shim_dir.replace("\\", "/"))]
+        if self._linker == "lld":
+            flags += ["-fuse-ld=lld"]
+        if self.options.get_safe("gdb_index"):
+            flags += ["-Wl,--gdb-index"]
+        if self.options.get_safe("compress_debug_sections"):
+            flags += ["-Wl,--compress-debug-sections=zlib"]
+        return flags
+
+    # compile flags of split_dwarf, gdb_index and compress_debug_sections
+    @property
+    def _debug_info_flags(self):
+        flags = []
+        if self.options.get_safe("split_dwarf"):
+            flags += ["-gsplit-dwarf"]
+        if self.options.get_safe("gdb_index"):
+            flags += ["-ggnu-pubnames"]
+        if self.options.get_safe("compress_debug_sections"):
+            flags += ["-gz"]
+        return flags
+
+    # records of scripts/perfetto_link_stats.py since the previous build report, the log is consumed
+    def _read_link_stats(self):
+        log_path = os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, self._link_stats_log)
+        if not os.path.exists(log_path):
+            return []
+        records = []
+        with open(log_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        os.remove(log_path)
+        return records
+
+    @property
+    def _thin_lto_flags(self):
+        return ["-flto=thin"] if self.options.get_safe("thin_lto") else []
+
+    _pgo_instrument_flags = ["-fprofile-instr-generate"]
+
+    def _pgo_use_flags(self, profdata):
+        # NOTE: functions without profile data (i.e. not reached by the training workload) are expected
+        return ["-fprofile-instr-use=%s" % (profdata.replace("\\", "/")), "-Wno-profile-instr-unprofiled", "-Wno-profile-instr-out-of-date"]
+
+    @property
+    def _pgo_build_dir(self):
+        return "out/conan-pgo-instrument"
+
+    @property
+    def _pgo_dir(self):
+        return os.path.join(self.build_folder, self._source_subfolder, "out", "conan-pgo")
+
+    @property
+    def _llvm_profdata(self):
+        if "LLVM_PROFDATA" in os.environ:
+            return os.environ["LLVM_PROFDATA"]
+        if self.settings.compiler == "apple-clang":
+            return tools.XCRun(self.settings).find("llvm-profdata")
+        path = tools.which("llvm-profdata")
+        if not path:
+            raise errors.ConanInvalidConfiguration("pgo=True requires llvm-profdata in PATH or LLVM_PROFDATA env. var.")
+        return path
+
+    # Stage 1 of the profile-guided build: builds instrumented libperfetto, trace_processor_shell and training workload
+    # (linked with instrumented sdk/perfetto.cc) in separate out dirs, runs them and merges raw profiles.
+    # Returns path to .profdata named after its content, so ninja rebuilds the final stage only if profile changed.
+    def _build_pgo_profile(self, gn_opts, sdk_flags):
+        build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
+        pgo_recipe_dir = os.path.join(self.build_folder, "cmake", "pgo")
+        profile_info_path = os.path.join(self._pgo_dir, "conan_pgo_profile.json")
+
+        fingerprint = self._gn_fingerprint(gn_opts)
+        fingerprint["sdk_flags"] = sdk_flags
+        fingerprint["workload"] = dict((name, file_sha256(os.path.join(pgo_recipe_dir, name)))
+                                       for name in sorted(os.listdir(pgo_recipe_dir)))
+        if os.path.exists(profile_info_path):
+            with open(profile_info_path, "r") as f:
+                profile_info = json.load(f)
+            if profile_info.get("fingerprint") == fingerprint and os.path.exists(profile_info.get("profdata", "")):
+                self.output.info("instrumented build did not change, reusing profile %s" % (profile_info["profdata"]))
+                return profile_info["profdata"]
+
+        self.run('gn gen %s %s' % (self._pgo_build_dir, gn_opts), cwd=self._source_subfolder)
+        # NOTE: enable_perfetto_trace_processor=None means gn default (enabled)
+        with_trace_processor = str(self.options.get_safe("enable_perfetto_trace_processor")).lower() != "false"
+        # NOTE: libperfetto is compiled from the same sources as sdk/perfetto.cc,
+        # its functions get counters of the workload by their (mangled) names
+        instrumented_targets = ["libperfetto"] if self._has_component("libperfetto") else []
+        if with_trace_processor:
+            instrumented_targets.append("trace_processor_shell")
+        with tools.environment_append(self._compiler_launcher_env):
+            if instrumented_targets:
+                self._run_ninja(instrumented_targets, build_dir=self._pgo_build_dir)
+
+            cmake = CMake(self)
+            cmake.parallel = True
+            cmake.definitions["PERFETTO_SDK_DIR"] = os.path.join(build_subfolder, "sdk").replace("\\", "/")
+            cmake.definitions["PERFETTO_SDK_OUTPUT_DIR"] = os.path.join(build_subfolder, self._pgo_build_dir, "conan-sdk").replace("\\", "/")
+            cmake.definitions["PERFETTO_SDK_EXTRA_FLAGS"] = " ".join(sdk_flags)
+            cmake.definitions["CMAKE_EXE_LINKER_FLAGS"] = " ".join(self._pgo_instrument_flags)
+            cmake.configure(source_folder=pgo_recipe_dir,
+                            build_folder=os.path.join(build_subfolder, self._pgo_build_dir, "conan-pgo-training"))
+            cmake.build()
+
+        raw_dir = os.path.join(self._pgo_dir, "raw")
+        if os.path.exists(raw_dir):
+            shutil.rmtree(raw_dir)
+        os.makedirs(raw_dir)
+        trace_path = os.path.join(raw_dir, "training.perfetto-trace")
+        workload = os.path.join(build_subfolder, self._pgo_build_dir, "conan-pgo-training", "bin", "training_workload")
+        with tools.environment_append({"LLVM_PROFILE_FILE": os.path.join(raw_dir, "%p.profraw")}):
+            self.run('"%s" --output "%s"' % (workload, trace_path))
+            if with_trace_processor:
+                trace_processor = os.path.join(build_subfolder, self._pgo_build_dir, "trace_processor_shell")
+                self.run('"%s" -q "%s" "%s"' % (trace_processor, os.path.join(pgo_recipe_dir, "training_queries.sql"), trace_path))
+
+        profraw_files = sorted(glob.glob(os.path.join(raw_dir, "*.profraw")))
+        if not profraw_files:
+            raise errors.ConanException("pgo: training workload did not produce any .profraw files in %s" % (raw_dir))
+        merged = os.path.join(self._pgo_dir, "merged.profdata")
+        self.run('"%s" merge -output="%s" %s' % (self._llvm_profdata, merged, " ".join('"%s"' % f for f in profraw_files)))
+        profdata = os.path.join(self._pgo_dir, "perfetto-%s.profdata" % (file_sha256(merged)[:16]))
+        for old_profdata in glob.glob(os.path.join(self._pgo_dir, "perfetto-*.profdata")):
+            if old_profdata != profdata:
+                os.remove(old_profdata)
+        shutil.move(merged, profdata)
+        with open(profile_info_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "profdata": profdata}, f, indent=2)
+        self.output.info("pgo: merged %s raw profiles into %s" % (len(profraw_files), profdata))
+        return profdata
+
+    _build_report_top_n = 30
+
+    @property
+    def _build_report_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_build_report.json")
+
+    @property
+    def _gn_timing_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_gn_timing.json")
+
+    @property
+    def _ninja_log_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, ".ninja_log")
+
+    def _ninja_log_size(self):
+        return os.path.getsize(self._ninja_log_path) if os.path.exists(self._ninja_log_path) else 0
+
+    # parses output of `gn gen --time`
+    def _save_gn_timing(self, output):
+        timing = {"time": time.time(), "gen_seconds": None, "targets": None, "files": None, "details": []}
+        match = re.search(r"Made (\d+) targets from (\d+) files in (\d+)ms", output)
+        if match:
+            timing["targets"] = int(match.group(1))
+            timing["files"] = int(match.group(2))
+            timing["gen_seconds"] = int(match.group(3)) / 1000.0
+        # i.e. "Total loading time: 1234ms"
+        for line in output.splitlines():
+            if re.search(r"\d+(\.\d+)?\s*ms\b", line) and not line.startswith("Done."):
+                timing["details"].append(line.strip())
+        with open(self._gn_timing_path, "w") as f:
+            json.dump(timing, f, indent=2)
+
+    def _write_build_report(self, ninja_log_offset, ninja_seconds):
+        links = self._read_link_stats()
+        report = {"commit": self.commit, "gn": None, "ninja_seconds": ninja_seconds, "ninja": None,
+                  "linker": {"linker": self._linker or "default", "links": links,
+                             "peak_rss_mb": max(link["max_rss_mb"] for link in links) if links else None}}
+        if os.path.exists(self._gn_timing_path):
+            with open(self._gn_timing_path, "r") as f:
+                report["gn"] = json.load(f)
+        if os.path.exists(self._ninja_log_path):
+            report["ninja"] = ninja_build_report(read_ninja_log(self._ninja_log_path, ninja_log_offset), self._build_report_top_n)
+        with open(self._build_report_path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        ninja = report["ninja"] or {}
+        if ninja.get("steps"):
+            self.output.info("ninja: %s steps, %.1fs wall, %.1f CPU-seconds, effective parallelism %.1f, critical path %.1fs" % (
+                ninja["steps"], ninja["wall_seconds"], ninja["cpu_seconds"], ninja["effective_parallelism"] or 0, ninja["critical_path_seconds"]))
+            if ninja["link"]["steps"]:
+                self.output.info("link (%s): %s steps, %.1fs wall, %.1f CPU-seconds" % (
+                    report["linker"]["linker"], ninja["link"]["steps"], ninja["link"]["wall_seconds"], ninja["link"]["cpu_seconds"]))
+        if links:
+            peak = max(links, key=lambda link: link["max_rss_mb"])
+            self.output.info("peak linker RSS %.0f MB (%s), %s links" % (peak["max_rss_mb"], peak["output"], len(links)))
+        self.output.info("build report written to %s" % (self._build_report_path))
+
+    @property
+    def _benchmark_results_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_benchmarks.json")
+
+    @property
+    def _benchmark_comparison_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_benchmark_comparison.json")
+
+    def _str_option(self, name):
+        value = self.options.get_safe(name)
+        if value is None or str(value).lower() == "none":
+            return None
+        return str(value)
+
+    @property
+    def _benchmark_regression_threshold(self):
+        value = self._str_option("benchmark_regression_threshold") or "10"
+        try:
+            return float(value)
+        except ValueError:
+            raise errors.ConanInvalidConfiguration("option benchmark_regression_threshold must be a number, got {}".format(value))
+
+    @property
+    def _unittest_shards_dir(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan-unittests")
+
+    @property
+    def _unittest_results_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_unittests.xml")
+
+    @property
+    def _unittest_timing_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_unittest_timing.json")
+
+    @property
+    def _unittest_shards(self):
+        return self._int_option("unittest_shards") or tools.cpu_count()
+
+    @property
+    def _unittest_slow_threshold(self):
+        value = self._str_option("unittest_slow_threshold") or "1"
+        try:
+            return float(value)
+        except ValueError:
+            raise errors.ConanInvalidConfiguration("option unittest_slow_threshold must be a number, got {}".format(value))
+
+    # {test name: seconds} from `unittest_baseline` or, if not set, from the previous run in this build dir
+    def _unittest_baseline(self):
+        baseline_path = self._str_option("unittest_baseline")
+        if baseline_path:
+            baseline_path = os.path.abspath(os.path.expanduser(baseline_path))
+            if not os.path.exists(baseline_path):
+                raise errors.ConanInvalidConfiguration("not found: unittest_baseline {}".format(baseline_path))
+        elif os.path.exists(self._unittest_timing_path):
+            baseline_path = self._unittest_timing_path
+        else:
+            return None, {}
+        with open(baseline_path, "r") as f:
+            return baseline_path, json.load(f).get("tests", {})
+
+    # Runs perfetto_unittests split into `unittest_shards` processes (GTEST_TOTAL_SHARDS / GTEST_SHARD_INDEX),
+    # merges gtest XML of all shards, reports tests slower than `unittest_slow_threshold` seconds
+    # and keeps per-test timing as baseline for the next run.
+    def _run_unittests(self):
+        if tools.cross_building(self):
+            self.output.warn("cross building, perfetto_unittests are not executed")
+            return
+        build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
+        binary = os.path.join(build_subfolder, self._gn_build_dir, "perfetto_unittests")
+        if self.settings.os == "Windows":
+            binary += ".exe"
+        if os.path.exists(self._unittest_shards_dir):
+            shutil.rmtree(self._unittest_shards_dir)
+        os.makedirs(self._unittest_shards_dir)
+        baseline_path, baseline = self._unittest_baseline()
+
+        shards = self._unittest_shards
+        self.output.info("running %s in %s shards" % (os.path.relpath(binary, build_subfolder), shards))
+        start = time.time()
+        running = {}
+        for index in range(shards):
+            xml_path = os.path.join(self._unittest_shards_dir, "shard-%s.xml" % (index))
+            log_path = os.path.join(self._unittest_shards_dir, "shard-%s.log" % (index))
+            log_file = open(log_path, "w")
+            env = dict(os.environ)
+            env.update({"GTEST_TOTAL_SHARDS": str(shards), "GTEST_SHARD_INDEX": str(index), "GTEST_OUTPUT": "xml:%s" % (xml_path)})
+            # NOTE: test data paths are relative to the checkout
+            process = subprocess.Popen([binary], cwd=build_subfolder, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+            running[index] = (process, log_file, log_path, xml_path)
+        shard_seconds = {}
+        failed_shards = []
+        xml_paths = []
+        while running:
+            time.sleep(0.2)
+            for index, (process, log_file, log_path, xml_path) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                log_file.close()
+                del running[index]
+                shard_seconds[index] = time.time() - start
+                if os.path.exists(xml_path):
+                    xml_paths.append(xml_path)
+                # NOTE: a crashed shard has no XML, ASan/LSan exit-time checks fail after gtest wrote a clean XML
+                if process.returncode != 0:
+                    with open(log_path, "r") as f:
+                        self.output.error("perfetto_unittests shard %s exited with code %s:\n%s" % (index, process.returncode, "".join(f.readlines()[-50:])))
+                    failed_shards.append(index)
+        wall_seconds = time.time() - start
+
+        tests, merged = merge_gtest_xml(sorted(xml_paths))
+        ElementTree.ElementTree(merged).write(self._unittest_results_path, encoding="utf-8", xml_declaration=True)
+        timing = {
+            "commit": self.commit,
+            "shards": shards,
+            "wall_seconds": wall_seconds,
+            "test_seconds": sum(test["seconds"] for test in tests.values()),
+            "shard_seconds": [shard_seconds[index] for index in sorted(shard_seconds)],
+            "baseline": baseline_path,
+            "slow_threshold_seconds": self._unittest_slow_threshold,
+            "slow_tests": slow_gtests(tests, baseline, self._unittest_slow_threshold),
+            "tests": dict((name, test["seconds"]) for name, test in tests.items() if test["status"] != "skipped"),
+        }
+        with open(self._unittest_timing_path, "w") as f:
+            json.dump(timing, f, indent=2, sort_keys=True)
+
+        failed = sorted(name for name, test in tests.items() if test["status"] == "failed")
+        counts = dict((status, sum(1 for test in tests.values() if test["status"] == status)) for status in ["passed", "failed", "skipped"])
+        self.output.info("perfetto_unittests: %s passed, %s failed, %s skipped in %.1fs wall (%.1fs of tests, slowest shard %.1fs)" % (
+            counts["passed"], counts["failed"], counts["skipped"], wall_seconds, timing["test_seconds"], max(timing["shard_seconds"] or [0])))
+        for row in timing["slow_tests"][:self._build_report_top_n]:
+            baseline_seconds = row["baseline_seconds"]
+            self.output.warn("slow test %s: %.2fs%s" % (row["name"], row["seconds"],
+                " (baseline %.2fs)" % (baseline_seconds) if baseline_seconds is not None else ""))
+        self.output.info("unittest results written to %s, timing to %s" % (self._unittest_results_path, self._unittest_timing_path))
+
+        if failed or failed_shards:
+            raise errors.ConanException("perfetto_unittests failed in %s: %s tests failed%s%s" % (self._gn_build_dir, len(failed),
+                ", shards exited with non-zero code: %s" % (", ".join(str(index) for index in failed_shards)) if failed_shards else "",
+                ": %s" % (", ".join(failed[:20])) if failed else ""))
+
+    # Runs perfetto_benchmarks with Google Benchmark JSON output
+    # and compares median cpu times with `benchmark_baseline`.
+    def _run_benchmarks(self):
+        if tools.cross_building(self):
+            self.output.warn("cross building, perfetto_benchmarks are not executed")
+            return
+        for path in [self._benchmark_results_path, self._benchmark_comparison_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        args = ["--benchmark_out=%s" % (self._benchmark_results_path),
+                "--benchmark_out_format=json",
+                "--benchmark_repetitions=3",
+                "--benchmark_report_aggregates_only=true"]
+        benchmark_filter = self._str_option("benchmark_filter")
+        if benchmark_filter:
+            args.append('"--benchmark_filter=%s"' % (benchmark_filter))
+        self.run('%s/perfetto_benchmarks %s' % (self._gn_build_dir, " ".join(args)), cwd=self._source_subfolder)
+        self.output.info("benchmark results written to %s" % (self._benchmark_results_path))
+
+        baseline_path = self._str_option("benchmark_baseline")
+        if not baseline_path:
+            return
+        baseline_path = os.path.abspath(os.path.expanduser(baseline_path))
+        if not os.path.exists(baseline_path):
+            raise errors.ConanInvalidConfiguration("not found: benchmark_baseline {}".format(baseline_path))
+        with open(baseline_path, "r") as f:
+            baseline = benchmark_times(json.load(f))
+        with open(self._benchmark_results_path, "r") as f:
+            current = benchmark_times(json.load(f))
+        comparison = compare_benchmarks(baseline, current, self._benchmark_regression_threshold)
+        comparison["baseline"] = baseline_path
+        with open(self._benchmark_comparison_path, "w") as f:
+            json.dump(comparison, f, indent=2, sort_keys=True)
+
+        for row in comparison["benchmarks"]:
+            self.output.info("%s%s: %.1f ns -> %.1f ns (%+.1f%%)" % ("REGRESSION " if row["regression"] else "",
+                row["name"], row["baseline_ns"], row["current_ns"], row["change_percent"]))
+        if comparison["missing_in_current"]:
+            self.output.warn("benchmarks missing compared to baseline: %s" % (", ".join(comparison["missing_in_current"])))
+        if comparison["regressions"]:
+            message = "%s benchmarks are slower than baseline %s by more than %s%%: %s" % (len(comparison["regressions"]),
+                baseline_path, comparison["threshold_percent"], ", ".join(comparison["regressions"]))
+            if self.options.get_safe("benchmark_regression_action") == "fail":
+                raise errors.ConanException(message)
+            self.output.warn(message)
+        else:
+            self.output.info("no benchmark regressions compared to baseline %s" % (baseline_path))
+
+    # Runs `gn gen` in the build dir of the active variant,
+    # skipped if the gn fingerprint did not change since the previous build()
+    def _gn_gen(self, gn_opts):
+        self.output.info("gn options: %s" % (gn_opts))
+        gn_fingerprint = self._gn_fingerprint(gn_opts)
+        if self.options.get_safe("incremental_build") and self._is_gn_build_dir_up_to_date(gn_fingerprint):
+            self.output.info("gn configuration did not change, skipping gn gen and reusing %s" % (self._gn_build_dir))
+            return
+
+        # NOTE: fingerprint is saved only after successful gn gen and gn options check
+        self._remove_gn_fingerprint()
+
+        # Checks that conan options match gn options
+        #  --runtime-deps-list-file=runtime-deps.txt
+        gn_gen_output = StringIO()
+        try:
+            self.run('gn gen %s --time -v %s ' %(self._gn_build_dir, gn_opts), output=gn_gen_output, cwd=self._source_subfolder)
+        finally:
+            self.output.info(gn_gen_output.getvalue())
+        self._save_gn_timing(gn_gen_output.getvalue())
+
+        gn_options = self.load_gn_options(build_dir=self._gn_build_dir, cwd=self._source_subfolder)
+        self.log_gn_options(gn_options)
+
+        if self.options.get_safe("check_gn_options"):
+            self.check_gn_options(gn_options)
+
+        if "concurrent_links" not in gn_options:
+            self.output.warn("gn toolchain does not declare concurrent_links, link rules of %s get pool %s" % (self._gn_build_dir, self._link_pool_name))
+
+        self._save_gn_fingerprint(gn_fingerprint)
+
+    # gn args of the active matrix variant. Flags from the profile were computed for settings.build_type,
+    # their build type flags (i.e. -O3 vs -g) are replaced with flags of the variant build type.
+    def _variant_gn_opts(self, ar_opt, cc_opt, cxx_opt, flags, toolchain_opts):
+        cflags, cxxflags, ldflags = flags
+        variant_settings = self.settings.copy()
+        variant_settings.build_type = self._active_build_type
+        old_flags = build_type_flags(self.settings)
+        new_flags = build_type_flags(variant_settings)
+        return '"--args=%s %s %s %s %s %s %s"' % (ar_opt, cc_opt, cxx_opt,
+            'extra_cflags=\\"%s\\"' % (replace_flags(cflags, old_flags, new_flags)),
+            'extra_cxxflags=\\"%s\\"' % (replace_flags(cxxflags, old_flags, new_flags)),
+            'extra_ldflags=\\"%s\\"' % (ldflags),
+            " ".join(self._gn_option_args() + toolchain_opts))
+
+    # protoc of the protobuf tool_require
+    @property
+    def _tool_protoc(self):
+        bin_paths = self.deps_cpp_info["protobuf"].bin_paths
+        for bin_path in bin_paths:
+            for name in ["protoc", "protoc.exe"]:
+                if os.path.exists(os.path.join(bin_path, name)):
+                    return os.path.join(bin_path, name)
+        raise errors.ConanInvalidConfiguration("protoc_from_tool_requires=True, but protoc not found in {}".format(bin_paths))
+
+    # NOTE: with perfetto_use_system_protobuf gn runs `protoc` from PATH
+    @property
+    def _tool_protobuf_env(self):
+        if not self.options.get_safe("protoc_from_tool_requires"):
+            return {}
+        return {"PATH": [os.path.dirname(self._tool_protoc)]}
+
+    # Generated .pb.cc files must be compiled with headers of the same protobuf minor version as protoc,
+    # consumers get headers from buildtools/protobuf (see perfetto-buildtools component).
+    def _check_tool_protobuf(self):
+        if tools.cross_building(self):
+            raise errors.ConanInvalidConfiguration("protoc_from_tool_requires=True links libprotobuf of the build context, it can not be used when cross building")
+        buf = StringIO()
+        self.run('"%s" --version' % (self._tool_protoc), output=buf)
+        match = re.search(r"(\d+)\.(\d+)\.(\d+)", buf.getvalue())
+        if not match:
+            raise errors.ConanInvalidConfiguration("can not parse protoc version from: {}".format(buf.getvalue()))
+        tool_version = tuple(int(v) for v in match.groups())
+        # i.e. #define GOOGLE_PROTOBUF_VERSION 3009001
+        common_h = os.path.join(self._source_subfolder, "buildtools", "protobuf", "src", "google", "protobuf", "stubs", "common.h")
+        if not os.path.exists(common_h):
+            self.output.warn("not found: %s, protobuf version of perfetto is not checked" % (common_h))
+            return
+        with open(common_h, "r") as f:
+            match = re.search(r"#define GOOGLE_PROTOBUF_VERSION (\d+)", f.read())
+        if not match:
+            self.output.warn("GOOGLE_PROTOBUF_VERSION not found in %s, protobuf version of perfetto is not checked" % (common_h))
+            return
+        version = int(match.group(1))
+        perfetto_version = (version // 1000000, version // 1000 % 1000, version % 1000)
+        if tool_version[:2] != perfetto_version[:2]:
+            raise errors.ConanInvalidConfiguration("protoc_from_tool_requires=True: protobuf tool_require is {}, but perfetto uses protobuf {}".format(
+                ".".join(str(v) for v in tool_version), ".".join(str(v) for v in perfetto_version)))
+        self.output.info("using protoc %s from protobuf tool_require (perfetto uses protobuf %s)" % (
+            ".".join(str(v) for v in tool_version), ".".join(str(v) for v in perfetto_version)))
+
     def _lib_path_arg(self, path):
         argname = "LIBPATH:" if self.settings.compiler == "Visual Studio" or self._is_clang_cl() else "L"
         return "-{}'{}'".format(argname, path.replace("\\", "/"))
@@ -816,9 +2717,13 @@ if (false)""")
         with tools.vcvars(self.settings, only_diff=False): # https://github.com/conan-io/conan/issues/6577
             env_build = AutoToolsBuildEnvironment(self)
             env_build.fpic = self.options.fpic
-            with tools.environment_append(env_build.vars):
+            with tools.environment_append(merge_two_dicts(env_build.vars, self._tool_protobuf_env)):
+                self._extend_sparse_sources()
                 self._patch_sources()
 
+                if self.options.get_safe("protoc_from_tool_requires"):
+                    self._check_tool_protobuf()
+
                 if self.options.get_safe("gen_amalgamated"):
                     self._patch_sources_to_gen_amalgamated()
                     # FIXES: fatal: unsafe repository ('C:/.conan/c543dd/1/source_subfolder' is owned by someone else) 
@@ -854,37 +2759,43 @@ if (false)""")
                         cflags += ' -Wno-c99-designator -Wno-unused-parameter -Wno-error '
                         cxxflags += ' -Wno-c99-designator -Wno-unused-parameter -Wno-error '
 
-                #if self.options.get_safe("perfetto_use_system_protobuf"):
-                    #cflags += ' -I%s ' % self.deps_cpp_info['protobuf'].cpp_info.includedirs
-                    #cxxflags += ' -I%s ' % self.deps_cpp_info['protobuf'].
+                # NOTE: gn links system protobuf as -lprotobuf (see gn/BUILD.gn), headers are in deps_cpp_info.include_paths
+                if self.options.get_safe("protoc_from_tool_requires"):
+                    ldflags += ' %s ' % " ".join("-L'{}'".format(self._cache_friendly_path(lib).replace("\\", "/")) for lib in self.deps_cpp_info["protobuf"].lib_paths)
                 
                 cflags += ' %s ' % " ".join(self.deps_cpp_info.cflags)
 
                 cxxflags += ' %s ' % " ".join(self.deps_cpp_info.cxxflags) 
-                cxxflags += ' %s ' % " ".join("-I'{}'".format(inc.replace("\\", "/")) for inc in self.deps_cpp_info.include_paths)
+                cxxflags += ' %s ' % " ".join("-I'{}'".format(self._cache_friendly_path(inc).replace("\\", "/")) for inc in self.deps_cpp_info.include_paths)
                 cxxflags += ' %s ' % " ".join("-D'{}'".format(inc.replace("\\", "/")) for inc in self.deps_cpp_info.defines)
 
                 ldflags += ' %s ' % " ".join(self.deps_cpp_info.exelinkflags)
                 ldflags += ' %s ' % " ".join(self.deps_cpp_info.sharedlinkflags)
                 ldflags += ' %s ' % " ".join(self._lib_path_arg(l) for l in self.deps_cpp_info.lib_paths)
 
-                cflags = 'extra_cflags=\\"%s\\"' % cflags
-                cxxflags = 'extra_cxxflags=\\"%s\\"' % cxxflags
-                ldflags = 'extra_ldflags=\\"%s\\"' % ldflags
+                cflags += ' %s ' % " ".join(self._thin_lto_flags)
+                cxxflags += ' %s ' % " ".join(self._thin_lto_flags)
+                ldflags += ' %s ' % " ".join(self._thin_lto_flags)
 
-                opts = []
+                cflags += ' %s ' % " ".join(self._debug_info_flags)
+                cxxflags += ' %s ' % " ".join(self._debug_info_flags)
+                self._write_linker_shims()
+                ldflags += ' %s ' % " ".join(self._linker_flags)
 
-                for k,v in self.options.items():
-                    if k in self.perfetto_options:
-                        opts += [("%s=%s" % (k,v)).lower()]
+                # gn args that are same for all build variants
+                toolchain_opts = []
 
-                # TODO: set (based on conan data) "cc" and "cc_wrapper", but only when use_bundled_compiler=False 
+                # TODO: set (based on conan data) "cc", but only when use_bundled_compiler=False
+                if self._compiler_launcher:
+                    toolchain_opts += ['cc_wrapper=\\"%s\\"' % (self._compiler_launcher_path.replace("\\", "/"))]
                 #compiler_command = os.environ.get('CXX', None)
 
                 self.output.info("self.settings.compiler: %s" % (self.settings.compiler))
 
                 if self.options.append_target_arg:
-                    opts = self.append_target_opts(opts)
+                    toolchain_opts = self.append_target_opts(toolchain_opts)
+
+                opts = self._gn_option_args() + toolchain_opts
 
                 ar_opt = ""
                 cc_opt = ""
@@ -900,44 +2811,65 @@ if (false)""")
                 
                 #raise errors.ConanInvalidConfiguration("os.environ {} {} {} {}".format(ar_opt, cc_opt, cxx_opt, os.environ))
                 
+                # flags used to compile sdk/perfetto.cc outside of gn (see _build_sdk_library)
+                sdk_flags = self._sanitizer_flags + self._thin_lto_flags + self._debug_info_flags
+
+                if self.options.get_safe("pgo"):
+                    instrument_flags = " ".join(self._pgo_instrument_flags)
+                    instrument_gn_opts = '"--args=%s %s %s %s %s %s %s"' % (ar_opt, cc_opt, cxx_opt,
+                        'extra_cflags=\\"%s %s\\"' % (cflags, instrument_flags),
+                        'extra_cxxflags=\\"%s %s\\"' % (cxxflags, instrument_flags),
+                        'extra_ldflags=\\"%s %s\\"' % (ldflags, instrument_flags),
+                        " ".join(opts))
+                    profdata = self._build_pgo_profile(instrument_gn_opts, self._sanitizer_flags + self._pgo_instrument_flags)
+                    pgo_use_flags = self._pgo_use_flags(profdata)
+                    cflags += ' %s ' % " ".join(pgo_use_flags)
+                    cxxflags += ' %s ' % " ".join(pgo_use_flags)
+                    sdk_flags += pgo_use_flags
+
+                # NOTE: matrix_variants are configured from the same flags, see _variant_gn_opts
+                variant_flags = (cflags, cxxflags, ldflags)
+
+                cflags = 'extra_cflags=\\"%s\\"' % cflags
+                cxxflags = 'extra_cxxflags=\\"%s\\"' % cxxflags
+                ldflags = 'extra_ldflags=\\"%s\\"' % ldflags
+
                 gn_opts = '"--args=%s %s %s %s %s %s %s"' % (ar_opt, cc_opt, cxx_opt, cflags, cxxflags, ldflags, " ".join(opts))
-                self.output.info("gn options: %s" % (gn_opts))
-
-                # Checks that conan options match gn options
-                #  --runtime-deps-list-file=runtime-deps.txt
-                self.run('gn gen out/conan-build --time -v %s ' %(gn_opts), cwd=self._source_subfolder)
-
-                self.log_gn_options(build_dir="out/conan-build", cwd=self._source_subfolder)
-
-                if self.options.get_safe("check_gn_options"):
-                    failed = False
-                    failed_options = []
-                    for k,v in self.options.items():
-                        if k in self.perfetto_options:       
-                            actual = self.get_gn_option_value(option_name=k, build_dir="out/conan-build", cwd=self._source_subfolder)
-                            if not ("%s" % actual) == ("%s" % v):
-                                failed = True
-                                failed_options.append("in %s: %s => %s" % ( k, v, actual ))
-                                self.output.warn("Mismatch in %s: %s => %s" % ( k, v, actual ))
-                    if failed:
-                        raise errors.ConanInvalidConfiguration("Final gn configuration did not match requested config for options {}".format(str(failed_options)))
-            
-                self.run('ninja -C out/conan-build', cwd=self._source_subfolder)
 
-                if not self.options.get_safe("perfetto_use_system_protobuf"):
-                    self.run('ninja -C out/conan-build protoc', cwd=self._source_subfolder)
+                self._gn_gen(gn_opts)
+
+                with tools.environment_append(self._compiler_launcher_env):
+                    compiler_cache_stats = self._compiler_cache_stats()
+
+                    if self._matrix_variants:
+                        # NOTE: all variants share patched sources in source_subfolder
+                        ninja_log_offsets = {}
+                        for variant in self._build_variants:
+                            with self._build_variant(variant):
+                                if variant != self._build_variants[0]:
+                                    self._gn_gen(self._variant_gn_opts(ar_opt, cc_opt, cxx_opt, variant_flags, toolchain_opts))
+                                ninja_log_offsets[variant] = self._ninja_log_size()
+                        ninja_seconds = self._run_ninja_matrix(self._build_variants, self._ninja_targets)
+                        for variant in self._build_variants:
+                            with self._build_variant(variant):
+                                self._write_build_report(ninja_log_offsets[variant], ninja_seconds[variant])
+                    else:
+                        # NOTE: ninja is a no-op if nothing changed since the previous build
+                        ninja_log_offset = self._ninja_log_size()
+                        ninja_start = time.time()
+                        self._run_ninja(self._ninja_targets)
+                        self._write_build_report(ninja_log_offset, time.time() - ninja_start)
+
+                    self._log_compiler_cache_stats(compiler_cache_stats)
 
-                # ProtoZero is a zero-copy zero-alloc zero-syscall protobuf serialization libary purposefully built for Perfetto's tracing use cases.
-                self.run('ninja -C out/conan-build protozero_plugin', cwd=self._source_subfolder)
+                if self.options.get_safe("run_benchmarks"):
+                    self._run_benchmarks()
 
-                if self.options.get_safe("perfetto_unittests"):
-                    mybuf = StringIO()
-                    try:
-                        self.run('out/conan-build/perfetto_unittests --gtest_filter=-*', cwd=self._source_subfolder, output=mybuf)
-                    except ConanException:
-                        #self.run("gn_unittests", cwd=out_dir_path)
-                        self.output.error(mybuf.getvalue())
-                        raise
+                # NOTE: every build variant is verified by its own perfetto_unittests
+                if self.options.get_safe("enable_perfetto_unittests"):
+                    for variant in self._build_variants:
+                        with self._build_variant(variant):
+                            self._run_unittests()
 
                 # TODO: change cflags/ldflags/defines/libs in gen_amalgamated based on cflags/ldflags/defines/libs from env
                 if self.options.get_safe("gen_amalgamated"):
@@ -967,6 +2899,273 @@ if (false)""")
                         # -j flag for parallel builds
                         cmake.build(args=["--", "-j%s" % cpu_count])
 
+                # NOTE: each matrix variant is packaged from its own build dir, see README
+                for variant in self._build_variants:
+                    with self._build_variant(variant):
+                        if self._with_sdk_library:
+                            self._build_sdk_library(sdk_flags if variant == self._build_variants[0] else self._sanitizer_flags + self._thin_lto_flags + self._debug_info_flags)
+
+                        if self.options.get_safe("split_trace_protos"):
+                            self._build_split_trace_protos()
+
+                        self._write_package_manifest()
+
+    _trace_protos_label = "//protos/perfetto/trace:perfetto_trace_protos"
+    _libperfetto_label = "//:libperfetto"
+
+    @property
+    def _split_protos_dir(self):
+        return os.path.join(self._gn_build_dir, "conan-protos")
+
+    @property
+    def _split_protos_info_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._split_protos_dir, "conan_proto_components.json")
+
+    @staticmethod
+    def _split_protos_names(label):
+        # //protos/perfetto/trace/ftrace:lite -> perfetto_protos_perfetto_trace_ftrace_lite, perfetto-protos-perfetto-trace-ftrace-lite
+        path = label.lstrip("/").replace("/", "_").replace(":", "_")
+        return "perfetto_" + path, "perfetto-" + path.replace("_", "-")
+
+    def _archive(self, lib_path, objects, cwd):
+        if os.path.exists(lib_path):
+            if all(os.path.getmtime(os.path.join(cwd, o)) <= os.path.getmtime(lib_path) for o in objects):
+                return
+            os.remove(lib_path)
+        rsp_path = lib_path + ".rsp"
+        with open(rsp_path, "w") as f:
+            f.write("\n".join(objects))
+        if self._is_msvc or self._is_clang_cl:
+            self.run('lib /NOLOGO /OUT:"%s" @"%s"' % (lib_path, rsp_path), cwd=cwd)
+        elif self.settings.os == "Macos":
+            # NOTE: Apple ar does not support response files
+            self.run('"%s" rcs "%s" %s' % (self._tool("AR", "ar") or "ar", lib_path, " ".join(objects)), cwd=cwd)
+        else:
+            self.run('"%s" rcs "%s" @"%s"' % (self._tool("AR", "ar") or "ar", lib_path, rsp_path), cwd=cwd)
+
+    # Archives objects of every compiled target in the dependency tree of perfetto_trace_protos
+    # into its own static library and records `requires` between them (from `gn desc ... deps --tree`),
+    # package_info() declares components from the recorded json.
+    def _build_split_trace_protos(self):
+        build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
+        buf = StringIO()
+        self.run('gn desc %s %s deps --tree' % (self._gn_build_dir, self._trace_protos_label), output=buf, cwd=self._source_subfolder)
+        graph = parse_gn_deps_tree(buf.getvalue(), self._trace_protos_label)
+
+        objects = {}
+        for label in graph:
+            # NOTE: targets of non-default toolchains (i.e. host protoc) are not linked into consumers
+            if "(" in label or label == self._trace_protos_label:
+                continue
+            target_dir, _, target_name = label.lstrip("/").partition(":")
+            ninja_file = os.path.join(build_subfolder, self._gn_build_dir, "obj", target_dir, target_name + ".ninja")
+            if os.path.exists(ninja_file):
+                target_objects = ninja_target_objects(ninja_file)
+                if target_objects:
+                    objects[label] = target_objects
+
+        # requires are the nearest compiled targets, looking through groups and actions
+        def compiled_deps(label, visited):
+            result = []
+            for dep in graph.get(label, []):
+                if dep in visited:
+                    continue
+                visited.add(dep)
+                if dep in objects:
+                    result.append(dep)
+                else:
+                    result.extend(compiled_deps(dep, visited))
+            return result
+
+        # libperfetto requires the nearest split targets in its own gn deps
+        buf = StringIO()
+        self.run('gn desc %s %s deps --tree' % (self._gn_build_dir, self._libperfetto_label), output=buf, cwd=self._source_subfolder)
+        libperfetto_graph = parse_gn_deps_tree(buf.getvalue(), self._libperfetto_label)
+        libperfetto_requires = set()
+        visited = set([self._libperfetto_label])
+        pending = [self._libperfetto_label]
+        while pending:
+            for dep in libperfetto_graph.get(pending.pop(), []):
+                if dep in visited or "(" in dep:
+                    continue
+                visited.add(dep)
+                if dep in objects:
+                    libperfetto_requires.add(self._split_protos_names(dep)[1])
+                else:
+                    pending.append(dep)
+
+        lib_dir = os.path.join(build_subfolder, self._split_protos_dir)
+        if not os.path.exists(lib_dir):
+            os.makedirs(lib_dir)
+        lib_pattern = "%s.lib" if (self._is_msvc or self._is_clang_cl) else "lib%s.a"
+        components = {}
+        for label in sorted(objects):
+            lib_name, component_name = self._split_protos_names(label)
+            self._archive(os.path.join(lib_dir, lib_pattern % lib_name), objects[label], os.path.join(build_subfolder, self._gn_build_dir))
+            components[component_name] = {
+                "label": label,
+                "lib": lib_name,
+                "requires": sorted(set(self._split_protos_names(dep)[1] for dep in compiled_deps(label, set([label])))),
+            }
+        with open(self._split_protos_info_path, "w") as f:
+            json.dump({"components": components, "libperfetto_requires": sorted(libperfetto_requires)}, f, indent=2, sort_keys=True)
+        self.output.info("split %s into %s libraries, libperfetto requires %s of them" % (self._trace_protos_label, len(components), len(libperfetto_requires)))
+
+    @property
+    def _sdk_library_dir(self):
+        return os.path.join(self._gn_build_dir, "conan-sdk")
+
+    @property
+    def _sanitizer_flags(self):
+        if self._is_msvc:
+            return ["/fsanitize=address"] if self._sanitizer_enabled("is_asan") else []
+        flags = []
+        for option_name, sanitizer in [("is_asan", "address"), ("is_lsan", "leak"), ("is_msan", "memory"),
+                                       ("is_tsan", "thread"), ("is_ubsan", "undefined")]:
+            if self._sanitizer_enabled(option_name):
+                flags.append("-fsanitize=%s" % sanitizer)
+        if flags:
+            flags.append("-fno-omit-frame-pointer")
+        return flags
+
+    # Compiles amalgamated sdk/perfetto.cc with CFLAGS/CXXFLAGS from conan profile and sanitizer/LTO/PGO flags,
+    # so that every consumer does not need to compile it again
+    def _build_sdk_library(self, extra_flags):
+        build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
+        sdk_dir = os.path.join(build_subfolder, "sdk")
+        if not os.path.exists(os.path.join(sdk_dir, "perfetto.cc")):
+            raise errors.ConanInvalidConfiguration('not found: {}/perfetto.cc, set build_sdk_library=False or gen_amalgamated=True'.format(sdk_dir))
+        with tools.environment_append(self._compiler_launcher_env):
+            cmake = CMake(self, build_type=self._active_build_type)
+            cmake.parallel = True
+            cmake.definitions["PERFETTO_SDK_DIR"] = sdk_dir.replace("\\", "/")
+            cmake.definitions["PERFETTO_SDK_OUTPUT_DIR"] = os.path.join(build_subfolder, self._sdk_library_dir).replace("\\", "/")
+            cmake.definitions["PERFETTO_SDK_EXTRA_FLAGS"] = " ".join(extra_flags)
+            cmake.definitions["CMAKE_POSITION_INDEPENDENT_CODE"] = self.options.fpic
+            if self.settings.compiler.get_safe("cppstd"):
+                cmake.definitions["CMAKE_CXX_STANDARD"] = str(self.settings.compiler.cppstd).replace("gnu", "")
+            if self._compiler_launcher:
+                cmake.definitions["CMAKE_CXX_COMPILER_LAUNCHER"] = self._compiler_launcher_path.replace("\\", "/")
+            cmake.configure(source_folder=os.path.join(self.build_folder, "cmake", "sdk"),
+                            build_folder=os.path.join(build_subfolder, self._gn_build_dir, "conan-sdk-build"))
+            cmake.build()
+
+    @property
+    def _package_manifest_path(self):
+        return os.path.join(self.build_folder, self._source_subfolder, self._gn_build_dir, "conan_package_manifest.json")
+
+    # Outputs of link steps (executables, static and shared libraries) as known by ninja,
+    # including outputs of the host toolchain (i.e. gcc_like_host/protoc)
+    def _ninja_link_outputs(self):
+        buf = StringIO()
+        self.run('ninja -C %s -t targets all' % (self._gn_build_dir), output=buf, cwd=os.path.join(self.build_folder, self._source_subfolder))
+        outputs = []
+        for line in buf.getvalue().splitlines():
+            output, _, rule = line.rpartition(": ")
+            rule = rule.strip()
+            # NOTE: rules of non-default toolchains are prefixed with toolchain name
+            if any(rule == r or rule.endswith("_" + r) for r in ["link", "solink", "solink_module", "alink"]):
+                outputs.append(output.strip())
+        return outputs
+
+    # Single pass over the build tree that lists all files to package
+    # as (path relative to source_subfolder, path relative to package folder).
+    def _package_manifest_files(self):
+        build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
+        files = []
+
+        lean = self.options.get_safe("lean_package")
+        header_patterns = ["*.h", "*.inc"]
+
+        def add_tree(src_dir, dst_dir, patterns=None):
+            src_root = os.path.join(build_subfolder, src_dir)
+            for root, dirs, filenames in os.walk(src_root):
+                for filename in filenames:
+                    if patterns and not any(fnmatch.fnmatch(filename, pattern) for pattern in patterns):
+                        continue
+                    rel_path = os.path.relpath(os.path.join(root, filename), src_root)
+                    files.append((os.path.join(src_dir, rel_path), os.path.join(dst_dir, rel_path)))
+
+        files.append(("LICENSE", os.path.join("licenses", "LICENSE")))
+        add_tree("include", "include")
+        # files generated by protoc
+        # NOTE: perfetto-gen component exposes only include dir
+        add_tree(os.path.join(self._gn_build_dir, "gen"), "gen", header_patterns if lean else None)
+        # NOTE: dont export '/sdk' as public include dir to avoid collisions,
+        # use `perfetto/sdk` instead
+        # NOTE: lean package provides only `sdk/perfetto.h`
+        if not lean:
+            add_tree("sdk", os.path.join("include", "perfetto", "sdk"))
+        # NOTE: we export `sdk` dir twice because it contains not only header files
+        # i.e. `sdk/perfetto.cc`
+        add_tree("sdk", "sdk")
+        # perfetto_trace_protos requires same protobuf version that was used during linking
+        # i.e. provide same protobuf headers files
+        add_tree(os.path.join("buildtools", "protobuf"), os.path.join("buildtools", "protobuf"), header_patterns if lean else None)
+        # NOTE: we use `/protos/protos`
+        # due to standard include paths `protos/perfetto/trace/track_event/track_event.proto`
+        add_tree("protos", os.path.join("protos", "protos"), ["*.proto"] if lean else None)
+
+        # static library built by _build_sdk_library()
+        if self._with_sdk_library:
+            add_tree(self._sdk_library_dir, "lib", ["*.a", "*.lib"])
+
+        # static libraries built by _build_split_trace_protos()
+        if self.options.get_safe("split_trace_protos"):
+            add_tree(self._split_protos_dir, "lib", ["*.a", "*.lib"])
+            files.append((os.path.relpath(self._split_protos_info_path, build_subfolder), os.path.join("res", "perfetto_proto_components.json")))
+
+        binaries = {}
+        for output in self._ninja_link_outputs():
+            if not os.path.exists(os.path.join(build_subfolder, self._gn_build_dir, output)):
+                continue
+            name = os.path.basename(output)
+            ext = os.path.splitext(name)[1].lower()
+            if ext in ["", ".exe", ".dll"]:
+                dst_dir = "bin"
+            elif ext in [".a", ".so", ".dylib", ".lib"]:
+                dst_dir = "lib"
+            else:
+                # i.e. .so.TOC
+                continue
+            # prefer outputs of the default toolchain over outputs of the host toolchain
+            if name in binaries and binaries[name][0].count("/") <= output.count("/"):
+                continue
+            binaries[name] = (output, dst_dir)
+        for name in sorted(binaries):
+            output, dst_dir = binaries[name]
+            files.append((os.path.join(self._gn_build_dir, output), os.path.join(dst_dir, name)))
+
+        # protoc of the protobuf tool_require, used by perfetto_generate_pbzero()
+        if self.options.get_safe("protoc_from_tool_requires") and self._has_component("protoc"):
+            files.append((self._tool_protoc, os.path.join("bin", os.path.basename(self._tool_protoc))))
+
+        # perfetto_generate_pbzero() CMake function, see package_info()
+        for module in ["perfetto_protozero.cmake", "perfetto_protozero_generate.cmake"]:
+            files.append((os.path.relpath(os.path.join(self.build_folder, "cmake", module), build_subfolder), os.path.join("lib", "cmake", "perfetto", module)))
+
+        # batch trace analysis helper around trace_processor_shell
+        for script in ["perfetto_batch_query.py", "perfetto_batch_query.cmd"]:
+            files.append((os.path.relpath(os.path.join(self.build_folder, "scripts", script), build_subfolder), os.path.join("bin", script)))
+
+        if os.path.exists(self._build_report_path):
+            files.append((os.path.relpath(self._build_report_path, build_subfolder), os.path.join("res", "perfetto_build_report.json")))
+        if os.path.exists(self._benchmark_results_path):
+            files.append((os.path.relpath(self._benchmark_results_path, build_subfolder), os.path.join("res", "perfetto_benchmarks.json")))
+        if os.path.exists(self._unittest_results_path):
+            files.append((os.path.relpath(self._unittest_results_path, build_subfolder), os.path.join("res", "perfetto_unittests.xml")))
+        if os.path.exists(self._unittest_timing_path):
+            files.append((os.path.relpath(self._unittest_timing_path, build_subfolder), os.path.join("res", "perfetto_unittest_timing.json")))
+        if os.path.exists(self._benchmark_comparison_path):
+            files.append((os.path.relpath(self._benchmark_comparison_path, build_subfolder), os.path.join("res", "perfetto_benchmark_comparison.json")))
+        return files
+
+    def _write_package_manifest(self):
+        files = self._package_manifest_files()
+        with open(self._package_manifest_path, "w") as f:
+            json.dump({"files": files}, f, indent=2)
+        self.output.info("package manifest with %s files written to %s" % (len(files), self._package_manifest_path))
+
     def package(self):
         build_subfolder = os.path.join(self.build_folder, self._source_subfolder)
         if not os.path.exists('{}/'.format(build_subfolder)):
@@ -979,54 +3178,107 @@ if (false)""")
         if not os.path.exists('{}/protos'.format(src_subfolder)):
             raise errors.ConanInvalidConfiguration('not found: {}/protos'.format(src_subfolder))
 
-        self.copy("LICENSE", dst="licenses", src=src_subfolder)
-        self.copy('*', dst='include', src='{}/include'.format(src_subfolder))
-        # files generated by protoc
-        self.copy("*", dst="gen", src="%s/out/conan-build/gen" % (src_subfolder))
-        # NOTE: dont export '/sdk' as public include dir to avoid collisions, 
-        # use `perfetto/sdk` instead
-        self.copy('*', dst='include/perfetto/sdk', src='{}/sdk'.format(src_subfolder))
-        # NOTE: we export `sdk` dir twice because it contains not only header files 
-        # i.e. `sdk/perfetto.cc`
-        self.copy('*', dst='sdk', src='{}/sdk'.format(src_subfolder))
-        # perfetto_trace_protos requires same protobuf version that was used during linking
-        # i.e. provide same protobuf headers files
-        self.copy('*', dst='buildtools/protobuf', src='{}/buildtools/protobuf'.format(src_subfolder))
-        # NOTE: we use `/protos/protos` 
-        # due to standard include paths `protos/perfetto/trace/track_event/track_event.proto`
-        self.copy('*', dst='protos/protos', src='{}/protos'.format(src_subfolder))
-        self.copy("*.dll", dst="bin", src="%s/out/conan-build" % (src_subfolder),keep_path=False)
-        self.copy("*.so", dst="lib", src="%s/out/conan-build" % (src_subfolder),keep_path=False)
-        self.copy("*.dylib", dst="lib", src="%s/out/conan-build" % (src_subfolder),keep_path=False)
-        self.copy("*.a", dst="lib", src="%s/out/conan-build" % (src_subfolder), keep_path=False)
-        self.copy("*.lib", dst="lib", src="%s/out/conan-build" % (src_subfolder), keep_path=False)
-        # Copy plugins and tools
-        self.copy("busy_threads*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("heapprof*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("protoprofile*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("traced*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("idle_alloc*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("cpu_utilization*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("skippy*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("trace_to_text*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("trace_to_text_lite*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("stress_producer*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("cppgen_plugin*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("protozero_plugin*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("perfetto*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("protoc*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("traced_probes*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("compact_reencode*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("ftrace_proto_gen*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("trigger_perfetto*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("traced_perf*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
+        if not os.path.exists(self._package_manifest_path):
+            self._write_package_manifest()
+        with open(self._package_manifest_path, "r") as f:
+            manifest = json.load(f)
 
-        # NOTE: The IPC layer based on UNIX sockets can't be built on Win.
-        if not self.options.get_safe("enable_perfetto_ipc"):
-            self.copy("ipc_plugin*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
+        materializer = FileMaterializer()
+        for src, dst in manifest["files"]:
+            materializer.materialize(os.path.join(src_subfolder, src), os.path.join(self.package_folder, dst), hardlink=self._replaced_on_rebuild(src))
+        self.output.info("packaged %s files (reflinks: %s, hardlinks: %s, copies: %s)" % (
+            len(manifest["files"]), materializer.counts["reflink"], materializer.counts["hardlink"], materializer.counts["copy"]))
+
+        if self.options.get_safe("debug_info") in ["split", "strip"]:
+            self._process_debug_info([dst for src, dst in manifest["files"] if dst.split(os.sep)[0] in ["bin", "lib"]])
+
+    # Linked binaries and archives in gn/ninja build dirs are replaced on rebuild (linkers write a new file,
+    # archive rules and _archive() remove the old one), so hardlinking them into the package is safe.
+    # Sources, generated headers (protoc output, gen_amalgamated, _patch_file) and CMake modules
+    # may be rewritten in place, they are copied (or reflinked).
+    _replaced_on_rebuild_exts = ["", ".exe", ".dll", ".so", ".dylib", ".a", ".lib"]
+
+    def _replaced_on_rebuild(self, src):
+        path = os.path.normpath(src).replace("\\", "/")
+        return path.startswith("out/") and os.path.splitext(path)[1].lower() in self._replaced_on_rebuild_exts
 
-        self.copy("dump_ftrace_stats*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
-        self.copy("trace_processor_shell*", dst="bin", src="%s/out/conan-build" % (src_subfolder))
+    # None means debug info is packaged next to the binaries
+    @property
+    def _debug_info_dir(self):
+        debug_info_dir = self.options.get_safe("debug_info_dir")
+        if debug_info_dir is None or str(debug_info_dir).lower() == "none":
+            return None
+        return os.path.abspath(os.path.expanduser(str(debug_info_dir)))
+
+    # NOTE: gdb looks for the .gnu_debuglink name next to the binary and in its .debug/ subfolder,
+    # lldb looks for <name>.dSYM next to the binary
+    def _debug_file_path(self, package_file, binary_format):
+        if self._debug_info_dir:
+            return os.path.join(self._debug_info_dir, package_file + (".debug.dSYM" if binary_format == "macho" else ".debug"))
+        path = os.path.join(self.package_folder, package_file)
+        if binary_format == "macho":
+            return path + ".dSYM"
+        return os.path.join(os.path.dirname(path), ".debug", os.path.basename(path) + ".debug")
+
+    def _binary_format(self, path):
+        with open(path, "rb") as f:
+            magic = f.read(8)
+        if magic.startswith(b"\x7fELF"):
+            return "elf"
+        if magic[:4] in [b"\xfe\xed\xfa\xce", b"\xfe\xed\xfa\xcf", b"\xce\xfa\xed\xfe", b"\xcf\xfa\xed\xfe", b"\xca\xfe\xba\xbe"]:
+            return "macho"
+        if magic == b"!<arch>\n":
+            return "archive"
+        return None
+
+    def _debug_tool(self, env_name, name):
+        tool = os.environ.get(env_name) or tools.which(name)
+        if not tool:
+            raise errors.ConanInvalidConfiguration("debug_info={} requires {} (set {} or add it to PATH)".format(self.options.debug_info, name, env_name))
+        return tool
+
+    # Splits or strips debug info of packaged executables and libraries.
+    # Static libraries are only stripped, debug info can not be split out of them.
+    def _process_debug_info(self, package_files):
+        mode = str(self.options.debug_info)
+        size_before = 0
+        size_after = 0
+        for package_file in package_files:
+            path = os.path.join(self.package_folder, package_file)
+            binary_format = self._binary_format(path)
+            if binary_format is None:
+                continue
+            # NOTE: strip and objcopy may write through hardlinks into the build folder
+            break_hardlink(path)
+            size_before += os.path.getsize(path)
+            debug_path = self._debug_file_path(package_file, binary_format)
+            if binary_format == "elf":
+                if mode == "split":
+                    objcopy = self._debug_tool("OBJCOPY", "objcopy")
+                    tools.mkdir(os.path.dirname(debug_path))
+                    self.run('"{}" --only-keep-debug "{}" "{}"'.format(objcopy, path, debug_path))
+                    # NOTE: run from the debug file folder, so .gnu_debuglink records only the file name
+                    self.run('"{}" --strip-debug --add-gnu-debuglink="{}" "{}"'.format(objcopy, os.path.basename(debug_path), path),
+                             cwd=os.path.dirname(debug_path))
+                else:
+                    self.run('"{}" --strip-debug "{}"'.format(self._debug_tool("STRIP", "strip"), path))
+            elif binary_format == "macho":
+                if mode == "split":
+                    tools.mkdir(os.path.dirname(debug_path))
+                    self.run('"{}" "{}" -o "{}"'.format(self._debug_tool("DSYMUTIL", "dsymutil"), path, debug_path))
+                self.run('"{}" -S "{}"'.format(self._debug_tool("STRIP", "strip"), path))
+            elif binary_format == "archive":
+                if mode == "strip":
+                    strip_flag = "-S" if tools.is_apple_os(self.settings.os) else "--strip-debug"
+                    self.run('"{}" {} "{}"'.format(self._debug_tool("STRIP", "strip"), strip_flag, path))
+            size_after += os.path.getsize(path)
+        self.output.info("debug_info=%s: binaries shrunk from %.1f MiB to %.1f MiB" % (
+            mode, size_before / (1024.0 * 1024.0), size_after / (1024.0 * 1024.0)))
+        if mode == "split":
+            if self._debug_info_dir:
+                self.output.warn("split debug info stored in %s, it is not part of the package" % (self._debug_info_dir))
+            else:
+                self.output.info("split debug info packaged next to the binaries")
 
     def check_lib_exists(self, libname, folder, lib_prefix, lib_suffix, library_suffixes):
         has_item = False
@@ -1040,6 +3292,132 @@ if (false)""")
         if not has_item:
             raise errors.ConanInvalidConfiguration('not found any of: {}'.format(arr))
 
+    def _split_trace_protos_package_info(self):
+        info_path = os.path.join(self.package_folder, "res", "perfetto_proto_components.json")
+        if not os.path.exists(info_path):
+            self.output.warn("not found: %s, split_trace_protos components are not declared" % (info_path))
+            return
+        with open(info_path, "r") as f:
+            info = json.load(f)
+        components = info["components"]
+        for component_name, component in sorted(components.items()):
+            cpp_info = self.cpp_info.components[component_name]
+            cpp_info.names["cmake_find_package"] = component_name
+            cpp_info.names["cmake_find_package_multi"] = component_name
+            cpp_info.names["pkg_config"] = component_name
+            cpp_info.libs = [component["lib"]]
+            cpp_info.libdirs = [os.path.join(self.package_folder, "lib")]
+            # generated .pb.h / .pbzero.h headers and protobuf headers
+            cpp_info.requires = component["requires"] + ["perfetto-gen", "perfetto-buildtools"]
+            if self.settings.os in ["Linux", "FreeBSD"]:
+                cpp_info.system_libs.append("pthread")
+        self.cpp_info.components["perfetto-trace-protos"].names["cmake_find_package"] = "perfetto-trace-protos"
+        self.cpp_info.components["perfetto-trace-protos"].names["cmake_find_package_multi"] = "perfetto-trace-protos"
+        self.cpp_info.components["perfetto-trace-protos"].names["pkg_config"] = "perfetto-trace-protos"
+        self.cpp_info.components["perfetto-trace-protos"].requires = sorted(components)
+        # NOTE: split components used by libperfetto (from `gn desc //:libperfetto deps`)
+        self.cpp_info.components["libperfetto"].requires += info["libperfetto_requires"]
+
+    # gn defaults (gn/perfetto.gni, gn/standalone/BUILDCONFIG.gn at `commit`) of perfetto options
+    # that do not depend on the target platform or other gn args, option=None is same as option=<default>.
+    # NOTE: defaults computed from other args are not listed, i.e. enable_perfetto_x64_cpu_opt (Linux x64),
+    # enable_perfetto_unittests, enable_perfetto_integration_tests, enable_perfetto_version_gen,
+    # perfetto_enable_git_rev_version_header (is_perfetto_build_generator, platform), enable_perfetto_fuzzers (is_fuzzer),
+    # perfetto_build_with_embedder (is_perfetto_embedder): None of them keeps its own package id.
+    # NOTE: update when changing `commit`
+    _gn_default_options = {
+        "perfetto_use_system_zlib": False,
+        "perfetto_use_system_protobuf": False,
+        "perfetto_build_with_android": False,
+        "is_perfetto_build_generator": False,
+        "is_perfetto_embedder": False,
+        "is_system_compiler": False,
+        "build_with_chromium": False,
+        "is_nacl": False,
+        "is_fuzzer": False,
+        "use_libfuzzer": False,
+        "is_asan": False,
+        "is_lsan": False,
+        "is_msan": False,
+        "is_tsan": False,
+        "is_ubsan": False,
+    }
+
+    # options that change how the package is built, but not its binaries
+    _build_only_options = [
+        "check_gn_options",
+        # gn arg, but only skips the buildtools revision check
+        "skip_buildtools_check",
+        # only disables -Werror
+        "warn_no_error",
+        "incremental_build",
+        "compiler_launcher",
+        "compiler_cache_dir",
+        "ninja_jobs",
+        "ninja_link_jobs",
+        "debug_info_dir",
+        "benchmark_filter",
+        "benchmark_baseline",
+        "benchmark_regression_threshold",
+        "benchmark_regression_action",
+        # only selects which other variants are built by the same build(),
+        # each variant is exported with its own settings and sanitizer options
+        "matrix_variants",
+        # NOTE: forces enable_perfetto_ui=False if it is None, see configure()
+        "sparse_checkout",
+        # only wraps the linker
+        "link_stats",
+        "unittest_shards",
+        "unittest_slow_threshold",
+        "unittest_baseline",
+    ]
+
+    # perfetto options as resolved by gn: None and explicit gn default are the same value
+    def _effective_gn_options(self, options):
+        effective = {}
+        # NOTE: configure() removes None options from perfetto_options, default_perfetto_options lists all of them
+        for k in sorted(set(self.default_perfetto_options) | set(self._gn_default_options)):
+            value = options.get_safe(k)
+            value = None if value is None or str(value).lower() == "none" else parse_gn_value(str(value).lower())
+            if value is None:
+                value = self._gn_default_options.get(k)
+            if k in self._build_only_options or value is None:
+                continue
+            effective[k] = value
+        return effective
+
+    # Same ABI in older minor versions of the compiler, i.e. gcc 9.3 can use package built by gcc 9.1,
+    # nearest first. Newer minor versions are not compatible: their libstdc++ may add symbol versions
+    # (i.e. GLIBCXX_3.4.24 in gcc 7.2) that the runtime of an older consumer does not have.
+    # NOTE: libstdc++ ABI was not stable before gcc 5
+    def _compatible_compiler_versions(self):
+        compiler = str(self.settings.compiler)
+        version = str(self.settings.compiler.version)
+        major = version.split(".")[0]
+        if compiler not in ["gcc", "clang", "apple-clang"] or not major.isdigit():
+            return []
+        if compiler == "gcc" and int(major) < 5:
+            return []
+        older = [v for v in self.settings.compiler.version.values_range if v.split(".")[0] == major and Version(v) < Version(version)]
+        return sorted(older, key=Version, reverse=True)
+
+    # Package id depends on the effective gn configuration instead of raw option spellings,
+    # so that i.e. is_asan=None and is_asan=False or a different ninja_jobs share one binary package.
+    def package_id(self):
+        gn_config = self._effective_gn_options(self.info.options)
+        for k in self._build_only_options:
+            if k in self.info.options.fields:
+                delattr(self.info.options, k)
+        for k in self.default_perfetto_options:
+            if k in self.info.options.fields:
+                delattr(self.info.options, k)
+        self.info.options.gn_config = hashlib.sha256(json.dumps(gn_config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+        for version in self._compatible_compiler_versions():
+            compatible_pkg = self.info.clone()
+            compatible_pkg.settings.compiler.version = version
+            self.compatible_packages.append(compatible_pkg)
+
     def package_info(self):
         self.cpp_info.set_property("cmake_find_mode", "perfetto")
         self.cpp_info.set_property("cmake_module_file_name", "perfetto")
@@ -1054,47 +3432,70 @@ if (false)""")
         self.env_info.LD_LIBRARY_PATH.append(os.path.join(self.package_folder, "lib"))
         self.env_info.PATH.append(os.path.join(self.package_folder, "lib"))
         self.env_info.PATH.append(os.path.join(self.package_folder, "bin"))
-
-        self.cpp_info.components["libperfetto"].names["cmake_find_package"] = "libperfetto"
-        self.cpp_info.components["libperfetto"].names["cmake_find_package_multi"] = "libperfetto"
-        self.cpp_info.components["libperfetto"].libs = [
-            lib_prefix + "perfetto" + lib_suffix,
-            "perfetto_trace_protos" + lib_suffix # NOTE: without lib_prefix
-            # TODO: lib_prefix + "perfetto_src_tracing_ipc" + lib_suffix
-            # TODO: lib_prefix + "libperfetto_android_internal" + lib_suffix
-        ]
-        self.check_lib_exists("perfetto", os.path.join(self.package_folder, "lib"), lib_prefix, lib_suffix, library_suffixes)
-        self.check_lib_exists("perfetto_trace_protos", os.path.join(self.package_folder, "lib"), "", lib_suffix, library_suffixes) # NOTE: without lib_prefix
-        self.cpp_info.components["libperfetto"].includedirs = [
-            os.path.join(self.package_folder),
-            os.path.join(self.package_folder, "sdk"),
-            os.path.join(self.package_folder, "include")
-        ]
-        self.cpp_info.components["libperfetto"].libdirs = [os.path.join(self.package_folder, "lib")]
-        self.cpp_info.components["libperfetto"].bindirs = [os.path.join(self.package_folder, "bin")]
-        self.cpp_info.components["libperfetto"].defines += ["CONAN_PERFETTO=1"]
-        if self.settings.os == "Windows":
-            self.cpp_info.components["libperfetto"].system_libs.append("wsock32")
-            self.cpp_info.components["libperfetto"].system_libs.append("ws2_32")
-        if self.settings.os in ["Linux", "FreeBSD"]:
-            self.cpp_info.components["libperfetto"].system_libs.append("pthread")
-            if self._is_clang_x86 or "arm" in str(self.settings.arch):
-                self.cpp_info.components["libperfetto"].system_libs.append("atomic")
+        # perfetto_batch_query.py runs queries over directories of traces with packaged trace_processor_shell
+        self.env_info.PERFETTO_BATCH_QUERY = os.path.join(self.package_folder, "bin", "perfetto_batch_query.py")
+        if self._has_component("trace_processor_shell"):
+            self.env_info.PERFETTO_TRACE_PROCESSOR = os.path.join(self.package_folder, "bin", "trace_processor_shell" + (".exe" if self.settings.os == "Windows" else ""))
+
+        # NOTE: with `components` option only components that were built are declared
+        if self._has_component("libperfetto"):
+            self.cpp_info.components["libperfetto"].names["cmake_find_package"] = "libperfetto"
+            self.cpp_info.components["libperfetto"].names["cmake_find_package_multi"] = "libperfetto"
+            self.cpp_info.components["libperfetto"].libs = [
+                lib_prefix + "perfetto" + lib_suffix,
+                "perfetto_trace_protos" + lib_suffix # NOTE: without lib_prefix
+                # TODO: lib_prefix + "perfetto_src_tracing_ipc" + lib_suffix
+                # TODO: lib_prefix + "libperfetto_android_internal" + lib_suffix
+            ]
+            self.check_lib_exists("perfetto", os.path.join(self.package_folder, "lib"), lib_prefix, lib_suffix, library_suffixes)
+            self.check_lib_exists("perfetto_trace_protos", os.path.join(self.package_folder, "lib"), "", lib_suffix, library_suffixes) # NOTE: without lib_prefix
+            if self.options.get_safe("split_trace_protos"):
+                # NOTE: libperfetto requires the split components it uses, other consumers link only
+                # required perfetto-protos-perfetto-* components or perfetto-trace-protos (all of them)
+                self.cpp_info.components["libperfetto"].libs = [lib_prefix + "perfetto" + lib_suffix]
+                self._split_trace_protos_package_info()
+            self.cpp_info.components["libperfetto"].includedirs = [
+                os.path.join(self.package_folder),
+                os.path.join(self.package_folder, "sdk"),
+                os.path.join(self.package_folder, "include")
+            ]
+            self.cpp_info.components["libperfetto"].libdirs = [os.path.join(self.package_folder, "lib")]
+            self.cpp_info.components["libperfetto"].bindirs = [os.path.join(self.package_folder, "bin")]
+            self.cpp_info.components["libperfetto"].defines += ["CONAN_PERFETTO=1"]
             if self.settings.os == "Windows":
-                if self.options.shared:
-                    self.cpp_info.components["libperfetto"].defines = ["PROTOBUF_USE_DLLS"]
-            if self.settings.os == "Android":
-                self.cpp_info.components["libperfetto"].system_libs.append("log")
+                self.cpp_info.components["libperfetto"].system_libs.append("wsock32")
+                self.cpp_info.components["libperfetto"].system_libs.append("ws2_32")
+            if self.settings.os in ["Linux", "FreeBSD"]:
+                self.cpp_info.components["libperfetto"].system_libs.append("pthread")
+                if self._is_clang_x86 or "arm" in str(self.settings.arch):
+                    self.cpp_info.components["libperfetto"].system_libs.append("atomic")
+                if self.settings.os == "Windows":
+                    if self.options.shared:
+                        self.cpp_info.components["libperfetto"].defines = ["PROTOBUF_USE_DLLS"]
+                if self.settings.os == "Android":
+                    self.cpp_info.components["libperfetto"].system_libs.append("log")
 
         # The SDK consists of two files, sdk/perfetto.h and sdk/perfetto.cc. These are an amalgamation of the Client API designed to easy to integrate to existing build systems. The sources are self-contained and require only a C++11 compliant standard library.
-        self.cpp_info.components["perfetto-sdk"].names["cmake_find_package"] = "perfetto-sdk"
-        self.cpp_info.components["perfetto-sdk"].names["cmake_find_package_multi"] = "perfetto-sdk"
-        self.cpp_info.components["perfetto-sdk"].names["pkg_config"] = "perfetto-sdk"
-        self.cpp_info.components["perfetto-sdk"].bindirs = [os.path.join(self.package_folder, "bin")]
-        self.cpp_info.components["perfetto-sdk"].includedirs = [
-            os.path.join(self.package_folder),
-            os.path.join(self.package_folder, "sdk"),
-        ]
+        if self._has_component("sdk"):
+            self.cpp_info.components["perfetto-sdk"].names["cmake_find_package"] = "perfetto-sdk"
+            self.cpp_info.components["perfetto-sdk"].names["cmake_find_package_multi"] = "perfetto-sdk"
+            self.cpp_info.components["perfetto-sdk"].names["pkg_config"] = "perfetto-sdk"
+            self.cpp_info.components["perfetto-sdk"].bindirs = [os.path.join(self.package_folder, "bin")]
+            self.cpp_info.components["perfetto-sdk"].includedirs = [
+                os.path.join(self.package_folder),
+                os.path.join(self.package_folder, "sdk"),
+            ]
+            # NOTE: with build_sdk_library=False consumers compile sdk/perfetto.cc themselves
+            if self._with_sdk_library:
+                self.cpp_info.components["perfetto-sdk"].libs = ["perfetto_sdk"]
+                self.check_lib_exists("perfetto_sdk", os.path.join(self.package_folder, "lib"), "", "", [".lib", ".a"])
+                self.cpp_info.components["perfetto-sdk"].libdirs = [os.path.join(self.package_folder, "lib")]
+                if self.settings.os == "Windows":
+                    self.cpp_info.components["perfetto-sdk"].system_libs.extend(["wsock32", "ws2_32"])
+                if self.settings.os in ["Linux", "FreeBSD", "Android"]:
+                    self.cpp_info.components["perfetto-sdk"].system_libs.append("pthread")
+                if self.settings.os == "Android":
+                    self.cpp_info.components["perfetto-sdk"].system_libs.append("log")
 
         self.cpp_info.components["perfetto-gen"].names["cmake_find_package"] = "perfetto-gen"
         self.cpp_info.components["perfetto-gen"].names["cmake_find_package_multi"] = "perfetto-gen"
@@ -1119,26 +3520,33 @@ if (false)""")
         self.cpp_info.components["perfetto-protos"].includedirs = [
             os.path.join(self.package_folder, "protos"),
         ]
-
-        self.cpp_info.components["perfetto-protoc"].names["cmake_find_package"] = "perfetto-protoc"
-        self.cpp_info.components["perfetto-protoc"].names["cmake_find_package_multi"] = "perfetto-protoc"
-        self.cpp_info.components["perfetto-protoc"].names["pkg_config"] = "perfetto-protoc"
-        self.cpp_info.components["perfetto-protoc"].bindirs = [os.path.join(self.package_folder, "bin")]
-
-        self.cpp_info.components["perfetto-protozero-plugin"].names["cmake_find_package"] = "perfetto-protozero-plugin"
-        self.cpp_info.components["perfetto-protozero-plugin"].names["cmake_find_package_multi"] = "perfetto-protozero-plugin"
-        self.cpp_info.components["perfetto-protozero-plugin"].names["pkg_config"] = "perfetto-protozero-plugin"
-        self.cpp_info.components["perfetto-protozero-plugin"].bindirs = [os.path.join(self.package_folder, "bin")]
-
-        self.cpp_info.components["perfetto-cppgen-plugin"].names["cmake_find_package"] = "perfetto-cppgen-plugin"
-        self.cpp_info.components["perfetto-cppgen-plugin"].names["cmake_find_package_multi"] = "perfetto-cppgen-plugin"
-        self.cpp_info.components["perfetto-cppgen-plugin"].names["pkg_config"] = "perfetto-cppgen-plugin"
-        self.cpp_info.components["perfetto-cppgen-plugin"].bindirs = [os.path.join(self.package_folder, "bin")]
-
-        self.cpp_info.components["perfetto-ipc-plugin"].names["cmake_find_package"] = "perfetto-ipc-plugin"
-        self.cpp_info.components["perfetto-ipc-plugin"].names["cmake_find_package_multi"] = "perfetto-ipc-plugin"
-        self.cpp_info.components["perfetto-ipc-plugin"].names["pkg_config"] = "perfetto-ipc-plugin"
-        self.cpp_info.components["perfetto-ipc-plugin"].bindirs = [os.path.join(self.package_folder, "bin")]
+        # provides perfetto_generate_pbzero(TARGET ... PROTOS ...)
+        for generator in ["cmake", "cmake_find_package", "cmake_find_package_multi"]:
+            self.cpp_info.components["perfetto-protos"].build_modules[generator] = [os.path.join("lib", "cmake", "perfetto", "perfetto_protozero.cmake")]
+
+        if self._has_component("protoc"):
+            self.cpp_info.components["perfetto-protoc"].names["cmake_find_package"] = "perfetto-protoc"
+            self.cpp_info.components["perfetto-protoc"].names["cmake_find_package_multi"] = "perfetto-protoc"
+            self.cpp_info.components["perfetto-protoc"].names["pkg_config"] = "perfetto-protoc"
+            self.cpp_info.components["perfetto-protoc"].bindirs = [os.path.join(self.package_folder, "bin")]
+
+        if self._has_component("protozero_plugin"):
+            self.cpp_info.components["perfetto-protozero-plugin"].names["cmake_find_package"] = "perfetto-protozero-plugin"
+            self.cpp_info.components["perfetto-protozero-plugin"].names["cmake_find_package_multi"] = "perfetto-protozero-plugin"
+            self.cpp_info.components["perfetto-protozero-plugin"].names["pkg_config"] = "perfetto-protozero-plugin"
+            self.cpp_info.components["perfetto-protozero-plugin"].bindirs = [os.path.join(self.package_folder, "bin")]
+
+        if self._has_component("cppgen_plugin"):
+            self.cpp_info.components["perfetto-cppgen-plugin"].names["cmake_find_package"] = "perfetto-cppgen-plugin"
+            self.cpp_info.components["perfetto-cppgen-plugin"].names["cmake_find_package_multi"] = "perfetto-cppgen-plugin"
+            self.cpp_info.components["perfetto-cppgen-plugin"].names["pkg_config"] = "perfetto-cppgen-plugin"
+            self.cpp_info.components["perfetto-cppgen-plugin"].bindirs = [os.path.join(self.package_folder, "bin")]
+
+        if self._has_component("ipc_plugin"):
+            self.cpp_info.components["perfetto-ipc-plugin"].names["cmake_find_package"] = "perfetto-ipc-plugin"
+            self.cpp_info.components["perfetto-ipc-plugin"].names["cmake_find_package_multi"] = "perfetto-ipc-plugin"
+            self.cpp_info.components["perfetto-ipc-plugin"].names["pkg_config"] = "perfetto-ipc-plugin"
+            self.cpp_info.components["perfetto-ipc-plugin"].bindirs = [os.path.join(self.package_folder, "bin")]
 
         #protoc = "protoc.exe" if self.settings.os_build == "Windows" else "protoc"
         #self.env_info.PERFETTO_PROTOC_BIN = os.path.normpath(os.path.join(self.package_folder, "bin", protoc))
@@ -0,0 +1 @@
+@python "%~dp0perfetto_batch_query.py" %*
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""Runs SQL queries and metrics over a directory of traces with trace_processor_shell.
+
+Traces are processed by a pool of workers sized to CPU count and available memory,
+each worker hashes one trace and ingests it once: all its uncached SQL queries run in one
+trace_processor_shell invocation and all its uncached metrics in another one.
+Results are streamed as JSON lines or per-query CSV files.
+Results are cached by trace content hash + query hash + trace_processor_shell hash,
+so reruns only process new traces and changed queries.
+
+  perfetto_batch_query.py traces/ -q slices.sql -q threads.sql --metrics android_cpu > results.jsonl
+  perfetto_batch_query.py traces/ -q slices.sql --format csv --output-dir results/
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+DEFAULT_PATTERNS = ["*.perfetto-trace", "*.pftrace", "*.trace", "*.pb", "*.json", "*.gz"]
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def memory_available():
+    """Available memory in bytes or None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    if hasattr(os, "sysconf"):
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError):
+            pass
+    return None
+
+
+def default_jobs(memory_per_job_mb):
+    jobs = os.cpu_count() or 1
+    available = memory_available()
+    if available:
+        jobs = min(jobs, available // (memory_per_job_mb * 1024 * 1024))
+    return max(1, jobs)
+
+
+def find_trace_processor(path):
+    candidates = [path, os.environ.get("PERFETTO_TRACE_PROCESSOR")]
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in ["trace_processor_shell", "trace_processor_shell.exe"]:
+        candidates.append(os.path.join(script_dir, name))
+        candidates.append(shutil.which(name))
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    raise SystemExit("trace_processor_shell not found, use --trace-processor or PERFETTO_TRACE_PROCESSOR")
+
+
+def find_traces(trace_dir, patterns):
+    traces = []
+    for root, dirs, filenames in os.walk(trace_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns):
+                traces.append(os.path.join(root, filename))
+    return traces
+
+
+class ResultCache(object):
+    """Results stored as <cache_dir>/<key[:2]>/<key>.json, trace hashes are indexed
+    by (path, size, mtime) to avoid re-hashing unchanged traces."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "trace_hashes.json") if cache_dir else None
+        self.index = {}
+        if self.index_path and os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except ValueError:
+                self.index = {}
+
+    def trace_hash(self, path):
+        st = os.stat(path)
+        index_key = "%s|%s|%s" % (os.path.abspath(path), st.st_size, st.st_mtime)
+        if index_key not in self.index:
+            self.index[index_key] = file_sha256(path)
+        return self.index[index_key]
+
+    def save_index(self):
+        if self.index_path:
+            self._write_json(self.index_path, self.index)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key)) as f:
+            return json.load(f)
+
+    def put(self, key, value):
+        if self.cache_dir:
+            self._write_json(self._path(key), value)
+
+    @staticmethod
+    def _write_json(path, value):
+        # NOTE: atomic, several batch jobs may share one cache dir
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+
+# part of cache keys, results cached in another representation are not reused
+RESULT_FORMAT = "json-rows-1"
+
+# Trace proto with a single empty TracePacket: result columns of a query are known without ingesting a real trace
+EMPTY_TRACE = b"\x0a\x00"
+
+
+def split_sql(text):
+    """Splits SQL into statements on ';' outside of quotes and comments."""
+    statements = []
+    current = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in "'\"`":
+            end = text.find(c, i + 1)
+            end = len(text) if end < 0 else end + 1
+            current.append(text[i:end])
+            i = end
+        elif text.startswith("--", i):
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = len(text) if end < 0 else end + 2
+        elif c == ";":
+            statements.append("".join(current).strip())
+            current = []
+            i += 1
+        else:
+            current.append(c)
+            i += 1
+    statements.append("".join(current).strip())
+    return [statement for statement in statements if statement]
+
+
+def run_trace_processor(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        return None, stderr.decode("utf-8", "replace")[-4000:]
+    return stdout.decode("utf-8", "replace"), None
+
+
+def run_sql_file(trace_processor, trace, sql):
+    fd, sql_path = tempfile.mkstemp(suffix=".sql")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(sql)
+        stdout, error = run_trace_processor([trace_processor, "-q", sql_path, trace])
+    finally:
+        os.remove(sql_path)
+    if error is not None:
+        return None, error
+    return list(csv.reader(io.StringIO(stdout))), None
+
+
+class QueryColumns(object):
+    """Result columns of SQL queries, from running them once over EMPTY_TRACE."""
+
+    def __init__(self, trace_processor, work_dir):
+        self.trace_processor = trace_processor
+        self.empty_trace = os.path.join(work_dir, "empty.pftrace")
+        with open(self.empty_trace, "wb") as f:
+            f.write(EMPTY_TRACE)
+        self.columns = {}
+        self.lock = threading.Lock()
+
+    def get(self, query):
+        with self.lock:
+            if query["hash"] not in self.columns:
+                rows, error = run_sql_file(self.trace_processor, self.empty_trace, query["sql"])
+                self.columns[query["hash"]] = rows[0] if rows and rows[0] else None
+            return self.columns[query["hash"]]
+
+
+def combined_sql(queries):
+    """One SQL file with the result of every query as (batch_query, JSON array of row values) rows,
+    the statements before the last one of each query (i.e. INCLUDE PERFETTO MODULE) run first."""
+    statements = []
+    selects = []
+    for index, query in enumerate(queries):
+        parts = split_sql(query["sql"])
+        statements += parts[:-1]
+        # NOTE: columns are renamed positionally, result column names may repeat
+        names = ["batch_c%s" % (i) for i in range(len(query["columns"]))]
+        selects.append("SELECT * FROM (WITH batch_q%s(%s) AS (%s) SELECT %s AS batch_query, json_array(%s) AS batch_row FROM batch_q%s)" % (
+            index, ", ".join(names), parts[-1], index, ", ".join(names), index))
+    return ";\n".join(statements + ["\nUNION ALL\n".join(selects)]) + ";\n"
+
+
+# {index in queries: result} of queries with known columns run in one trace_processor_shell invocation
+def run_combined_sql(trace_processor, trace, queries):
+    rows, error = run_sql_file(trace_processor, trace, combined_sql(queries))
+    if error is not None:
+        return None, error
+    results = dict((index, {"columns": query["columns"], "rows": []}) for index, query in enumerate(queries))
+    for batch_query, batch_row in rows[1:]:
+        # NOTE: values keep their SQL types, NULL is None
+        results[int(batch_query)]["rows"].append(json.loads(batch_row))
+    return results, None
+
+
+def run_sql_query(trace_processor, trace, query, columns):
+    """Runs one query through the same json_array wrapping as run_sql_queries(),
+    columns are taken from a plain run over the trace if they are not known."""
+    if not split_sql(query["sql"]):
+        return {"columns": [], "rows": []}
+    if columns is None:
+        rows, error = run_sql_file(trace_processor, trace, query["sql"])
+        if error is not None:
+            return {"error": error}
+        if not rows or not rows[0]:
+            return {"columns": [], "rows": []}
+        columns = rows[0]
+    results, error = run_combined_sql(trace_processor, trace, [dict(query, columns=columns)])
+    if error is not None:
+        return {"error": error}
+    return results[0]
+
+
+# {index in queries: result}, queries are run in one trace_processor_shell invocation,
+# one by one if that fails (to report the error of the failing query only).
+# Rows are JSON arrays of typed values in every case, NULL is None.
+def run_sql_queries(trace_processor, trace, queries, query_columns):
+    columns = [query_columns.get(query) if split_sql(query["sql"]) else None for query in queries]
+    if len(queries) > 1 and all(c is not None for c in columns):
+        results, error = run_combined_sql(trace_processor, trace,
+                                          [dict(query, columns=columns[index]) for index, query in enumerate(queries)])
+        if error is None:
+            return results
+    return dict((index, run_sql_query(trace_processor, trace, query, columns[index])) for index, query in enumerate(queries))
+
+
+# {index in queries: result}, same as run_sql_queries() for a single --run-metrics list
+def run_metrics(trace_processor, trace, queries):
+    stdout, error = run_trace_processor([trace_processor, "--run-metrics", ",".join(query["name"] for query in queries),
+                                         "--metrics-output", "json", trace])
+    if error is None:
+        metrics = json.loads(stdout)
+        if len(queries) == 1:
+            return {0: {"metrics": metrics}}
+        if all(query["name"] in metrics for query in queries):
+            return dict((index, {"metrics": {query["name"]: metrics[query["name"]]}}) for index, query in enumerate(queries))
+    if len(queries) == 1:
+        return {0: {"error": error}}
+    results = {}
+    for index, query in enumerate(queries):
+        results[index] = run_metrics(trace_processor, trace, [query])[0]
+    return results
+
+
+def process_trace(trace, queries, cache, trace_processor, trace_processor_hash, query_columns):
+    """Hashes the trace and runs its uncached queries, returns [(query, result, cached)] in order of queries."""
+    trace_hash = cache.trace_hash(trace)
+    results = [None] * len(queries)
+    pending = {"sql": [], "metric": []}
+    for index, query in enumerate(queries):
+        key = hashlib.sha256(("%s|%s|%s|%s" % (trace_hash, query["hash"], trace_processor_hash, RESULT_FORMAT)).encode("utf-8")).hexdigest()
+        result = cache.get(key)
+        if result is not None:
+            results[index] = (query, result, True)
+        else:
+            pending[query["kind"]].append((index, key))
+    for kind, run in [("sql", lambda batch: run_sql_queries(trace_processor, trace, batch, query_columns)),
+                      ("metric", lambda batch: run_metrics(trace_processor, trace, batch))]:
+        if not pending[kind]:
+            continue
+        batch_results = run([queries[index] for index, key in pending[kind]])
+        for batch_index, (index, key) in enumerate(pending[kind]):
+            result = batch_results[batch_index]
+            if "error" not in result:
+                cache.put(key, result)
+            results[index] = (queries[index], result, False)
+    return results
+
+
+class Output(object):
+    def __init__(self, fmt, output, output_dir):
+        self.fmt = fmt
+        self.output_dir = output_dir
+        self.stream = open(output, "w") if output else sys.stdout
+        self.csv_files = {}
+
+    def write(self, trace, query, result, cached):
+        if self.fmt == "json" or "columns" not in result:
+            record = dict(result, trace=trace, query=query["name"], cached=cached)
+            if self.fmt == "json":
+                self.stream.write(json.dumps(record) + "\n")
+                self.stream.flush()
+            else:
+                # errors and metrics do not fit per-query CSV
+                sys.stderr.write(json.dumps(record) + "\n")
+            return
+        if query["name"] not in self.csv_files:
+            f = open(os.path.join(self.output_dir, query["name"] + ".csv"), "w", newline="")
+            writer = csv.writer(f)
+            writer.writerow(["trace"] + result["columns"])
+            self.csv_files[query["name"]] = (f, writer)
+        f, writer = self.csv_files[query["name"]]
+        for row in result["rows"]:
+            writer.writerow([trace] + row)
+        f.flush()
+
+    def close(self):
+        for f, writer in self.csv_files.values():
+            f.close()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_dir", help="directory with traces (searched recursively)")
+    parser.add_argument("-q", "--query", action="append", default=[], help="SQL file, may be repeated")
+    parser.add_argument("--metrics", default="", help="comma separated trace_processor metrics, i.e. android_cpu")
+    parser.add_argument("--pattern", action="append", help="trace file name pattern (default: %s)" % " ".join(DEFAULT_PATTERNS))
+    parser.add_argument("--format", choices=["json", "csv"], default="json",
+                        help="json: JSON lines to --output or stdout, csv: <query>.csv files in --output-dir")
+    parser.add_argument("--output", help="output file for --format json (default: stdout)")
+    parser.add_argument("--output-dir", help="output directory for --format csv")
+    parser.add_argument("--jobs", type=int, help="parallel trace_processor_shell processes (default: from CPU count and available memory)")
+    parser.add_argument("--memory-per-job-mb", type=int, default=2048, help="expected peak memory of one trace_processor_shell (default: 2048)")
+    parser.add_argument("--cache-dir", default=os.environ.get("PERFETTO_BATCH_QUERY_CACHE",
+                        os.path.join(os.path.expanduser("~"), ".cache", "perfetto_batch_query")),
+                        help="result cache (default: PERFETTO_BATCH_QUERY_CACHE or ~/.cache/perfetto_batch_query)")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the result cache")
+    parser.add_argument("--trace-processor", help="trace_processor_shell (default: PERFETTO_TRACE_PROCESSOR, next to this script or PATH)")
+    args = parser.parse_args()
+
+    queries = []
+    for path in args.query:
+        with open(path, "rb") as f:
+            content = f.read()
+        queries.append({"kind": "sql", "name": os.path.splitext(os.path.basename(path))[0],
+                        "sql": content.decode("utf-8"), "hash": hashlib.sha256(content).hexdigest()})
+    for metric in [m.strip() for m in args.metrics.split(",") if m.strip()]:
+        queries.append({"kind": "metric", "name": metric, "hash": hashlib.sha256(b"metric:" + metric.encode("utf-8")).hexdigest()})
+    if not queries:
+        parser.error("no queries, use -q and/or --metrics")
+    if args.format == "csv":
+        if not args.output_dir:
+            parser.error("--format csv requires --output-dir")
+        if not os.path.exists(args.output_dir):
+            os.makedirs(args.output_dir)
+
+    trace_processor = find_trace_processor(args.trace_processor)
+    # results depend on trace_processor_shell version
+    trace_processor_hash = file_sha256(trace_processor)
+    cache = ResultCache(None if args.no_cache else args.cache_dir)
+    traces = find_traces(args.trace_dir, args.pattern or DEFAULT_PATTERNS)
+    jobs = args.jobs or default_jobs(args.memory_per_job_mb)
+    sys.stderr.write("%s traces x %s queries, %s jobs, %s\n" % (len(traces), len(queries), jobs, trace_processor))
+
+    output = Output(args.format, args.output, args.output_dir)
+    stats = {"cached": 0, "executed": 0, "errors": 0}
+    work_dir = tempfile.mkdtemp(prefix="perfetto_batch_query_")
+    try:
+        query_columns = QueryColumns(trace_processor, work_dir)
+        # NOTE: threads hash traces and wait for trace_processor_shell processes, one trace per task
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = dict((executor.submit(process_trace, trace, queries, cache, trace_processor, trace_processor_hash, query_columns), trace)
+                           for trace in traces)
+            for future in concurrent.futures.as_completed(futures):
+                trace = futures[future]
+                for query, result, cached in future.result():
+                    if cached:
+                        stats["cached"] += 1
+                    elif "error" in result:
+                        stats["errors"] += 1
+                    else:
+                        stats["executed"] += 1
+                    output.write(trace, query, result, cached)
+        cache.save_index()
+    finally:
+        output.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.stderr.write("done: %(executed)s executed, %(cached)s cached, %(errors)s errors\n" % stats)
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Runs perfetto tools/install-build-deps without the dependencies that are not needed.
+
+tools/install-build-deps is loaded as module, dependencies whose target folder is given by
+--exclude are removed from its manifest lists and its main() is executed with the
+remaining arguments. The recipe selects target folders by pattern (see build_dep_excluded() of conanfile.py).
+
+  perfetto_install_build_deps.py --source-dir source_subfolder --exclude buildtools/linux64/nodejs.tgz --exclude buildtools/ndk.zip
+"""
+
+import argparse
+import os
+import sys
+from importlib.machinery import SourceFileLoader
+
+
+def normalize(target_folder):
+    return target_folder.replace("\\", "/").strip("/")
+
+
+def is_dependency_list(value):
+    return isinstance(value, list) and value and all(
+        hasattr(dep, "target_folder") and hasattr(dep, "source_url") for dep in value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source-dir", default=".", help="perfetto checkout")
+    parser.add_argument("--exclude", action="append", default=[], help="target folder of the manifest to skip, may be repeated")
+    args, install_args = parser.parse_known_args()
+
+    script = os.path.join(os.path.abspath(args.source_dir), "tools", "install-build-deps")
+    sys.path.insert(0, os.path.dirname(script))
+    module = SourceFileLoader("install_build_deps", script).load_module()
+
+    excluded = set(normalize(target_folder) for target_folder in args.exclude)
+    skipped = set()
+    for value in list(vars(module).values()):
+        if not is_dependency_list(value):
+            continue
+        kept = [dep for dep in value if normalize(dep.target_folder) not in excluded]
+        skipped.update(dep.target_folder for dep in value if dep not in kept)
+        # NOTE: in place, other module level lists may be built from this one
+        value[:] = kept
+    if skipped:
+        sys.stderr.write("skipping build deps: %s\n" % (", ".join(sorted(skipped))))
+
+    sys.argv = [script] + install_args
+    return module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Runs a linker and records its wall time and peak RSS.
+
+Installed by the recipe as `ld` / `ld.lld` shim in out/conan-linker (found by the compiler driver via -B),
+one JSON line per link is appended to --log, relative paths are resolved from the ninja build dir.
+
+  perfetto_link_stats.py --linker /usr/bin/ld.lld --log conan_link_stats.jsonl -- <linker arguments>
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def link_output(args):
+    for index, arg in enumerate(args):
+        if arg == "-o" and index + 1 < len(args):
+            return args[index + 1]
+        if arg.startswith("-o") and len(arg) > 2:
+            return arg[2:]
+    return "a.out"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linker", required=True, help="real linker")
+    parser.add_argument("--log", required=True, help="JSON lines file to append to")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="linker arguments")
+    args = parser.parse_args()
+    linker_args = args.args[1:] if args.args[:1] == ["--"] else args.args
+
+    start = time.time()
+    process = subprocess.Popen([args.linker] + linker_args)
+    # NOTE: rusage of the linker process only, not of this script
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.time() - start
+    returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else (status >> 8)
+    process.returncode = returncode
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss_mb = rusage.ru_maxrss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+    record = {"output": link_output(linker_args), "seconds": round(seconds, 3), "max_rss_mb": round(max_rss_mb, 1), "returncode": returncode}
+    # NOTE: single write of a short line in append mode, concurrent links do not interleave
+    with open(args.log, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,6 +25,17 @@ class TestPackageConan(conan_build_helper.CMakePackage):
     def _is_llvm_tools_enabled(self):
       return self._environ_option("ENABLE_LLVM_TOOLS", default = 'false')
 
+    # components declared by perfetto (see `components` option of perfetto), None means all of them
+    @property
+    def _perfetto_components(self):
+      value = self.options['perfetto'].components
+      if value is None or str(value).lower() == "none" or not str(value).strip():
+        return None
+      return [c for c in re.split(r"[,;\s]+", str(value).strip()) if c]
+
+    def _has_perfetto_component(self, name):
+      return self._perfetto_components is None or name in self._perfetto_components
+
     def build_requirements(self):
         self.build_requires("cmake_platform_detection/master@conan/stable")
         self.build_requires("cmake_build_options/master@conan/stable")
@@ -74,6 +85,16 @@ class TestPackageConan(conan_build_helper.CMakePackage):
 
               self.add_cmake_option(cmake, "COMPILE_WITH_LLVM_TOOLS", self._is_compile_with_llvm_tools_enabled())
 
+              # perfetto_test_package uses perfetto-sdk, its pbzero check needs packaged protoc and protozero_plugin
+              cmake.definitions['PERFETTO_WITH_SDK'] = self._has_perfetto_component("sdk")
+              cmake.definitions['PERFETTO_WITH_PBZERO'] = self._has_perfetto_component("protoc") and self._has_perfetto_component("protozero_plugin")
+
+              # link prebuilt perfetto_sdk library from perfetto-sdk component if it was built
+              cmake.definitions['PERFETTO_SDK_FROM_SOURCE'] = not self.options['perfetto'].build_sdk_library
+
+              # link check of perfetto::libperfetto alone (requires split proto components)
+              cmake.definitions['PERFETTO_SPLIT_TRACE_PROTOS'] = self.options['perfetto'].split_trace_protos and self._has_perfetto_component("libperfetto")
+
               cmake.configure()
               cmake.build()
 
@@ -81,7 +102,16 @@ class TestPackageConan(conan_build_helper.CMakePackage):
         if not tools.cross_building(self):
             #bin_path = os.path.join("bin", "test_package")
             bin_path = os.path.join(self.build_folder, "perfetto_test_package")
-            self.run("%s -s" % bin_path, run_environment=True)
+            if self._has_perfetto_component("sdk"):
+              self.run("%s -s" % bin_path, run_environment=True)
+              # peak RSS of each trace output mode
+              self.run("%s --output-mode memory --output memory.pftrace" % bin_path, run_environment=True)
+              self.run("%s --output-mode file --output file.pftrace --file-write-period-ms 100 --max-file-size-bytes 104857600" % bin_path, run_environment=True)
+              self.run("%s --output-mode stream --output stream.pftrace" % bin_path, run_environment=True)
+              # short smoke run of the stress mode
+              self.run("%s --stress --threads 4 --events 200000 --buffer-kb 8192" % bin_path, run_environment=True)
+            if self.options['perfetto'].split_trace_protos and self._has_perfetto_component("libperfetto"):
+                self.run(os.path.join(self.build_folder, "perfetto_test_libperfetto_link"), run_environment=True)
             #bin_path = os.path.join(self.build_folder, "perfetto_test_package_with_sdk")
             #self.run("%s -s" % bin_path, run_environment=True)
             #bin_path = os.path.join(self.build_folder, "perfetto_test_package_with_libperfetto")
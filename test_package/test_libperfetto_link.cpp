@@ -0,0 +1,21 @@
+// Links only perfetto::libperfetto: with split_trace_protos=True the generated
+// proto code used here comes from split components required by libperfetto.
+#include "protos/perfetto/config/trace_config.gen.h"
+
+#include <cstdio>
+#include <string>
+
+int main() {
+  perfetto::protos::gen::TraceConfig config;
+  config.set_duration_ms(1000);
+  config.add_buffers()->set_size_kb(1024);
+  const std::string serialized = config.SerializeAsString();
+
+  perfetto::protos::gen::TraceConfig parsed;
+  if (!parsed.ParseFromString(serialized) || parsed.duration_ms() != 1000) {
+    std::fprintf(stderr, "TraceConfig round trip failed\n");
+    return 1;
+  }
+  std::printf("libperfetto link check: %zu bytes\n", serialized.size());
+  return 0;
+}
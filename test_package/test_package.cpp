@@ -9,6 +9,12 @@
 #include <cstdlib>
 #include <codecvt>
 #include <random>
+#include <algorithm>
+#include <atomic>
+#include <cstring>
+#include <iomanip>
+#include <mutex>
+#include <condition_variable>
 
 #include <sys/stat.h>
 #include <fcntl.h>
@@ -16,16 +22,21 @@
 # define SEPARATOR "\\"
 # include <io.h>
 # include <windows.h>
+# include <psapi.h>
 #else
 # define SEPARATOR "/"
 #include <unistd.h>
+#include <sys/resource.h>
 #endif
 
 #include <sdk/perfetto.h>
 
 #include "perfetto_build_flags.h"
 
+#ifdef PERFETTO_TEST_PBZERO
+// generated by perfetto_generate_pbzero() with packaged protoc and protozero_plugin
 #include "chrome_track_event.pbzero.h"
+#endif
 
 PERFETTO_DEFINE_CATEGORIES(
     perfetto::Category("category")
@@ -145,6 +156,323 @@ void OnNewRequest(size_t request_id) {
   });
 }
 
+// How the trace gets to --output:
+// memory - ReadTraceBlocking() into std::vector, then written to file (peak memory: buffer + full trace)
+// file   - service writes into file descriptor passed to Setup(cfg, fd) every file_write_period_ms
+// stream - callback-based ReadTrace() writes chunks to file as they arrive
+struct OutputOptions {
+  std::string mode = "memory";
+  std::string path = "example3.pftrace";
+  uint32_t file_write_period_ms = 0;  // 0 means perfetto default (5s)
+  uint64_t max_file_size_bytes = 0;  // 0 means unlimited
+};
+
+static uint64_t PeakRssBytes() {
+#ifdef _WIN32
+  PROCESS_MEMORY_COUNTERS counters;
+  if (GetProcessMemoryInfo(GetCurrentProcess(), &counters, sizeof(counters))) {
+    return counters.PeakWorkingSetSize;
+  }
+  return 0;
+#else
+  struct rusage usage;
+  if (getrusage(RUSAGE_SELF, &usage) != 0) {
+    return 0;
+  }
+#ifdef __APPLE__
+  return static_cast<uint64_t>(usage.ru_maxrss);  // bytes
+#else
+  return static_cast<uint64_t>(usage.ru_maxrss) * 1024;  // kilobytes
+#endif
+#endif
+}
+
+static int OpenTraceFile(const std::string& fullpath) {
+#ifdef _WIN32
+  std::wstring_convert<std::codecvt_utf8_utf16<wchar_t>> converter;
+  std::wstring wpath = converter.from_bytes(fullpath);
+  return _wopen(wpath.c_str(), O_RDWR | O_CREAT | O_TRUNC | O_BINARY, S_IWRITE);
+#else
+  return open(fullpath.c_str(), O_RDWR | O_CREAT | O_TRUNC, S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
+#endif
+}
+
+// Returns file descriptor that must be passed to FinishTrace() or -2 on error.
+static int SetupTraceOutput(perfetto::TracingSession* tracing_session,
+                            perfetto::TraceConfig& cfg, const OutputOptions& output) {
+  if (output.mode != "file") {
+    tracing_session->Setup(cfg);
+    return -1;
+  }
+  const int fd = OpenTraceFile(output.path);
+  if (fd == -1) {
+    std::cerr << "can not open " << output.path << std::endl;
+    return -2;
+  }
+  cfg.set_write_into_file(true);
+  if (output.file_write_period_ms) {
+    cfg.set_file_write_period_ms(output.file_write_period_ms);
+  }
+  if (output.max_file_size_bytes) {
+    cfg.set_max_file_size_bytes(output.max_file_size_bytes);
+  }
+  // NOTE: Passing a file descriptor to TracingSession::Setup() is only supported
+  // with the kInProcessBackend on Windows.
+  tracing_session->Setup(cfg, fd);
+  return fd;
+}
+
+// Call after StopBlocking(), returns trace size in bytes.
+static uint64_t FinishTrace(perfetto::TracingSession* tracing_session,
+                            const OutputOptions& output, int fd) {
+  uint64_t trace_size = 0;
+  if (output.mode == "file") {
+    struct stat st;
+    if (fstat(fd, &st) == 0) {
+      trace_size = static_cast<uint64_t>(st.st_size);
+    }
+    close(fd);
+  } else if (output.mode == "stream") {
+    std::ofstream out(output.path, std::ios::out | std::ios::binary);
+    std::mutex mutex;
+    std::condition_variable cv;
+    bool done = false;
+    tracing_session->ReadTrace(
+        [&](perfetto::TracingSession::ReadTraceCallbackArgs args) {
+          std::lock_guard<std::mutex> lock(mutex);
+          if (args.size) {
+            out.write(args.data, std::streamsize(args.size));
+            trace_size += args.size;
+          }
+          if (!args.has_more) {
+            done = true;
+            cv.notify_one();
+          }
+        });
+    std::unique_lock<std::mutex> lock(mutex);
+    cv.wait(lock, [&] { return done; });
+  } else {
+    std::vector<char> trace_data(tracing_session->ReadTraceBlocking());
+    trace_size = trace_data.size();
+    if (!trace_data.empty()) {
+      // Write the trace into a file.
+      std::ofstream out(output.path, std::ios::out | std::ios::binary);
+      out.write(&trace_data[0], std::streamsize(trace_data.size()));
+    }
+  }
+  std::cout << "output: mode=" << output.mode << " path=" << output.path
+            << " trace size " << trace_size << " bytes, peak RSS "
+            << PeakRssBytes() / (1024 * 1024) << " MB" << std::endl;
+  return trace_size;
+}
+
+// Stress mode: measures throughput of the in-process backend, i.e.
+// perfetto_test_package --stress --threads 8 --events 10000000 --buffer-kb 65536 --mix static,dynamic,args,counter
+struct StressOptions {
+  int threads = 4;
+  uint64_t events = 1000000;
+  uint32_t buffer_kb = 32 * 1024;
+  // event kinds emitted in round-robin order
+  std::vector<std::string> mix = {"static", "dynamic", "args", "counter"};
+};
+
+// per-event cost is measured over batches of events to keep clock overhead low
+static constexpr int kStressBatch = 16;
+
+static void StressProducer(const StressOptions& options, uint64_t events,
+                           const std::atomic<bool>& start, std::vector<double>* batch_ns) {
+  enum Kind { kStatic, kDynamic, kArgs, kCounter };
+  std::vector<Kind> kinds;
+  for (const auto& kind : options.mix) {
+    if (kind == "dynamic") kinds.push_back(kDynamic);
+    else if (kind == "args") kinds.push_back(kArgs);
+    else if (kind == "counter") kinds.push_back(kCounter);
+    else kinds.push_back(kStatic);
+  }
+  const std::string dynamic_names[] = {"PictureLayer::Update", "Compositor::Draw", "Upload::Chunk"};
+  batch_ns->reserve(static_cast<size_t>(events / kStressBatch + 1));
+
+  while (!start.load(std::memory_order_acquire)) {
+    std::this_thread::yield();
+  }
+  uint64_t i = 0;
+  while (i < events) {
+    const uint64_t batch_end = std::min(events, i + kStressBatch);
+    const uint64_t batch_size = batch_end - i;
+    const auto batch_start = std::chrono::steady_clock::now();
+    for (; i < batch_end; ++i) {
+      switch (kinds[i % kinds.size()]) {
+        case kStatic:
+          TRACE_EVENT("rendering", "DrawFrame");
+          break;
+        case kDynamic:
+          TRACE_EVENT("rendering", perfetto::DynamicString{dynamic_names[i % 3]});
+          break;
+        case kArgs:
+          TRACE_EVENT("network", "Request", "id", i, "bytes", static_cast<int>(i & 0xffff),
+                      "url", "https://example.com/upload");
+          break;
+        case kCounter:
+          TRACE_COUNTER("rendering", "Framerate", static_cast<int>(i % 120));
+          break;
+      }
+    }
+    const auto batch_end_time = std::chrono::steady_clock::now();
+    batch_ns->push_back(
+        std::chrono::duration<double, std::nano>(batch_end_time - batch_start).count() / batch_size);
+  }
+}
+
+// TraceStats from GetTraceStatsBlocking() decoded with protozero,
+// field ids are from protos/perfetto/common/trace_stats.proto
+struct StressTraceStats {
+  uint64_t bytes_written = 0;
+  uint64_t chunks_written = 0;
+  uint64_t chunks_overwritten = 0;
+  uint64_t chunks_discarded = 0;
+  uint64_t write_wrap_count = 0;
+  uint64_t patches_failed = 0;
+  uint64_t trace_writer_packet_loss = 0;
+};
+
+static StressTraceStats DecodeTraceStats(const std::vector<uint8_t>& data) {
+  StressTraceStats stats;
+  protozero::ProtoDecoder trace_stats(data.data(), data.size());
+  for (auto field = trace_stats.ReadField(); field.valid(); field = trace_stats.ReadField()) {
+    if (field.id() == 1 /* buffer_stats */) {
+      protozero::ProtoDecoder buffer_stats(field.data(), field.size());
+      for (auto f = buffer_stats.ReadField(); f.valid(); f = buffer_stats.ReadField()) {
+        switch (f.id()) {
+          case 1: stats.bytes_written += f.as_uint64(); break;
+          case 2: stats.chunks_written += f.as_uint64(); break;
+          case 3: stats.chunks_overwritten += f.as_uint64(); break;
+          case 4: stats.write_wrap_count += f.as_uint64(); break;
+          case 6: stats.patches_failed += f.as_uint64(); break;
+          case 18: stats.chunks_discarded += f.as_uint64(); break;
+          case 19: stats.trace_writer_packet_loss += f.as_uint64(); break;
+        }
+      }
+    } else if (field.id() == 8 /* chunks_discarded */) {
+      stats.chunks_discarded += field.as_uint64();
+    }
+  }
+  return stats;
+}
+
+static double Percentile(std::vector<double>& values, double p) {
+  if (values.empty()) {
+    return 0;
+  }
+  const size_t n = std::min(values.size() - 1, static_cast<size_t>(p * values.size()));
+  std::nth_element(values.begin(), values.begin() + n, values.end());
+  return values[n];
+}
+
+static int RunStress(const StressOptions& options, const OutputOptions& output) {
+  perfetto::TraceConfig cfg;
+  cfg.add_buffers()->set_size_kb(options.buffer_kb);
+  auto* ds_cfg = cfg.add_data_sources()->mutable_config();
+  ds_cfg->set_name("track_event");
+
+  std::unique_ptr<perfetto::TracingSession> tracing_session(
+      perfetto::Tracing::NewTrace(perfetto::kInProcessBackend));
+  const int fd = SetupTraceOutput(tracing_session.get(), cfg, output);
+  if (fd == -2) {
+    return EXIT_FAILURE;
+  }
+  tracing_session->StartBlocking();
+
+  std::atomic<bool> start(false);
+  std::vector<std::vector<double>> batch_ns(options.threads);
+  std::vector<std::thread> producers;
+  for (int t = 0; t < options.threads; ++t) {
+    const uint64_t events = options.events / options.threads + (t < static_cast<int>(options.events % options.threads) ? 1 : 0);
+    producers.emplace_back(StressProducer, std::cref(options), events, std::cref(start), &batch_ns[t]);
+  }
+  const auto start_time = std::chrono::steady_clock::now();
+  start.store(true, std::memory_order_release);
+  for (auto& producer : producers) {
+    producer.join();
+  }
+  const double seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start_time).count();
+
+  perfetto::TrackEvent::Flush();
+  const auto stats_args = tracing_session->GetTraceStatsBlocking();
+  tracing_session->StopBlocking();
+  const uint64_t trace_size = FinishTrace(tracing_session.get(), output, fd);
+
+  std::vector<double> all_batches;
+  for (const auto& batches : batch_ns) {
+    all_batches.insert(all_batches.end(), batches.begin(), batches.end());
+  }
+  const StressTraceStats stats = stats_args.success ? DecodeTraceStats(stats_args.trace_stats_data) : StressTraceStats();
+
+  std::cout << std::fixed << std::setprecision(1)
+            << "stress: threads=" << options.threads << " events=" << options.events
+            << " buffer_kb=" << options.buffer_kb << std::endl
+            << "stress: " << seconds * 1000 << " ms, " << options.events / seconds << " events/sec" << std::endl
+            << "stress: per-event cost p50=" << Percentile(all_batches, 0.5)
+            << " ns p99=" << Percentile(all_batches, 0.99) << " ns (batches of " << kStressBatch << ")" << std::endl;
+  if (stats_args.success) {
+    std::cout << "stress: bytes_written=" << stats.bytes_written
+              << " chunks_written=" << stats.chunks_written
+              << " chunks_overwritten=" << stats.chunks_overwritten
+              << " chunks_discarded=" << stats.chunks_discarded
+              << " write_wrap_count=" << stats.write_wrap_count
+              << " patches_failed=" << stats.patches_failed
+              << " trace_writer_packet_loss=" << stats.trace_writer_packet_loss << std::endl;
+  } else {
+    std::cout << "stress: GetTraceStatsBlocking failed" << std::endl;
+  }
+  std::cout << "stress: trace size " << trace_size << " bytes, peak RSS "
+            << PeakRssBytes() / (1024 * 1024) << " MB" << std::endl;
+  return trace_size ? EXIT_SUCCESS : EXIT_FAILURE;
+}
+
+static bool ParseOptions(int argc, char** argv, bool* stress, StressOptions* options, OutputOptions* output) {
+  for (int i = 1; i < argc; ++i) {
+    const std::string arg = argv[i];
+    const bool has_value = i + 1 < argc;
+    if (arg == "--stress") {
+      *stress = true;
+    } else if (arg == "--threads" && has_value) {
+      options->threads = std::max(1, atoi(argv[++i]));
+    } else if (arg == "--events" && has_value) {
+      options->events = strtoull(argv[++i], nullptr, 10);
+    } else if (arg == "--buffer-kb" && has_value) {
+      options->buffer_kb = static_cast<uint32_t>(strtoul(argv[++i], nullptr, 10));
+    } else if (arg == "--output-mode" && has_value) {
+      output->mode = argv[++i];
+      if (output->mode != "memory" && output->mode != "file" && output->mode != "stream") {
+        std::cerr << "unknown --output-mode: " << output->mode << " (expected memory, file or stream)" << std::endl;
+        return false;
+      }
+    } else if (arg == "--output" && has_value) {
+      output->path = argv[++i];
+    } else if (arg == "--file-write-period-ms" && has_value) {
+      output->file_write_period_ms = static_cast<uint32_t>(strtoul(argv[++i], nullptr, 10));
+    } else if (arg == "--max-file-size-bytes" && has_value) {
+      output->max_file_size_bytes = strtoull(argv[++i], nullptr, 10);
+    } else if (arg == "--mix" && has_value) {
+      options->mix.clear();
+      std::stringstream mix(argv[++i]);
+      std::string kind;
+      while (std::getline(mix, kind, ',')) {
+        if (kind != "static" && kind != "dynamic" && kind != "args" && kind != "counter") {
+          std::cerr << "unknown --mix kind: " << kind << " (expected static,dynamic,args,counter)" << std::endl;
+          return false;
+        }
+        options->mix.push_back(kind);
+      }
+      if (options->mix.empty()) {
+        std::cerr << "--mix is empty" << std::endl;
+        return false;
+      }
+    }
+  }
+  return true;
+}
+
 static void OnPerfettoLogMessage(perfetto::base::LogMessageCallbackArgs args) {
   // Perfetto levels start at 0, base's at -1.
   int severity = static_cast<int>(args.level) - 1;
@@ -153,8 +481,15 @@ static void OnPerfettoLogMessage(perfetto::base::LogMessageCallbackArgs args) {
 
 // see https://github.com/google/perfetto/tree/master/examples/sdk
 // see https://reviews.llvm.org/D82994?id=286866
-int main()
+int main(int argc, char** argv)
 {
+  bool stress = false;
+  StressOptions stress_options;
+  OutputOptions output_options;
+  if (!ParseOptions(argc, argv, &stress, &stress_options, &output_options)) {
+    return EXIT_FAILURE;
+  }
+
   perfetto::TracingInitArgs args;
 
   // The backends determine where trace events are recorded. You may select one
@@ -185,6 +520,10 @@ int main()
 
   perfetto::TrackEvent::Register();
 
+  if (stress) {
+    return RunStress(stress_options, output_options);
+  }
+
   perfetto::TraceConfig cfg;
   cfg.add_buffers()->set_size_kb(1024);
   auto* ds_cfg = cfg.add_data_sources()->mutable_config();
@@ -202,25 +541,12 @@ int main()
   std::unique_ptr<perfetto::TracingSession> tracing_session(
       perfetto::Tracing::NewTrace(perfetto::kInProcessBackend));
   
-  int memory_fd = -1;
-/*
-  const std::string fullpath = "memory.pftrace";
-#ifdef _WIN32
-  std::wstring_convert<std::codecvt_utf8_utf16<wchar_t>> converter;
-  std::wstring wpath = converter.from_bytes(fullpath);
-  memory_fd = _wopen(wpath.c_str(), O_RDWR | O_CREAT | O_TRUNC, S_IWRITE);
-#else
-  memory_fd = open(fullpath.c_str(), O_RDWR | O_CREAT | O_TRUNC, S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
-#endif
-  if (memory_fd == -1) {
-      return EXIT_FAILURE;
+  // To save memory with longer traces, use --output-mode file (Setup(cfg, fd))
+  // or --output-mode stream (chunked ReadTrace)
+  const int trace_fd = SetupTraceOutput(tracing_session.get(), cfg, output_options);
+  if (trace_fd == -2) {
+    return EXIT_FAILURE;
   }
-  // To save memory with longer traces, you can also tell Perfetto to write directly into a file
-  // NOTE: Passing a file descriptor to TracingSession::Setup() is only supported 
-  // with the kInProcessBackend on Windows. Use TracingSession::ReadTrace() instead
-  tracing_session->Setup(cfg, memory_fd);*/
-
-  tracing_session->Setup(cfg);
 
   tracing_session->StartBlocking();
 
@@ -281,17 +607,7 @@ int main()
   perfetto::TrackEvent::Flush();
   tracing_session->StopBlocking();
 
-  std::vector<char> trace_data(tracing_session->ReadTraceBlocking());
-  if (!trace_data.empty()) {
-    // Write the trace into a file.
-    std::ofstream output;
-    output.open("example3.pftrace", std::ios::out | std::ios::binary);
-    output.write(&trace_data[0], std::streamsize(trace_data.size()));
-    output.close();
-    if (memory_fd != -1) {
-      close(memory_fd);
-    }
-  }
+  FinishTrace(tracing_session.get(), output_options, trace_fd);
   
   return EXIT_SUCCESS;
 }